@@ -0,0 +1,320 @@
+"""
+Admission control for expensive endpoints and the readiness check
+
+Expensive requests are admitted per class up to a configured number in flight:
+
+- generation: onboarding and regenerate (blocking model calls)
+- bulk: bulk content endpoints, batch submission and exports
+
+Requests beyond the limit wait in a bounded FIFO queue. When the queue is full
+they are shed at once with 429, and when no slot frees up within
+ADMISSION_QUEUE_TIMEOUT_SECONDS they get 503. Both carry a Retry-After header,
+estimated from the class's recent request duration and queue depth. Every other
+endpoint is never queued. Until start() (after warmup) and from stop() on, while
+the instance drains, expensive requests are refused with 503 at once.
+
+Admitted generation requests run their blocking work on the generation thread
+pool (executors.run_generation), sized to the generation limit.
+
+readiness() reports MongoDB, OpenAI and n8n health and the queue depths. Only
+startup/shutdown, a dependency check that has not completed yet and a full
+generation queue make the instance not ready.
+Dependency outages are reported as degraded, because reads keep working
+without them.
+"""
+import asyncio
+import math
+import re
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Optional
+from fastapi.responses import JSONResponse
+from config import get_settings
+import database
+import metrics
+import storage
+
+# (class, method, path pattern) of the endpoints that go through admission
+ROUTES = (
+    ('generation', 'POST', re.compile(r'^/api/client/onboard$')),
+    ('generation', 'POST', re.compile(r'^/api/content/[^/]+/regenerate$')),
+    ('bulk', 'POST', re.compile(r'^/api/content/bulk/[^/]+$')),
+    ('bulk', 'POST', re.compile(r'^/api/batch$')),
+    ('bulk', 'GET', re.compile(r'^/api/export/[^/]+$')),
+)
+
+# Assumed request duration per class until one has been measured
+DEFAULT_DURATION_SECONDS = {'generation': 15.0, 'bulk': 5.0}
+DURATION_SMOOTHING = 0.2
+MAX_RETRY_AFTER_SECONDS = 120
+
+_accepting = False
+
+# Last dependency check and the one in progress, shared by concurrent probes
+_ready_result: Optional[Dict] = None
+_ready_checked_at = 0.0
+_ready_task: Optional[asyncio.Task] = None
+
+admission_stats = {
+    "ready_checks": 0,
+    "not_ready": 0,
+}
+
+
+class _Gate:
+    """In-flight counter with a bounded FIFO queue for one class of endpoints"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.avg_seconds = DEFAULT_DURATION_SECONDS[name]
+        self.stats = {"admitted": 0, "queued": 0, "shed": 0, "timed_out": 0, "not_accepting": 0}
+
+    def limit(self) -> int:
+        settings = get_settings()
+        return settings.admission_generation_limit if self.name == 'generation' else settings.admission_bulk_limit
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free: the queue ahead, drained limit at a time"""
+        rounds = (len(self.waiters) + 1) / max(self.limit(), 1)
+        return max(1, min(MAX_RETRY_AFTER_SECONDS, math.ceil(self.avg_seconds * rounds)))
+
+    async def acquire(self) -> Optional[int]:
+        """Take a slot; returns None once admitted, else the status code to reject with"""
+        settings = get_settings()
+        if self.in_flight < self.limit() and not self.waiters:
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            return None
+        if len(self.waiters) >= settings.admission_queue_size:
+            self.stats["shed"] += 1
+            return 429
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.stats["queued"] += 1
+        try:
+            await asyncio.wait({waiter}, timeout=settings.admission_queue_timeout_seconds)
+        except asyncio.CancelledError:
+            # Client went away while queued; pass on a slot that was already handed over
+            if waiter.done():
+                self.release()
+            else:
+                self.waiters.remove(waiter)
+            raise
+        if waiter.done():
+            # release() handed its slot over, in_flight already counts this request
+            self.stats["admitted"] += 1
+            return None
+        self.waiters.remove(waiter)
+        self.stats["timed_out"] += 1
+        return 503
+
+    def release(self) -> None:
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def observe(self, seconds: float) -> None:
+        self.avg_seconds += DURATION_SMOOTHING * (seconds - self.avg_seconds)
+
+    def snapshot(self) -> Dict:
+        return {
+            **self.stats,
+            "in_flight": self.in_flight,
+            "waiting": len(self.waiters),
+            "limit": self.limit(),
+            "avg_seconds": round(self.avg_seconds, 3),
+            "retry_after": self.retry_after(),
+        }
+
+
+_gates: Dict[str, _Gate] = {name: _Gate(name) for name in DEFAULT_DURATION_SECONDS}
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """Admission class of a request, None for endpoints that are always admitted"""
+    for name, route_method, pattern in ROUTES:
+        if method == route_method and pattern.match(path):
+            return name
+    return None
+
+
+class AdmissionMiddleware:
+    """ASGI middleware queueing or shedding expensive requests above their in-flight limit"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        name = classify(scope.get("method", ''), scope.get("path", '')) if scope["type"] == "http" else None
+        gate = _gates.get(name)
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+        if not _accepting:
+            gate.stats["not_accepting"] += 1
+            rejected = 503
+        elif gate.limit() <= 0:
+            await self.app(scope, receive, send)
+            return
+        else:
+            rejected = await gate.acquire()
+        if rejected is not None:
+            retry_after = gate.retry_after()
+            if not _accepting:
+                message = "Server is starting or shutting down"
+            elif rejected == 429:
+                message = "Too many requests queued"
+            else:
+                message = "Server busy, no capacity freed up in time"
+            response = JSONResponse(
+                status_code=rejected,
+                content={"success": False, "message": f"{message}, retry in {retry_after}s", "retry_after": retry_after},
+                headers={"Retry-After": str(retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            # Held until the response body is sent, so streamed exports count while they stream
+            await self.app(scope, receive, send)
+        finally:
+            gate.observe(time.perf_counter() - started)
+            gate.release()
+
+
+# ---------------------------------------------------------------------------
+# Readiness
+# ---------------------------------------------------------------------------
+
+async def _check_mongo() -> Dict:
+    if not storage.is_mongo_available():
+        # Requests are served from memory and writes journaled until MongoDB is back
+        return {"status": "down", "storage_mode": "memory", "journal_pending": storage.journal_pending()}
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(database.client.admin.command('ping'), get_settings().ready_check_timeout_seconds)
+    except Exception as e:
+        return {"status": "down", "storage_mode": "mongo", "error": str(e) or type(e).__name__}
+    return {"status": "ok", "storage_mode": "mongo", "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+def _check_openai() -> Dict:
+    settings = get_settings()
+    if not settings.openai_configured:
+        return {"status": "not_configured"}
+    from openai import APIConnectionError, APIStatusError
+    from services import get_openai_client
+
+    started = time.perf_counter()
+    try:
+        get_openai_client().with_options(timeout=settings.ready_check_timeout_seconds, max_retries=0).models.list()
+    except APIConnectionError as e:
+        return {"status": "down", "error": str(e)}
+    except APIStatusError as e:
+        # Any HTTP answer means the API is reachable; a rejected key still breaks generation
+        if e.status_code in (401, 403):
+            return {"status": "down", "error": f"HTTP {e.status_code}: API key rejected"}
+        if e.status_code >= 500:
+            return {"status": "down", "error": f"HTTP {e.status_code}"}
+    except Exception as e:
+        return {"status": "down", "error": str(e)}
+    return {"status": "ok", "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+def _check_n8n() -> Dict:
+    import requests
+
+    settings = get_settings()
+    started = time.perf_counter()
+    try:
+        # Webhook URLs only accept their own method, so any answer below 500 counts as reachable
+        response = requests.get(settings.n8n_webhook_url, timeout=settings.ready_check_timeout_seconds)
+    except Exception as e:
+        return {"status": "down", "error": str(e)}
+    if response.status_code >= 500:
+        return {"status": "down", "error": f"HTTP {response.status_code}"}
+    return {"status": "ok", "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+async def _check_dependencies() -> Dict:
+    mongo, openai_check, n8n = await asyncio.gather(
+        _check_mongo(),
+        asyncio.to_thread(_check_openai),
+        asyncio.to_thread(_check_n8n)
+    )
+    return {"mongo": mongo, "openai": openai_check, "n8n": n8n}
+
+
+def _store_ready_result(task: asyncio.Task) -> None:
+    global _ready_result, _ready_checked_at, _ready_task
+    _ready_task = None
+    if not task.cancelled() and task.exception() is None:
+        _ready_result = task.result()
+        _ready_checked_at = time.monotonic()
+
+
+async def readiness() -> Dict:
+    """Dependency health and queue depths; 'ready' is False while starting, stopping or saturated"""
+    global _ready_task
+    admission_stats["ready_checks"] += 1
+    # Probes arrive every few seconds from every load balancer, so external checks are cached
+    if _ready_result is None or time.monotonic() - _ready_checked_at >= get_settings().ready_cache_seconds:
+        if _ready_task is None:
+            _ready_task = asyncio.create_task(_check_dependencies())
+            _ready_task.add_done_callback(_store_ready_result)
+        # A probe that disconnects does not cancel the check the others are waiting for
+        try:
+            await asyncio.shield(_ready_task)
+        except Exception as e:
+            print(f"Warning: Readiness check failed: {str(e)}")
+
+    queues = {name: gate.snapshot() for name, gate in _gates.items()}
+    generation = _gates['generation']
+    saturated = generation.limit() > 0 and len(generation.waiters) >= get_settings().admission_queue_size
+    # No dependency check has completed yet
+    probed = _ready_result is not None
+    ready = _accepting and not saturated and probed
+    if not ready:
+        admission_stats["not_ready"] += 1
+    if not _accepting:
+        reason = "not_accepting"
+    elif not probed:
+        reason = "not_probed_yet"
+    else:
+        reason = "saturated" if saturated else None
+    degraded = [name for name, check in (_ready_result or {}).items() if check["status"] == 'down']
+    return {
+        "ready": ready,
+        "status": "not_ready" if not ready else ("degraded" if degraded else "ok"),
+        "reason": reason,
+        "timestamp": datetime.now().isoformat(),
+        "checked_at_age_seconds": round(time.monotonic() - _ready_checked_at, 1) if probed else None,
+        "dependencies": _ready_result,
+        "queues": queues,
+    }
+
+
+async def start() -> None:
+    global _accepting
+    _accepting = True
+
+
+async def stop() -> None:
+    global _accepting
+    _accepting = False
+
+
+def get_admission_metrics() -> Dict:
+    return {
+        **admission_stats,
+        "accepting": _accepting,
+        "queues": {name: gate.snapshot() for name, gate in _gates.items()},
+    }
+
+metrics.register("admission", get_admission_metrics)
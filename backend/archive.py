@@ -0,0 +1,305 @@
+"""
+Background archival and deletion of clients
+
+Archiving or deleting a client removes the client, its content and its
+campaigns from the live collections. The work runs as a background job, one
+job at a time, in batches of ARCHIVE_BATCH_SIZE documents with a pause between
+batches, so a client with thousands of content items does not hold up
+foreground requests.
+
+- archive: documents are copied to cold '<collection>_archive' collections in
+  MongoDB (ARCHIVE_TARGET=mongo) or appended to a gzipped JSON lines file in
+  ARCHIVE_DIR (ARCHIVE_TARGET=files, also used while MongoDB is unavailable)
+  before they are removed; the client's uploaded images move to ARCHIVE_DIR
+- delete: documents and uploaded images are removed
+
+Each batch is archived before it is deleted, and clients are marked
+'archiving'/'deleting' first, so a job interrupted by a restart is resumed on
+startup. Every job ends with a sweep of upload files no client refers to.
+"""
+import asyncio
+import gzip
+import json
+import shutil
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from config import get_settings
+import cache
+import database
+import metrics
+import storage
+
+# Directory main.py saves onboarding uploads to
+UPLOAD_DIR = Path("uploads/images")
+
+# Live collections holding a client's documents, removed in this order (the client last)
+RELATED_COLLECTIONS = ('content', 'campaigns')
+
+MODES = {'archive': 'archiving', 'delete': 'deleting'}
+
+database.INDEXES.append(('content', [('client_id', 1)], {}))
+database.INDEXES.append(('campaigns', [('client_id', 1)], {}))
+
+# job id -> job status, most recent last (finished jobs beyond the history size are dropped)
+_jobs: Dict[str, Dict] = {}
+_JOB_HISTORY = 100
+
+_queue: Optional[asyncio.Queue] = None
+_worker_task: Optional[asyncio.Task] = None
+
+archive_stats = {
+    "jobs_completed": 0,
+    "jobs_failed": 0,
+    "documents_archived": 0,
+    "documents_deleted": 0,
+    "uploads_removed": 0,
+    "batches": 0,
+    "throttle_seconds_total": 0.0,
+}
+
+
+def _new_job(client_id: str, mode: str) -> Dict:
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "client_id": client_id,
+        "mode": mode,
+        "state": "queued",
+        "target": None,
+        "counts": {name: 0 for name in (*RELATED_COLLECTIONS, 'clients')},
+        "uploads_removed": 0,
+        "created_at": datetime.now().isoformat(),
+        "started_at": None,
+        "finished_at": None,
+        "error": None,
+    }
+    _jobs[job["job_id"]] = job
+    finished = [key for key, other in _jobs.items() if other["state"] in ('completed', 'failed')]
+    for key in finished[:max(0, len(_jobs) - _JOB_HISTORY)]:
+        del _jobs[key]
+    return job
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    job = _jobs.get(job_id)
+    return dict(job) if job is not None else None
+
+
+def _active_job(client_id: str) -> Optional[Dict]:
+    for job in _jobs.values():
+        if job["client_id"] == client_id and job["state"] in ('queued', 'running'):
+            return job
+    return None
+
+
+async def submit(client: Dict, mode: str) -> Dict:
+    """Mark the client and queue an archive or delete job for it (the running job if there is one)"""
+    client_id = client['client_id']
+    job = _active_job(client_id)
+    if job is not None:
+        return dict(job)
+    await storage.update_one('clients', {"client_id": client_id}, {
+        "status": MODES[mode],
+        "updated_at": datetime.now().isoformat()
+    })
+    cache.invalidate_client(client_id)
+    job = _new_job(client_id, mode)
+    _queue.put_nowait(job["job_id"])
+    return dict(job)
+
+
+# ---------------------------------------------------------------------------
+# Archive targets
+# ---------------------------------------------------------------------------
+
+def _archive_file(job: Dict) -> Path:
+    return Path(get_settings().archive_dir) / f"{job['client_id']}-{job['job_id'][:8]}.jsonl.gz"
+
+
+def _append_to_file(path: Path, name: str, documents: List[Dict]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Each batch is a separate gzip member; readers decompress the concatenation transparently
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        f.write(''.join(json.dumps({"collection": name, "document": document}, default=str) + '\n' for document in documents))
+
+
+async def _archive_batch(job: Dict, name: str, documents: List[Dict]) -> None:
+    if get_settings().archive_target == 'mongo' and storage.collection(name) is not None:
+        from pymongo import ReplaceOne
+
+        key_field = storage.KEY_FIELDS[name]
+        try:
+            # Upserts by key, so re-archiving a batch after an interrupted job does not duplicate it
+            await database.get_collection(f"{name}_archive").bulk_write([
+                ReplaceOne({key_field: document[key_field]}, storage._strip_id(document), upsert=True)
+                for document in documents
+            ], ordered=False)
+            job["target"] = job["target"] or "archive collections"
+            return
+        except Exception as e:
+            storage.fail_over(e)
+    path = _archive_file(job)
+    await asyncio.to_thread(_append_to_file, path, name, [storage._strip_id(document) for document in documents])
+    job["target"] = str(path)
+
+
+# ---------------------------------------------------------------------------
+# Job execution
+# ---------------------------------------------------------------------------
+
+async def _throttle() -> None:
+    pause = get_settings().archive_batch_pause_seconds
+    if pause > 0:
+        archive_stats["throttle_seconds_total"] += pause
+        await asyncio.sleep(pause)
+
+
+async def _drain(job: Dict, name: str, query: Dict) -> None:
+    """Archive (when archiving) and delete the documents matching query, a batch at a time"""
+    key_field = storage.KEY_FIELDS[name]
+    batch_size = get_settings().archive_batch_size
+    while True:
+        documents = await storage.find(name, query, limit=batch_size)
+        if not documents:
+            return
+        if job["mode"] == 'archive':
+            archived_at = datetime.now().isoformat()
+            for document in documents:
+                document["archived_at"] = archived_at
+                if name == 'clients':
+                    document["status"] = "archived"
+            await _archive_batch(job, name, documents)
+            archive_stats["documents_archived"] += len(documents)
+        deleted = await storage.delete_many(name, {key_field: {"$in": [document[key_field] for document in documents]}})
+        job["counts"][name] += len(deleted)
+        archive_stats["documents_deleted"] += len(deleted)
+        archive_stats["batches"] += 1
+        await _throttle()
+
+
+def _client_uploads(client: Optional[Dict]) -> List[Path]:
+    files = []
+    for image in (client or {}).get('images') or []:
+        stored = image.get('stored_filename')
+        if not stored:
+            continue
+        if (UPLOAD_DIR / stored).is_file():
+            files.append(UPLOAD_DIR / stored)
+    return files
+
+
+def _move_or_remove(files: List[Path], mode: str) -> int:
+    archive_dir = Path(get_settings().archive_dir) / 'uploads'
+    for path in files:
+        if mode == 'archive':
+            archive_dir.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(path), str(archive_dir / path.name))
+        else:
+            path.unlink(missing_ok=True)
+    return len(files)
+
+
+async def _referenced_uploads() -> set:
+    referenced = set()
+    for client in await storage.find('clients', {}, limit=100000):
+        for image in client.get('images') or []:
+            if image.get('stored_filename'):
+                referenced.add(image['stored_filename'])
+    return referenced
+
+
+def _remove_unreferenced(referenced: set) -> int:
+    # Files younger than the grace period may belong to an onboarding request still in progress
+    cutoff = time.time() - get_settings().archive_upload_grace_seconds
+    removed = 0
+    if not UPLOAD_DIR.is_dir():
+        return removed
+    for path in UPLOAD_DIR.iterdir():
+        if path.is_file() and path.name not in referenced and path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+async def collect_orphaned_uploads() -> int:
+    """Delete upload files that no client refers to; returns the number removed"""
+    removed = await asyncio.to_thread(_remove_unreferenced, await _referenced_uploads())
+    archive_stats["uploads_removed"] += removed
+    return removed
+
+
+async def _run(job: Dict) -> None:
+    client_id = job["client_id"]
+    job["state"] = "running"
+    job["started_at"] = datetime.now().isoformat()
+    for name in RELATED_COLLECTIONS:
+        await _drain(job, name, {"client_id": client_id})
+
+    client = await storage.find_one('clients', {"client_id": client_id})
+    uploads = _client_uploads(client)
+    await _drain(job, 'clients', {"client_id": client_id})
+    cache.invalidate_client(client_id)
+    moved = await asyncio.to_thread(_move_or_remove, uploads, job["mode"])
+    archive_stats["uploads_removed"] += moved
+    job["uploads_removed"] = moved + await collect_orphaned_uploads()
+
+
+async def _worker() -> None:
+    while True:
+        job = _jobs.get(await _queue.get())
+        if job is None:
+            continue
+        try:
+            await _run(job)
+            job["state"] = "completed"
+            archive_stats["jobs_completed"] += 1
+            print(f"✅ Client {job['client_id']} {job['mode']}d: {job['counts']}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job["state"] = "failed"
+            job["error"] = str(e)
+            archive_stats["jobs_failed"] += 1
+            print(f"Warning: Client {job['mode']} job {job['job_id']} failed: {str(e)}")
+        finally:
+            if job["state"] != "running":
+                job["finished_at"] = datetime.now().isoformat()
+
+
+async def _resume_interrupted() -> None:
+    """Requeue jobs for clients left 'archiving' or 'deleting' by a restart"""
+    for mode, status in MODES.items():
+        for client in await storage.find('clients', {"status": status}):
+            if _active_job(client['client_id']) is None:
+                _queue.put_nowait(_new_job(client['client_id'], mode)["job_id"])
+
+
+async def start() -> None:
+    global _queue, _worker_task
+    _queue = asyncio.Queue()
+    try:
+        await _resume_interrupted()
+    except Exception as e:
+        print(f"Warning: Could not resume client archive jobs: {str(e)}")
+    _worker_task = asyncio.create_task(_worker())
+
+
+async def stop() -> None:
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        _worker_task = None
+
+
+def get_archive_metrics() -> Dict:
+    return {
+        **archive_stats,
+        "throttle_seconds_total": round(archive_stats["throttle_seconds_total"], 3),
+        "target": get_settings().archive_target,
+        "jobs_queued": sum(1 for job in _jobs.values() if job["state"] == 'queued'),
+        "jobs_running": sum(1 for job in _jobs.values() if job["state"] == 'running'),
+    }
+
+metrics.register("archive", get_archive_metrics)
@@ -0,0 +1,183 @@
+"""
+Static serving of uploaded files
+
+Replaces a plain StaticFiles mount for /uploads:
+- Files with content-addressed names (uuid or hex digest, never rewritten
+  in place) are served with 'Cache-Control: public, max-age=31536000, immutable';
+  other files get STATIC_MAX_AGE_SECONDS
+- Single byte ranges (Range: bytes=...) are answered with 206, so video players
+  can seek, and If-None-Match / If-Modified-Since with 304
+- File reads happen in worker threads, a chunk at a time
+"""
+import asyncio
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from starlette.routing import get_route_path
+from config import get_settings
+import metrics
+
+CHUNK_SIZE = 64 * 1024
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# uuid4 file names written by onboarding, or hex content digests
+_CONTENT_ADDRESSED_RE = re.compile(r'^(?:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{32,64})\.[A-Za-z0-9]+$')
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+static_stats = {
+    "requests": 0,
+    "not_found": 0,
+    "not_modified": 0,
+    "partial": 0,
+    "range_not_satisfiable": 0,
+    "bytes_sent": 0,
+}
+
+
+def _etag(stat: os.stat_result) -> str:
+    """Strong ETag of the file"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive for a single 'bytes=' range; raises ValueError when unsatisfiable"""
+    match = _RANGE_RE.match(header.strip())
+    if match is None:
+        # Multiple or malformed ranges: serve the whole file
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class StaticAssets:
+    """ASGI app serving files below directory"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory).resolve()
+
+    def _resolve(self, path: str) -> Optional[Path]:
+        candidate = (self.directory / path.lstrip('/')).resolve()
+        if self.directory not in candidate.parents or not candidate.is_file():
+            return None
+        return candidate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        static_stats["requests"] += 1
+        method = scope["method"]
+        if method not in ('GET', 'HEAD'):
+            await self._respond(send, 405, [(b'allow', b'GET, HEAD')], b'Method Not Allowed')
+            return
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope["headers"]}
+        path = self._resolve(get_route_path(scope))
+        if path is None:
+            static_stats["not_found"] += 1
+            await self._respond(send, 404, [], b'Not Found')
+            return
+
+        stat = await asyncio.to_thread(path.stat)
+        settings = get_settings()
+        cache_control = (
+            IMMUTABLE_CACHE_CONTROL if _CONTENT_ADDRESSED_RE.match(path.name)
+            else f'public, max-age={settings.static_max_age_seconds}'
+        )
+        content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        etag = _etag(stat)
+        size = stat.st_size
+        range_header = headers.get('range')
+        if range_header and headers.get('if-range') not in (None, etag):
+            range_header = None
+
+        response_headers = [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'etag', etag.encode('latin-1')),
+            (b'last-modified', formatdate(stat.st_mtime, usegmt=True).encode('latin-1')),
+            (b'cache-control', cache_control.encode('latin-1')),
+            (b'accept-ranges', b'bytes'),
+        ]
+
+        if self._not_modified(headers, etag, stat.st_mtime):
+            static_stats["not_modified"] += 1
+            await self._respond(send, 304, response_headers, b'')
+            return
+
+        status, start, end = 200, 0, size - 1
+        if range_header:
+            try:
+                byte_range = _parse_range(range_header, size)
+            except ValueError:
+                static_stats["range_not_satisfiable"] += 1
+                await self._respond(send, 416, [(b'content-range', f'bytes */{size}'.encode())], b'')
+                return
+            if byte_range is not None:
+                status, (start, end) = 206, byte_range
+                static_stats["partial"] += 1
+                response_headers.append((b'content-range', f'bytes {start}-{end}/{size}'.encode()))
+
+        length = max(0, end - start + 1)
+        response_headers.append((b'content-length', str(length).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": response_headers})
+        if method == 'HEAD' or length == 0:
+            await send({"type": "http.response.body", "body": b''})
+            return
+        await self._send_file(send, path, start, length)
+
+    @staticmethod
+    def _not_modified(headers: Dict[str, str], etag: str, mtime: float) -> bool:
+        if_none_match = headers.get('if-none-match')
+        if if_none_match:
+            return if_none_match.strip() == '*' or etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        if_modified_since = headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    async def _send_file(send, path: Path, start: int, length: int) -> None:
+        with open(path, 'rb') as f:
+            await asyncio.to_thread(f.seek, start)
+            remaining = length
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                static_stats["bytes_sent"] += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # The file shrank while it was being sent
+            await send({"type": "http.response.body", "body": b''})
+
+    @staticmethod
+    async def _respond(send, status: int, headers, body: bytes) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": headers + [(b'content-length', str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def get_static_metrics() -> Dict:
+    return dict(static_stats)
+
+metrics.register("static", get_static_metrics)
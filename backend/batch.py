@@ -0,0 +1,651 @@
+"""
+Offline batch generation through the OpenAI Batch API
+
+Large runs (e.g. refreshing every client's content for a new quarter) do not go
+through the synchronous generation path. Requests are written to JSON lines
+files from the same prompts generate_content and regenerate_content use,
+uploaded and submitted as batch jobs (billed at half price, outside the
+synchronous rate limits), polled every BATCH_POLL_INTERVAL_SECONDS and, once
+finished, written into the content collection in bulk:
+
+- generate: one new pending content item per client and primary channel
+- regenerate: each pending content item of the clients is rewritten in place
+  (items approved or edited since submission are left alone)
+
+Runs with more than BATCH_MAX_REQUESTS requests are split into several batches
+(parts). Jobs are kept in the 'batches' collection, so polling resumes after a
+restart. A worker building, polling or applying a job holds a per-job lease
+(renewed while it works), so jobs are only recovered from workers that died
+and two workers never apply the same job. Results get the local platform limit check (truncation) and the
+near-duplicate flag, but no model escalation or shorten retry, which would be
+synchronous calls.
+
+Point OPENAI_BASE_URL at batch_stub.py to run the whole flow locally.
+"""
+import asyncio
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from config import get_settings
+import database
+import dedup
+import metrics
+import routing
+import storage
+import usage
+import validation
+
+MODES = ('generate', 'regenerate')
+
+ENDPOINT = '/v1/chat/completions'
+
+# OpenAI batch statuses after which a batch no longer changes
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+# Clients in these states are not generated for
+INACTIVE_CLIENT_STATUSES = ('archiving', 'deleting', 'archived')
+
+# Input files are limited to 200 MB by the Batch API
+MAX_FILE_BYTES = 190 * 1024 * 1024
+
+# Request lines buffered before they are appended to the input file, and
+# result lines written to the content collection at a time
+WRITE_CHUNK_SIZE = 500
+
+database.INDEXES.append(('batches', [('status', 1)], {}))
+database.INDEXES.append(('content', [('batch_id', 1)], {"sparse": True}))
+
+# Held by the worker building, polling or applying a job; renewed every third of it
+JOB_LEASE_SECONDS = 120
+
+_poll_task: Optional[asyncio.Task] = None
+# Jobs being built and submitted in the background
+_build_tasks: set = set()
+
+batch_stats = {
+    "jobs_submitted": 0,
+    "jobs_completed": 0,
+    "jobs_failed": 0,
+    "requests_submitted": 0,
+    "results_succeeded": 0,
+    "results_failed": 0,
+    "results_skipped": 0,
+    "documents_written": 0,
+    "polls": 0,
+    "jobs_resumed": 0,
+}
+
+
+def _client():
+    # Imported here so the OpenAI SDK is only loaded once batch mode is used
+    from services import get_openai_client
+    return get_openai_client()
+
+
+def _summary(job: Dict) -> Dict:
+    return {key: value for key, value in job.items() if key != '_id'}
+
+
+async def _save(job: Dict, **fields) -> None:
+    job.update(fields, updated_at=datetime.now().isoformat())
+    await storage.update_one('batches', {"id": job["id"]}, {
+        key: value for key, value in job.items() if key not in ('id', '_id')
+    })
+
+
+def _lease_name(job_id: str) -> str:
+    return f"batches.{job_id}"
+
+
+async def _renew_lease(job_id: str, token: str) -> None:
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            if not await storage.renew_lease(_lease_name(job_id), token, JOB_LEASE_SECONDS):
+                print(f"Warning: Batch job {job_id} lease expired while it was being processed")
+        except Exception as e:
+            print(f"Warning: Could not renew the lease of batch job {job_id}: {str(e)}")
+
+
+@asynccontextmanager
+async def _holding(job_id: str, token: str):
+    """Keep renewing a job lease this worker took for the block, then release it"""
+    renewal = asyncio.create_task(_renew_lease(job_id, token))
+    try:
+        yield
+    finally:
+        renewal.cancel()
+        await storage.release_lease(_lease_name(job_id), token)
+
+
+async def get_job(job_id: str) -> Optional[Dict]:
+    job = await storage.find_one('batches', {"id": job_id})
+    return _summary(job) if job is not None else None
+
+
+async def list_jobs(limit: int = 50) -> List[Dict]:
+    jobs = await storage.find('batches', {}, limit=10000, read_only=True)
+    jobs.sort(key=lambda job: job.get('created_at') or '', reverse=True)
+    return [_summary(job) for job in jobs[:limit]]
+
+
+# ---------------------------------------------------------------------------
+# Building and submitting
+# ---------------------------------------------------------------------------
+
+def _request_line(custom_id: str, platform: str, content_type: str, messages: List[Dict], temperature: float) -> str:
+    route = routing.select_route(platform, content_type)
+    return json.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": ENDPOINT,
+        "body": {
+            "model": route["model"],
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": route["max_tokens"],
+        },
+    }) + '\n'
+
+
+async def _target_clients(client_ids: Optional[List[str]], skipped: List[Dict]) -> List[Dict]:
+    query = {"client_id": {"$in": client_ids}} if client_ids else {}
+    clients = await storage.find('clients', query, limit=100000)
+    if client_ids:
+        found = {client['client_id'] for client in clients}
+        skipped.extend({"client_id": client_id, "reason": "not found"} for client_id in client_ids if client_id not in found)
+    active = []
+    for client in clients:
+        if client.get('status') in INACTIVE_CLIENT_STATUSES:
+            if client_ids:
+                skipped.append({"client_id": client['client_id'], "reason": client['status']})
+            continue
+        over_budget = await usage.check_budget(client)
+        if over_budget is not None:
+            skipped.append({"client_id": client['client_id'], "reason": "monthly budget exceeded"})
+            continue
+        active.append(client)
+    return active
+
+
+async def _request_lines(job: Dict, clients: List[Dict]):
+    """The JSON line of every request of the job"""
+    import services
+
+    platforms = set(job.get('platforms') or [])
+    if job["mode"] == 'generate':
+        for client in clients:
+            seen = set()
+            for platform, content_type in services.client_platforms(client):
+                if platform in seen or (platforms and platform not in platforms):
+                    continue
+                seen.add(platform)
+                custom_id = f"generate:{client['client_id']}:{platform}"
+                messages = services.build_generation_messages(client, platform, content_type, job.get('topic'))
+                yield _request_line(custom_id, platform, content_type, messages, services.GENERATE_TEMPERATURE)
+        return
+
+    by_id = {client['client_id']: client for client in clients}
+    query: Dict = {"status": "pending", "client_id": {"$in": list(by_id)}}
+    if platforms:
+        query["platform"] = {"$in": list(platforms)}
+    for item in await storage.find('content', query, limit=100000):
+        client = by_id[item['client_id']]
+        custom_id = f"regenerate:{item['id']}"
+        messages = services.build_regeneration_messages(
+            client, item.get('platform'), item.get('content_type'), item.get('content', ''), job.get('improvement_focus')
+        )
+        yield _request_line(custom_id, item.get('platform'), item.get('content_type'), messages, services.REGENERATE_TEMPERATURE)
+
+
+def _append_lines(path: Path, lines: List[str]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(''.join(lines))
+
+
+async def _write_input_files(job: Dict, clients: List[Dict]) -> List[Dict]:
+    """Write the request lines into one input file per part"""
+    settings = get_settings()
+    parts: List[Dict] = []
+    pending: List[str] = []
+    part = None
+    async for line in _request_lines(job, clients):
+        size = len(line.encode('utf-8'))
+        if part is None or part["request_count"] >= settings.batch_max_requests or part["bytes"] + size > MAX_FILE_BYTES:
+            if pending:
+                await asyncio.to_thread(_append_lines, Path(part["input_path"]), pending)
+                pending = []
+            part = {
+                "index": len(parts),
+                "input_path": str(Path(settings.batch_dir) / f"{job['id']}-{len(parts)}.input.jsonl"),
+                "request_count": 0,
+                "bytes": 0,
+                "batch_id": None,
+                "input_file_id": None,
+                "status": None,
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": None,
+                "errors": [],
+                "applied": False,
+            }
+            parts.append(part)
+        pending.append(line)
+        part["request_count"] += 1
+        part["bytes"] += size
+        if len(pending) >= WRITE_CHUNK_SIZE:
+            await asyncio.to_thread(_append_lines, Path(part["input_path"]), pending)
+            pending = []
+    if pending:
+        await asyncio.to_thread(_append_lines, Path(part["input_path"]), pending)
+    return parts
+
+
+def _upload_and_create(part: Dict, job_id: str) -> Tuple[str, object]:
+    client = _client()
+    with open(part["input_path"], 'rb') as f:
+        uploaded = client.files.create(file=f, purpose='batch')
+    created = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=ENDPOINT,
+        completion_window=get_settings().batch_completion_window,
+        metadata={"job_id": job_id, "part": str(part["index"])}
+    )
+    return uploaded.id, created
+
+
+async def _build_and_submit(job: Dict, client_ids: Optional[List[str]], token: str) -> None:
+    async with _holding(job["id"], token):
+        await _build_parts(job, client_ids)
+
+
+async def _build_parts(job: Dict, client_ids: Optional[List[str]]) -> None:
+    submitted: List[Dict] = []
+    try:
+        skipped: List[Dict] = []
+        clients = await _target_clients(client_ids, skipped)
+        parts = await _write_input_files(job, clients)
+        job["skipped"] = skipped
+        if not parts:
+            await _save(job, status="completed", parts=[], request_count=0, completed_at=datetime.now().isoformat())
+            return
+        for part in parts:
+            part["input_file_id"], created = await asyncio.to_thread(_upload_and_create, part, job["id"])
+            part["batch_id"] = created.id
+            part["status"] = created.status
+            submitted.append(part)
+            batch_stats["requests_submitted"] += part["request_count"]
+            # Stored right away, so a batch that was created is never lost to a later failure
+            await _save(job, parts=submitted, request_count=sum(part["request_count"] for part in submitted))
+        batch_stats["jobs_submitted"] += 1
+        await _save(job, status="submitted", submitted_at=datetime.now().isoformat())
+        print(f"✅ Batch job {job['id']} submitted: {job['request_count']} requests in {len(parts)} batch(es)")
+    except Exception as e:
+        print(f"Warning: Batch job {job['id']} could not be submitted: {str(e)}")
+        if not submitted:
+            batch_stats["jobs_failed"] += 1
+            await _save(job, status="failed", error=str(e))
+            return
+        # The parts that went out are still polled and applied
+        batch_stats["jobs_submitted"] += 1
+        await _save(
+            job,
+            status="submitted",
+            submitted_at=datetime.now().isoformat(),
+            error=f"Only {len(submitted)} of {len(parts)} batches were submitted: {str(e)}"
+        )
+
+
+async def submit(
+    mode: str,
+    client_ids: Optional[List[str]] = None,
+    topic: Optional[str] = None,
+    improvement_focus: Optional[str] = None,
+    platforms: Optional[List[str]] = None
+) -> Dict:
+    """Record a batch job and build and submit it in the background (client_ids None: every active client)"""
+    job = {
+        "id": str(uuid.uuid4()),
+        "mode": mode,
+        "status": "building",
+        "client_ids": client_ids,
+        "topic": topic,
+        "improvement_focus": improvement_focus,
+        "platforms": platforms,
+        "request_count": 0,
+        "parts": [],
+        "skipped": [],
+        "counts": {"succeeded": 0, "failed": 0, "skipped": 0, "written": 0},
+        "cancel_requested": False,
+        "error": None,
+        "created_at": datetime.now().isoformat(),
+        "submitted_at": None,
+        "completed_at": None,
+        "updated_at": None,
+    }
+    # Taken before the job is stored, so no other worker's recovery sees it building without a lease
+    token = await storage.acquire_lease(_lease_name(job["id"]), JOB_LEASE_SECONDS)
+    await storage.insert_one('batches', dict(job))
+    task = asyncio.create_task(_build_and_submit(job, client_ids, token))
+    _build_tasks.add(task)
+    task.add_done_callback(_build_tasks.discard)
+    return _summary(job)
+
+
+async def cancel(job_id: str) -> Optional[Dict]:
+    """Ask OpenAI to cancel the job's unfinished batches; results finished so far are still applied"""
+    job = await storage.find_one('batches', {"id": job_id})
+    if job is None:
+        return None
+    if job["status"] != 'submitted':
+        return _summary(job)
+    client = _client()
+    for part in job["parts"]:
+        if part["status"] not in FINAL_STATUSES:
+            cancelled = await asyncio.to_thread(client.batches.cancel, part["batch_id"])
+            part["status"] = cancelled.status
+    await _save(job, cancel_requested=True)
+    return _summary(job)
+
+
+# ---------------------------------------------------------------------------
+# Results
+# ---------------------------------------------------------------------------
+
+def _download(file_id: str, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _client().files.with_streaming_response.content(file_id) as response:
+        response.stream_to_file(path)
+
+
+def _read_lines(f, count: int) -> List[Dict]:
+    results = []
+    for line in f:
+        if line.strip():
+            results.append(json.loads(line))
+            if len(results) >= count:
+                break
+    return results
+
+
+def _finish_text(body: Dict, platform: str, content_type: str, client_id: Optional[str], exclude: Optional[str] = None) -> Tuple[str, List[Dict]]:
+    """Record the completion in the usage ledger, enforce the platform limits locally and flag near-duplicates"""
+    route = routing.select_route(platform, content_type)
+    body_usage = body.get('usage') or {}
+    entry = usage.record(
+        model=body.get('model') or route["model"],
+        latency=0.0,
+        platform=platform,
+        client_id=client_id,
+        prompt_tokens=body_usage.get('prompt_tokens', 0) or 0,
+        completion_tokens=body_usage.get('completion_tokens', 0) or 0,
+        route=route["name"],
+        batch=True
+    )
+    routing.record_call(route, entry)
+    text = (body["choices"][0]["message"].get("content") or '').strip()
+    if get_settings().validation_mode != 'off' and validation.validate(platform, text):
+        text = validation.truncate(platform, text)
+    return text, dedup.find_near_duplicates(text, exclude=exclude)
+
+
+def _generated_documents(job: Dict, results: List[Tuple[str, Dict]], clients: Dict[str, Dict]) -> Tuple[List[Dict], int]:
+    import services
+
+    now = datetime.now().isoformat()
+    documents, skipped = [], 0
+    for custom_id, body in results:
+        _, client_id, platform = custom_id.split(':', 2)
+        client = clients.get(client_id)
+        if client is None or client.get('status') in INACTIVE_CLIENT_STATUSES:
+            skipped += 1
+            continue
+        content_type = services.CONTENT_TYPES.get(platform, 'post')
+        text, duplicates = _finish_text(body, platform, content_type, client_id)
+        document = {
+            # Derived from the request, so applying the same results again writes nothing new
+            'id': str(uuid.uuid5(uuid.NAMESPACE_URL, f"batch:{job['id']}:{custom_id}")),
+            'platform': platform,
+            'content_type': content_type,
+            'content': text,
+            'client_id': client_id,
+            'client_name': client.get('company_name'),
+            'status': 'pending',
+            'created_at': now,
+            'batch_id': job["id"],
+        }
+        if duplicates:
+            document['near_duplicate_of'] = duplicates
+        uploaded_image_urls = [image.get('url') for image in client.get('images') or [] if image.get('url')]
+        if uploaded_image_urls:
+            document['uploaded_images'] = uploaded_image_urls
+            document['has_uploaded_images'] = True
+        documents.append(document)
+    return documents, skipped
+
+
+def _regenerated_updates(job: Dict, results: List[Tuple[str, Dict]], items: Dict[str, Dict]) -> Tuple[Dict[str, Dict], int]:
+    now = datetime.now().isoformat()
+    updates, skipped = {}, 0
+    for custom_id, body in results:
+        content_id = custom_id.split(':', 1)[1]
+        item = items.get(content_id)
+        # Approved, published or hand-edited since the job was submitted, or already
+        # rewritten by this job (a part applied again after its worker died)
+        if (
+            item is None
+            or item.get('status') != 'pending'
+            or (item.get('edited_at') or '') > (job.get('submitted_at') or '')
+            or item.get('batch_id') == job["id"]
+        ):
+            skipped += 1
+            continue
+        text, duplicates = _finish_text(body, item.get('platform'), item.get('content_type'), item.get('client_id'), exclude=content_id)
+        updates[content_id] = {
+            "content": text,
+            "regenerated_at": now,
+            "regeneration_count": item.get('regeneration_count', 0) + 1,
+            "near_duplicate_of": duplicates,
+            "batch_id": job["id"],
+        }
+    return updates, skipped
+
+
+async def _apply_results(job: Dict, lines: List[Dict]) -> None:
+    counts = job["counts"]
+    results = []
+    for line in lines:
+        response = line.get('response') or {}
+        body = response.get('body') or {}
+        if line.get('error') or response.get('status_code') != 200 or not body.get('choices'):
+            counts["failed"] += 1
+            continue
+        results.append((line["custom_id"], body))
+    counts["succeeded"] += len(results)
+    batch_stats["results_failed"] += len(lines) - len(results)
+    batch_stats["results_succeeded"] += len(results)
+    if not results:
+        return
+
+    if job["mode"] == 'generate':
+        client_ids = list({custom_id.split(':', 2)[1] for custom_id, _ in results})
+        clients = {
+            client['client_id']: client
+            for client in await storage.find('clients', {"client_id": {"$in": client_ids}}, limit=len(client_ids))
+        }
+        documents, skipped = await asyncio.to_thread(_generated_documents, job, results, clients)
+        written = len(await storage.insert_missing('content', documents))
+    else:
+        content_ids = [custom_id.split(':', 1)[1] for custom_id, _ in results]
+        items = {
+            item['id']: item
+            for item in await storage.find('content', {"id": {"$in": content_ids}}, limit=len(content_ids))
+        }
+        updates, skipped = await asyncio.to_thread(_regenerated_updates, job, results, items)
+        written = len(await storage.bulk_update('content', updates, inc={storage.VERSION_FIELD: 1}))
+    counts["skipped"] += skipped
+    counts["written"] += written
+    batch_stats["results_skipped"] += skipped
+    batch_stats["documents_written"] += written
+
+
+async def _apply_part(job: Dict, part: Dict) -> None:
+    """Download the part's output file and write its results in chunks"""
+    path = Path(get_settings().batch_dir) / f"{job['id']}-{part['index']}.output.jsonl"
+    await asyncio.to_thread(_download, part["output_file_id"], path)
+    with open(path, 'r', encoding='utf-8') as f:
+        while True:
+            lines = await asyncio.to_thread(_read_lines, f, WRITE_CHUNK_SIZE)
+            if not lines:
+                break
+            with usage.context('batch'):
+                await _apply_results(job, lines)
+
+
+def _final_status(job: Dict) -> str:
+    if job.get("cancel_requested"):
+        return "cancelled"
+    if job["counts"]["succeeded"] or all(part["status"] == 'completed' for part in job["parts"]):
+        return "completed"
+    return "failed"
+
+
+async def _poll_job(job_id: str) -> None:
+    token = await storage.acquire_lease(_lease_name(job_id), JOB_LEASE_SECONDS)
+    if token is None:
+        # Another worker is polling or applying it
+        return
+    async with _holding(job_id, token):
+        # Read again under the lease: another worker may have applied it since it was listed
+        job = await storage.find_one('batches', {"id": job_id, "status": "submitted"})
+        if job is not None:
+            await _poll_parts(job)
+
+
+async def _poll_parts(job: Dict) -> None:
+    client = _client()
+    for part in job["parts"]:
+        if part["status"] in FINAL_STATUSES:
+            continue
+        batch = await asyncio.to_thread(client.batches.retrieve, part["batch_id"])
+        part["status"] = batch.status
+        part["output_file_id"] = batch.output_file_id
+        part["error_file_id"] = batch.error_file_id
+        if batch.request_counts is not None:
+            part["request_counts"] = {
+                "total": batch.request_counts.total,
+                "completed": batch.request_counts.completed,
+                "failed": batch.request_counts.failed,
+            }
+        if batch.errors is not None and batch.errors.data:
+            part["errors"] = [error.message for error in batch.errors.data[:5]]
+
+    if not all(part["status"] in FINAL_STATUSES for part in job["parts"]):
+        await _save(job)
+        return
+
+    await _save(job, status="applying")
+    started = time.perf_counter()
+    for part in job["parts"]:
+        if part["applied"]:
+            continue
+        if part["output_file_id"]:
+            await _apply_part(job, part)
+        # Failed requests are listed in the error file, not the output file
+        job["counts"]["failed"] += (part["request_counts"] or {}).get("failed", 0)
+        part["applied"] = True
+        await _save(job, status="applying")
+
+    status = _final_status(job)
+    batch_stats["jobs_completed" if status == 'completed' else "jobs_failed"] += 1
+    errors = [error for part in job["parts"] for error in part["errors"]]
+    await _save(
+        job,
+        status=status,
+        error=job.get("error") or (errors[0] if errors and status == 'failed' else None),
+        completed_at=datetime.now().isoformat()
+    )
+    print(f"✅ Batch job {job['id']} {status} in {time.perf_counter() - started:.1f}s: {job['counts']}")
+
+
+async def poll() -> None:
+    """Check every submitted job once and apply the ones whose batches have finished"""
+    batch_stats["polls"] += 1
+    for job in await storage.find('batches', {"status": "submitted"}, limit=1000):
+        try:
+            await _poll_job(job['id'])
+        except Exception as e:
+            print(f"Warning: Could not poll batch job {job['id']}: {str(e)}")
+
+
+async def _poll_periodically() -> None:
+    while True:
+        await asyncio.sleep(get_settings().batch_poll_interval_seconds)
+        try:
+            await _resume_interrupted()
+        except Exception as e:
+            print(f"Warning: Could not resume batch jobs: {str(e)}")
+        await poll()
+
+
+async def _resume_interrupted() -> None:
+    """
+    Jobs a dead worker left mid-build are failed, or submitted with the batches created so far;
+    jobs it left mid-apply are applied again (unapplied parts only). Jobs whose lease a live
+    worker still holds are left alone; a dead worker's lease expires within JOB_LEASE_SECONDS,
+    so its jobs are picked up by a later poll
+    """
+    for status in ('building', 'applying'):
+        for job in await storage.find('batches', {"status": status}, limit=1000):
+            token = await storage.acquire_lease(_lease_name(job['id']), JOB_LEASE_SECONDS)
+            if token is None:
+                continue
+            try:
+                now = datetime.now().isoformat()
+                if status == 'applying':
+                    fields = {"status": "submitted"}
+                elif job.get("parts"):
+                    fields = {
+                        "status": "submitted",
+                        "submitted_at": now,
+                        "error": f"Interrupted after {len(job['parts'])} batches were submitted",
+                    }
+                else:
+                    fields = {"status": "failed", "error": "Interrupted before it was submitted"}
+                # Conditional on the status it was listed with, in case its worker finished in between
+                if await storage.update_one('batches', {"id": job['id'], "status": status}, {**fields, "updated_at": now}):
+                    batch_stats["jobs_resumed"] += 1
+            finally:
+                await storage.release_lease(_lease_name(job['id']), token)
+
+
+async def start() -> None:
+    global _poll_task
+    try:
+        await _resume_interrupted()
+    except Exception as e:
+        print(f"Warning: Could not resume batch jobs: {str(e)}")
+    _poll_task = asyncio.create_task(_poll_periodically())
+
+
+async def stop() -> None:
+    global _poll_task
+    if _poll_task is not None:
+        _poll_task.cancel()
+        _poll_task = None
+    for task in list(_build_tasks):
+        task.cancel()
+
+
+def get_batch_metrics() -> Dict:
+    return {
+        **batch_stats,
+        "jobs_building": len(_build_tasks),
+    }
+
+metrics.register("batch", get_batch_metrics)
@@ -0,0 +1,225 @@
+"""
+Local stand-in for the OpenAI Files, Batches, Models and Chat Completions endpoints
+
+Runs batch mode (and ordinary generation) end to end without an API key or
+network access:
+
+    python batch_stub.py --port 8010
+    OPENAI_BASE_URL=http://localhost:8010/v1 OPENAI_API_KEY=stub uvicorn main:app
+
+Batches move validating -> in_progress -> completed BATCH_STUB_DELAY_SECONDS
+after they are created; every request gets a short canned completion (a JSON
+object with a string per property for json_schema response formats). With
+BATCH_STUB_FAIL_EVERY=n every n-th request of a batch fails and is listed in
+the error file instead. Files and batches only live in process memory.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Dict, List, Optional
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
+
+app = FastAPI(title="OpenAI batch stub")
+
+_files: Dict[str, Dict] = {}
+_batches: Dict[str, Dict] = {}
+
+
+def _delay() -> float:
+    return float(os.getenv('BATCH_STUB_DELAY_SECONDS', '2'))
+
+
+def _fail_every() -> int:
+    return int(os.getenv('BATCH_STUB_FAIL_EVERY', '0'))
+
+
+def _error(status_code: int, message: str) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content={"error": {"message": message, "type": "invalid_request_error"}})
+
+
+def _store_file(content: bytes, filename: str, purpose: str) -> Dict:
+    file_id = f"file-{uuid.uuid4().hex[:24]}"
+    meta = {
+        "id": file_id,
+        "object": "file",
+        "bytes": len(content),
+        "created_at": int(time.time()),
+        "filename": filename,
+        "purpose": purpose,
+        "status": "processed",
+    }
+    _files[file_id] = {"meta": meta, "content": content}
+    return meta
+
+
+def _completion(body: Dict) -> Dict:
+    """Canned chat completion for a request body"""
+    messages = body.get("messages") or []
+    prompt = ''.join(str(message.get("content", '')) for message in messages)
+    first_line = prompt.strip().splitlines()[0] if prompt.strip() else ''
+    digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:8]
+    text = f"Stub content {digest}: {first_line[:120]}"
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == 'json_schema':
+        # Structured output: a short string for every property of the schema
+        properties = response_format["json_schema"]["schema"].get("properties", {})
+        text = json.dumps({name: f"Stub {name} content {digest}" for name in properties})
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(text) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def _run(batch: Dict) -> None:
+    """Produce the output and error files of a batch"""
+    lines = _files[batch["input_file_id"]]["content"].decode('utf-8').splitlines()
+    fail_every = _fail_every()
+    output: List[str] = []
+    errors: List[str] = []
+    for number, line in enumerate((line for line in lines if line.strip()), start=1):
+        request = json.loads(line)
+        result = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": request["custom_id"]}
+        if fail_every and number % fail_every == 0:
+            errors.append(json.dumps({
+                **result,
+                "response": {"status_code": 500, "request_id": uuid.uuid4().hex, "body": {"error": {"message": "Stub failure"}}},
+                "error": None,
+            }))
+            continue
+        output.append(json.dumps({
+            **result,
+            "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": _completion(request["body"])},
+            "error": None,
+        }))
+    if output:
+        batch["output_file_id"] = _store_file(('\n'.join(output) + '\n').encode('utf-8'), 'batch_output.jsonl', 'batch_output')["id"]
+    if errors:
+        batch["error_file_id"] = _store_file(('\n'.join(errors) + '\n').encode('utf-8'), 'batch_errors.jsonl', 'batch_output')["id"]
+    batch["request_counts"] = {"total": len(output) + len(errors), "completed": len(output), "failed": len(errors)}
+
+
+def _advance(batch: Dict) -> Dict:
+    if batch["status"] in ('completed', 'failed', 'expired', 'cancelled'):
+        return batch
+    now = int(time.time())
+    elapsed = time.time() - batch["created_at_precise"]
+    if batch["status"] == 'cancelling':
+        batch.update(status='cancelled', cancelled_at=now)
+    elif elapsed >= _delay():
+        _run(batch)
+        batch.update(status='completed', in_progress_at=batch["in_progress_at"] or now, finalizing_at=now, completed_at=now)
+    elif elapsed >= _delay() / 2 and batch["status"] == 'validating':
+        batch.update(status='in_progress', in_progress_at=now)
+    return batch
+
+
+def _public(batch: Dict) -> Dict:
+    return {key: value for key, value in batch.items() if key != 'created_at_precise'}
+
+
+@app.post("/v1/files")
+async def create_file(file: UploadFile = File(...), purpose: str = Form(...)):
+    return _store_file(await file.read(), file.filename or 'upload.jsonl', purpose)
+
+
+@app.get("/v1/files/{file_id}")
+async def retrieve_file(file_id: str):
+    if file_id not in _files:
+        return _error(404, f"No such File object: {file_id}")
+    return _files[file_id]["meta"]
+
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    if file_id not in _files:
+        return _error(404, f"No such File object: {file_id}")
+    return Response(content=_files[file_id]["content"], media_type="application/octet-stream")
+
+
+@app.post("/v1/batches")
+async def create_batch(request: Request):
+    body = await request.json()
+    input_file_id = body.get("input_file_id")
+    if input_file_id not in _files:
+        return _error(400, f"Input file {input_file_id} not found")
+    created = time.time()
+    batch = {
+        "id": f"batch_{uuid.uuid4().hex[:24]}",
+        "object": "batch",
+        "endpoint": body.get("endpoint"),
+        "input_file_id": input_file_id,
+        "completion_window": body.get("completion_window", "24h"),
+        "status": "validating",
+        "output_file_id": None,
+        "error_file_id": None,
+        "errors": None,
+        "created_at": int(created),
+        "created_at_precise": created,
+        "in_progress_at": None,
+        "expires_at": int(created) + 86400,
+        "finalizing_at": None,
+        "completed_at": None,
+        "failed_at": None,
+        "expired_at": None,
+        "cancelling_at": None,
+        "cancelled_at": None,
+        "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        "metadata": body.get("metadata"),
+    }
+    _batches[batch["id"]] = batch
+    return _public(batch)
+
+
+@app.get("/v1/batches/{batch_id}")
+async def retrieve_batch(batch_id: str):
+    if batch_id not in _batches:
+        return _error(404, f"No such Batch object: {batch_id}")
+    return _public(_advance(_batches[batch_id]))
+
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str):
+    batch: Optional[Dict] = _batches.get(batch_id)
+    if batch is None:
+        return _error(404, f"No such Batch object: {batch_id}")
+    if batch["status"] in ('validating', 'in_progress'):
+        batch.update(status='cancelling', cancelling_at=int(time.time()))
+    return _public(batch)
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "stub", "object": "model", "created": 0, "owned_by": "stub"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    return _completion(await request.json())
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local OpenAI batch API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,564 @@
+"""
+Benchmark suite for CampaignForge backend
+
+Usage:
+    python benchmarks.py startup [--runs N]
+    python benchmarks.py search [--docs N] [--queries N]
+    python benchmarks.py dedup [--docs N] [--queries N]
+    python benchmarks.py bulk [--items N] [--runs N]
+    python benchmarks.py generation [--clients N] [--channels LIST] [--base-url URL]
+    python benchmarks.py writes [--ops N] [--rtt-ms MS]
+    python benchmarks.py campaigns [--campaigns N] [--clients N] [--queries N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from statistics import median
+from typing import Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Application modules and the third-party SDKs they used to import eagerly
+STARTUP_MODULES = [
+    'config',
+    'database',
+    'services',
+    'main',
+    'dotenv',
+    'requests',
+    'openai',
+    'motor.motor_asyncio',
+]
+
+# SDKs that should not be loaded just by importing the application
+LAZY_SDKS = ['openai', 'requests', 'motor', 'dotenv']
+
+
+def _importtime(statement: str) -> Dict[str, int]:
+    """Run statement in a fresh interpreter and return cumulative import time (us) per module"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else 'import failed')
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        # "import time:      self |  cumulative | <indent>package"
+        _, cumulative_us, name = line.replace('import time:', '', 1).split('|')
+        timings[name.strip()] = int(cumulative_us)
+    return timings
+
+
+def bench_startup(runs: int) -> None:
+    """Report the cold import time of each backend module and which SDKs main.py pulls in"""
+    print(f"Cold import time per module (median of {runs} runs, fresh interpreter each run)")
+    print(f"{'module':<24}{'cumulative ms':>16}")
+    for module in STARTUP_MODULES:
+        samples: List[int] = []
+        try:
+            for _ in range(runs):
+                timings = _importtime(f'import {module}')
+                samples.append(timings.get(module, 0))
+        except RuntimeError as e:
+            print(f"{module:<24}{'error':>16}  ({e})")
+            continue
+        print(f"{module:<24}{median(samples) / 1000:>16.1f}")
+
+    loaded = _importtime('import main')
+    eager = [sdk for sdk in LAZY_SDKS if sdk in loaded]
+    print()
+    if eager:
+        print(f"SDKs loaded by 'import main': {', '.join(eager)}")
+    else:
+        print("SDKs loaded by 'import main': none (deferred to first use / warmup)")
+
+
+def _percentiles(samples: List[float]) -> str:
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return f"p50 {pick(0.50) * 1000:8.3f} ms   p95 {pick(0.95) * 1000:8.3f} ms   p99 {pick(0.99) * 1000:8.3f} ms"
+
+
+_WORDS = (
+    'launch growth cloud analytics brand story customers team product insight summer sale '
+    'webinar security platform community engagement tips guide future innovation data '
+    'marketing campaign video newsletter event partner success results strategy'
+).split()
+_PLATFORMS = ['LinkedIn', 'Twitter', 'Instagram', 'Facebook', 'Reddit', 'Email', 'Website', 'YouTube']
+
+
+def bench_search(docs: int, queries: int) -> None:
+    """Latency of /api/content/search in in-memory mode (inverted index) over synthetic content"""
+    import storage
+    import search
+
+    rng = random.Random(42)
+    for i in range(docs):
+        document = {
+            'id': f'doc-{i}',
+            'client_id': f'client-{i % 50}',
+            'client_name': f'Client {i % 50}',
+            'platform': rng.choice(_PLATFORMS),
+            'content_type': rng.choice(['post', 'blog', 'newsletter', 'video_script']),
+            'status': rng.choice(['pending', 'approved']),
+            'content': ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(20, 120))),
+            'created_at': f'2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T12:00:00',
+        }
+        storage._memory_insert('content', document)
+
+    started = time.perf_counter()
+    search._get_index()
+    print(f"Indexed {docs} documents in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    cases = {
+        'keywords': lambda: dict(q=' '.join(rng.sample(_WORDS, 2)), filters={}),
+        'keywords + facets': lambda: dict(
+            q=rng.choice(_WORDS),
+            filters={'platform': [rng.choice(_PLATFORMS)], 'status': ['pending']}
+        ),
+        'keywords + date range': lambda: dict(
+            q=rng.choice(_WORDS), filters={}, date_from='2026-03-01', date_to='2026-06-30'
+        ),
+        'facets only': lambda: dict(q=None, filters={'client_id': [f'client-{rng.randint(0, 49)}']}),
+    }
+
+    async def run_cases():
+        for name, make_args in cases.items():
+            samples = []
+            for _ in range(queries):
+                args = make_args()
+                started = time.perf_counter()
+                await search.search_content(**args)
+                samples.append(time.perf_counter() - started)
+            print(f"{name:<24}{_percentiles(samples)}")
+
+    asyncio.run(run_cases())
+
+
+def bench_dedup(docs: int, queries: int) -> None:
+    """Near-duplicate lookup latency (MinHash LSH) against synthetic content"""
+    import storage
+    import dedup
+
+    rng = random.Random(42)
+    texts = []
+    for i in range(docs):
+        text = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(20, 60)))
+        texts.append(text)
+        storage._memory_insert('content', {'id': f'doc-{i}', 'content': text})
+
+    started = time.perf_counter()
+    dedup._get_index()
+    print(f"Indexed {docs} documents in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    def near_copy() -> str:
+        words = rng.choice(texts).split()
+        words[rng.randrange(len(words))] = rng.choice(_WORDS)
+        return ' '.join(words)
+
+    cases = {
+        'near-duplicate': near_copy,
+        'unrelated': lambda: ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(20, 60))),
+    }
+    for name, make_text in cases.items():
+        samples = []
+        flagged = 0
+        for _ in range(queries):
+            text = make_text()
+            started = time.perf_counter()
+            flagged += bool(dedup.find_near_duplicates(text))
+            samples.append(time.perf_counter() - started)
+        print(f"{name:<24}{_percentiles(samples)}   flagged {flagged}/{queries}")
+
+
+def bench_bulk(items: int, runs: int) -> None:
+    """Latency of the bulk content endpoints in in-memory mode (writes go to a temporary journal)"""
+    import tempfile
+    os.environ['STORAGE_JOURNAL_PATH'] = os.path.join(tempfile.mkdtemp(), 'journal.jsonl')
+    os.environ['SCHEDULER_ENABLED'] = 'true'
+    import storage
+    import main as app_main
+
+    rng = random.Random(42)
+
+    def populate() -> List[str]:
+        storage.memory['content'].clear()
+        ids = []
+        for i in range(items):
+            document = {
+                'id': f'doc-{i}',
+                'client_id': f'client-{i % 50}',
+                'platform': rng.choice(_PLATFORMS),
+                'content_type': 'post',
+                'status': 'pending',
+                'content': ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(10, 30))),
+                'created_at': f'2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T12:00:00',
+            }
+            storage._memory_insert('content', document)
+            ids.append(document['id'])
+        return ids
+
+    cases = {
+        'status by ids': lambda ids: app_main.bulk_update_status({"ids": ids, "status": "approved"}),
+        'status by filter': lambda ids: app_main.bulk_update_status({"filter": {"status": "pending"}, "status": "approved"}),
+        'edit': lambda ids: app_main.bulk_edit_content({"items": [{"id": key, "content": f"Edited {key}"} for key in ids]}),
+        'delete by ids': lambda ids: app_main.bulk_delete_content({"ids": ids}),
+        'delete by filter': lambda ids: app_main.bulk_delete_content({"filter": {"status": "pending"}}),
+    }
+
+    async def run_cases():
+        print(f"{items} items per request, {runs} runs each")
+        for name, make_call in cases.items():
+            samples = []
+            for _ in range(runs):
+                ids = populate()
+                started = time.perf_counter()
+                result = await make_call(ids)
+                samples.append(time.perf_counter() - started)
+            print(f"{name:<24}{_percentiles(samples)}   {result['summary']}")
+
+    asyncio.run(run_cases())
+
+
+def bench_generation(clients: int, channels: str, base_url: str) -> None:
+    """
+    Model calls, tokens and latency per client of per-platform generation against
+    GENERATION_MODE=combined (one structured call), using the OpenAI API or, with
+    --base-url, a compatible server such as batch_stub.py
+    """
+    import tempfile
+    os.environ['STORAGE_JOURNAL_PATH'] = os.path.join(tempfile.mkdtemp(), 'journal.jsonl')
+    if base_url:
+        os.environ['OPENAI_BASE_URL'] = base_url
+        os.environ.setdefault('OPENAI_API_KEY', 'stub')
+    import dataclasses
+    import config
+    import services
+    import usage
+
+    rng = random.Random(42)
+    profiles = [
+        {
+            'client_id': f'bench-{i}',
+            'company_name': f'Bench Company {i}',
+            'industry': rng.choice(['SaaS', 'Retail', 'Healthcare', 'Finance', 'Education']),
+            'brand_tone': rng.choice(['Professional', 'Friendly', 'Bold']),
+            'target_audience': ' '.join(rng.choice(_WORDS) for _ in range(6)),
+            'marketing_goals': ' '.join(rng.choice(_WORDS) for _ in range(8)),
+            'content_preferences': ' '.join(rng.choice(_WORDS) for _ in range(6)),
+            'past_examples': ' '.join(rng.choice(_WORDS) for _ in range(60)),
+            'primary_channels': channels,
+        }
+        for i in range(clients)
+    ]
+
+    base = config.get_settings()
+    print(f"{clients} clients, channels: {channels}")
+    try:
+        for mode in ('per_platform', 'combined'):
+            config.settings = dataclasses.replace(base, generation_mode=mode)
+            samples, calls, prompt_tokens, completion_tokens, cost, items = [], 0, 0, 0, 0.0, 0
+            for profile in profiles:
+                usage._buffer.clear()
+                started = time.perf_counter()
+                items += len(services.generate_content_for_all_platforms(profile))
+                samples.append(time.perf_counter() - started)
+                calls += len(usage._buffer)
+                prompt_tokens += sum(entry['prompt_tokens'] for entry in usage._buffer)
+                completion_tokens += sum(entry['completion_tokens'] for entry in usage._buffer)
+                cost += sum(entry['cost_usd'] for entry in usage._buffer)
+            print(
+                f"{mode:<14}{_percentiles(samples)}   per client: calls {calls / clients:.1f}  "
+                f"prompt tokens {prompt_tokens / clients:.0f}  completion tokens {completion_tokens / clients:.0f}  "
+                f"cost ${cost / clients:.5f}  items {items / clients:.1f}"
+            )
+    finally:
+        usage._buffer.clear()
+        config.settings = base
+    print(f"combined: {services.get_combined_metrics()}")
+
+
+def bench_writes(ops: int, rtt_ms: float) -> None:
+    """
+    Latency and storage round trips per request of edit, approve and campaign update:
+    before (find_one, then update_one per write) against after (one find_one_and_update
+    with a version check). Runs on MongoDB at MONGODB_URL (database DATABASE_NAME,
+    default campaignforge_bench) when it answers, otherwise on the in-memory store
+    with rtt_ms of simulated network latency per storage call
+    """
+    import dataclasses
+    import tempfile
+    os.environ['STORAGE_JOURNAL_PATH'] = os.path.join(tempfile.mkdtemp(), 'journal.jsonl')
+    os.environ.setdefault('DATABASE_NAME', 'campaignforge_bench')
+    os.environ.setdefault('MONGO_SERVER_SELECTION_TIMEOUT_MS', '2000')
+    import config
+    import storage
+    import validation
+    import scheduler
+    import main as app_main
+
+    rng = random.Random(42)
+    round_trips = {"count": 0}
+    simulated = {"rtt": 0.0}
+
+    def counted(func):
+        async def wrapper(*args, **kwargs):
+            round_trips["count"] += 1
+            if simulated["rtt"]:
+                await asyncio.sleep(simulated["rtt"])
+            return await func(*args, **kwargs)
+        return wrapper
+
+    # The previous endpoint bodies, storage calls only
+    async def edit_before(content_id: str) -> None:
+        content = await storage.find_one('content', {"id": content_id})
+        content['content'] = f"Edited {rng.random()}"
+        content['edited_at'] = datetime.now().isoformat()
+        await storage.update_one('content', {"id": content_id}, {"content": content['content'], "edited_at": content['edited_at']})
+
+    async def approve_before(content_id: str, posted: bool) -> None:
+        content = await storage.find_one('content', {"id": content_id})
+        validation.validate(content.get('platform'), content.get('content'))
+        fields = {"status": "approved", "approved_at": datetime.now().isoformat()}
+        if not posted:
+            fields.update({"publish_status": "scheduled", "scheduled_at": scheduler.assign_slot(content.get('platform')), "publish_attempts": 0})
+        await storage.update_one('content', {"id": content_id}, fields)
+        if posted:
+            await storage.update_one('content', {"id": content_id}, {"n8n_result": {"success": True}})
+
+    async def campaign_before(campaign_id: str) -> None:
+        campaign = await storage.find_one('campaigns', {"id": campaign_id})
+        update_data = {"budget": rng.randint(100, 10000), "updated_at": datetime.now().isoformat()}
+        await storage.update_one('campaigns', {"id": campaign_id}, update_data)
+        campaign.update(update_data)
+
+    cases = {
+        'edit': (edit_before, lambda key: app_main.edit_content_endpoint(key, {"content": f"Edited {rng.random()}"})),
+        'approve (scheduled)': (lambda key: approve_before(key, False), lambda key: app_main.approve_content_endpoint(key, None)),
+        'approve (posted to n8n)': (lambda key: approve_before(key, True), lambda key: app_main.approve_content_endpoint(key, None)),
+        'campaign update': (campaign_before, lambda key: app_main.update_campaign_endpoint(key, {"budget": rng.randint(100, 10000)})),
+    }
+
+    async def run_cases():
+        await storage.start()
+        on_mongo = storage.is_mongo_available()
+        if not on_mongo:
+            simulated["rtt"] = rtt_ms / 1000
+        print(f"{ops} requests per case on {'MongoDB' if on_mongo else f'the in-memory store with {rtt_ms} ms simulated round trips'}"
+              " (n8n posting stubbed out)")
+        base = config.get_settings()
+        client = {'client_id': 'bench-writes-client', 'company_name': 'Bench Company'}
+        contents = [
+            {
+                'id': f'bench-writes-{i}',
+                'client_id': client['client_id'],
+                'platform': rng.choice(_PLATFORMS),
+                'content_type': 'post',
+                'status': 'pending',
+                'content': ' '.join(rng.choice(_WORDS) for _ in range(12)),
+            }
+            for i in range(ops)
+        ]
+        campaigns = [{'id': f'bench-writes-campaign-{i}', 'name': f'Campaign {i}', 'budget': 1000} for i in range(ops)]
+        await storage.insert_many('clients', [client])
+        await storage.insert_many('content', contents)
+        await storage.insert_many('campaigns', campaigns)
+        app_main.post_to_n8n = lambda **kwargs: {'success': True}
+        originals = {name: getattr(storage, name) for name in ('find_one', 'update_one', 'find_one_and_update')}
+        for name, func in originals.items():
+            setattr(storage, name, counted(func))
+        try:
+            for name, (before, after) in cases.items():
+                config.settings = dataclasses.replace(base, scheduler_enabled=name != 'approve (posted to n8n)')
+                keys = [campaign['id'] for campaign in campaigns] if name == 'campaign update' else [content['id'] for content in contents]
+                for label, run in (('before', before), ('after', after)):
+                    samples = []
+                    round_trips["count"] = 0
+                    for key in keys:
+                        started = time.perf_counter()
+                        await run(key)
+                        samples.append(time.perf_counter() - started)
+                    print(f"{name:<28}{label:<8}{_percentiles(samples)}   round trips {round_trips['count'] / len(keys):.1f}")
+
+            # Two editors saving changes to the version they both loaded: one wins, the other gets 409
+            applied = conflicts = 0
+            for content in contents:
+                current = await originals['find_one']('content', {"id": content['id']})
+                results = await asyncio.gather(*[
+                    app_main.edit_content_endpoint(content['id'], {"content": f"Editor {editor}", "version": current.get('version', 0)})
+                    for editor in range(2)
+                ])
+                applied += sum(1 for result in results if isinstance(result, dict))
+                conflicts += sum(1 for result in results if getattr(result, 'status_code', None) == 409)
+            print(f"{'concurrent edits':<28}{len(contents)} pairs: {applied} applied, {conflicts} rejected with 409 (before: every edit applied, last write won)")
+        finally:
+            for name, func in originals.items():
+                setattr(storage, name, func)
+            config.settings = base
+            await storage.delete_many('content', {"client_id": client['client_id']})
+            await storage.delete_many('campaigns', {"id": {"$in": [campaign['id'] for campaign in campaigns]}})
+            await storage.delete_many('clients', {"client_id": client['client_id']})
+            await storage.stop()
+
+    asyncio.run(run_cases())
+
+
+def bench_campaigns(count: int, clients: int, queries: int) -> None:
+    """
+    Campaign listing and per-client summaries: before (every campaign fetched, then
+    filtered, sorted and summed by the caller) against after (server-side query on
+    the indexes, stored summary documents). Runs on MongoDB at MONGODB_URL (database
+    DATABASE_NAME, default campaignforge_bench) when it answers, otherwise in memory
+    """
+    import tempfile
+    os.environ['STORAGE_JOURNAL_PATH'] = os.path.join(tempfile.mkdtemp(), 'journal.jsonl')
+    os.environ.setdefault('DATABASE_NAME', 'campaignforge_bench')
+    os.environ.setdefault('MONGO_SERVER_SELECTION_TIMEOUT_MS', '2000')
+    import storage
+    import campaigns as campaign_queries
+
+    rng = random.Random(42)
+    client_ids = [f'bench-campaigns-client-{i}' for i in range(clients)]
+    statuses = ['active', 'paused', 'completed', 'draft']
+
+    async def list_before(client_id: str, status: str) -> int:
+        documents = await storage.find('campaigns', {}, limit=1000000)
+        matched = [d for d in documents if d.get('client_id') == client_id and d.get('status') == status]
+        matched.sort(key=lambda d: d.get('created_at') or '', reverse=True)
+        return len(documents)
+
+    async def list_after(client_id: str, status: str) -> int:
+        result = await campaign_queries.list_campaigns({"client_id": [client_id], "status": [status]}, page_size=50)
+        return len(result["campaigns"])
+
+    async def summary_before(client_id: str, status: str) -> int:
+        documents = await storage.find('campaigns', {"client_id": client_id}, limit=1000000)
+        sum(float(d.get('budget') or 0) for d in documents)
+        return len(documents)
+
+    async def summary_after(client_id: str, status: str) -> int:
+        await campaign_queries.get_summary(client_id)
+        return 1
+
+    async def summaries_before(client_id: str, status: str) -> int:
+        documents = await storage.find('campaigns', {}, limit=1000000)
+        totals: Dict[str, float] = {}
+        for d in documents:
+            totals[d.get('client_id')] = totals.get(d.get('client_id'), 0) + float(d.get('budget') or 0)
+        return len(documents)
+
+    async def summaries_after(client_id: str, status: str) -> int:
+        return len(await campaign_queries.get_summaries())
+
+    cases = {
+        'list (client + status)': (list_before, list_after),
+        'one client summary': (summary_before, summary_after),
+        'all client summaries': (summaries_before, summaries_after),
+    }
+
+    async def run_cases():
+        await storage.start()
+        await storage.delete_many('campaigns', {"client_id": {"$in": client_ids}})
+        # The once-per-process rebuild, so the timing below covers only the incremental deltas
+        await campaign_queries.flush_summaries()
+        documents = [
+            {
+                'id': f'bench-campaign-{i}',
+                'name': f'Campaign {i}',
+                'client_id': rng.choice(client_ids),
+                'platform': rng.choice(_PLATFORMS),
+                'status': rng.choice(statuses),
+                'budget': rng.randint(100, 10000),
+                'impressions': rng.randint(0, 100000),
+                'clicks': rng.randint(0, 5000),
+                'created_at': f'2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T12:00:00',
+            }
+            for i in range(count)
+        ]
+        for start in range(0, count, 1000):
+            await storage.insert_many('campaigns', documents[start:start + 1000])
+        started = time.perf_counter()
+        await campaign_queries.flush_summaries()
+        print(f"{count} campaigns of {clients} clients on {'MongoDB' if storage.is_mongo_available() else 'the in-memory store'};"
+              f" summary deltas of all inserts flushed in {(time.perf_counter() - started) * 1000:.0f} ms")
+        try:
+            for name, (before, after) in cases.items():
+                for label, run in (('before', before), ('after', after)):
+                    samples = []
+                    read = 0
+                    for _ in range(queries):
+                        started = time.perf_counter()
+                        read += await run(rng.choice(client_ids), rng.choice(statuses))
+                        samples.append(time.perf_counter() - started)
+                    print(f"{name:<24}{label:<8}{_percentiles(samples)}   documents read {read / queries:.0f}")
+        finally:
+            await storage.delete_many('campaigns', {"client_id": {"$in": client_ids}})
+            await campaign_queries.flush_summaries()
+            await storage.stop()
+
+    asyncio.run(run_cases())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='CampaignForge backend benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    startup = subparsers.add_parser('startup', help='per-module import time')
+    startup.add_argument('--runs', type=int, default=5)
+
+    search = subparsers.add_parser('search', help='content search latency (in-memory index)')
+    search.add_argument('--docs', type=int, default=10000)
+    search.add_argument('--queries', type=int, default=200)
+
+    dedup = subparsers.add_parser('dedup', help='near-duplicate lookup latency (MinHash LSH)')
+    dedup.add_argument('--docs', type=int, default=10000)
+    dedup.add_argument('--queries', type=int, default=200)
+
+    bulk = subparsers.add_parser('bulk', help='bulk delete/edit/status latency (in-memory mode)')
+    bulk.add_argument('--items', type=int, default=10000)
+    bulk.add_argument('--runs', type=int, default=5)
+
+    generation = subparsers.add_parser('generation', help='per-platform vs combined generation: calls, tokens, latency')
+    generation.add_argument('--clients', type=int, default=10)
+    generation.add_argument('--channels', default='LinkedIn, Twitter, Instagram, Facebook, Email')
+    generation.add_argument('--base-url', default='', help='OpenAI-compatible base URL, e.g. http://127.0.0.1:8010/v1')
+
+    writes = subparsers.add_parser('writes', help='edit/approve/campaign update latency and round trips, before and after')
+    writes.add_argument('--ops', type=int, default=500)
+    writes.add_argument('--rtt-ms', type=float, default=1.0, help='simulated round trip when MongoDB is not reachable')
+
+    campaigns = subparsers.add_parser('campaigns', help='campaign listing and summaries: client-side vs server-side')
+    campaigns.add_argument('--campaigns', type=int, default=20000)
+    campaigns.add_argument('--clients', type=int, default=100)
+    campaigns.add_argument('--queries', type=int, default=200)
+
+    args = parser.parse_args()
+    if args.command == 'startup':
+        bench_startup(args.runs)
+    elif args.command == 'search':
+        bench_search(args.docs, args.queries)
+    elif args.command == 'dedup':
+        bench_dedup(args.docs, args.queries)
+    elif args.command == 'bulk':
+        bench_bulk(args.items, args.runs)
+    elif args.command == 'generation':
+        bench_generation(args.clients, args.channels, args.base_url)
+    elif args.command == 'writes':
+        bench_writes(args.ops, args.rtt_ms)
+    elif args.command == 'campaigns':
+        bench_campaigns(args.campaigns, args.clients, args.queries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""
+Brand-context compression for generation prompts
+
+The onboarding form's free text (past_examples, texts) is often a pasted blog
+archive. Instead of resending it with every generation prompt, it is condensed
+once into a bounded brand-voice summary plus a few verbatim snippets, stored
+on the client as 'brand_context':
+
+- Sources of at most BRAND_CONTEXT_MAX_CHARS in total are short enough to be
+  used verbatim
+- Longer sources up to BRAND_CONTEXT_CHUNK_CHARS are summarized in one
+  small-model call; beyond that they are split into chunks, each chunk is
+  condensed to notes and the notes are merged into the summary (at most
+  BRAND_CONTEXT_SUMMARY_WORDS words either way)
+- Chunk notes are kept by chunk hash, so when the source fields change only
+  new or edited chunks are condensed again
+- Snippets are picked locally: the most mutually dissimilar paragraphs (MinHash)
+
+While no summary matches the current source fields (OpenAI not configured,
+refresh pending or failed), prompts get the raw fields capped at
+BRAND_CONTEXT_MAX_CHARS instead.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from config import get_settings
+import cache
+import dedup
+import executors
+import metrics
+import storage
+
+SOURCE_FIELDS = ('past_examples', 'texts')
+
+SOURCE_LABELS = {
+    'past_examples': 'past content examples',
+    'texts': 'brand texts',
+}
+
+FIELD_TITLES = {
+    'past_examples': 'Past Examples',
+    'texts': 'Brand Texts',
+}
+
+# Words of notes per chunk in the condense step
+CHUNK_NOTE_WORDS = 80
+
+# Paragraphs considered for snippets, spread evenly over the sources
+MAX_SNIPPET_CANDIDATES = 200
+MIN_SNIPPET_CHARS = 40
+
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+
+# client_id -> running background refresh; clients changed again while it runs
+_refresh_tasks: Dict[str, asyncio.Task] = {}
+_refresh_again: set = set()
+
+brand_stats = {
+    "refreshes": 0,
+    "unchanged": 0,
+    "skipped_not_configured": 0,
+    "errors": 0,
+    "chunks_condensed": 0,
+    "chunks_reused": 0,
+    "source_chars": 0,
+    "context_chars": 0,
+    "seconds_total": 0.0,
+}
+
+
+def _sources(client: Dict) -> Dict[str, str]:
+    sources = {}
+    for field in SOURCE_FIELDS:
+        text = str(client.get(field) or '').strip()
+        if text:
+            sources[field] = text
+    return sources
+
+
+def source_hash(client: Dict) -> str:
+    """Hash of the client's source fields, to tell whether brand_context is current"""
+    return hashlib.sha256(json.dumps(_sources(client), sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+
+def _paragraphs(text: str) -> List[str]:
+    paragraphs = [paragraph.strip() for paragraph in _PARAGRAPH_RE.split(text) if paragraph.strip()]
+    if len(paragraphs) <= 1:
+        paragraphs = [line.strip() for line in text.splitlines() if line.strip()]
+    return paragraphs
+
+
+def _chunks(text: str, size: int) -> List[str]:
+    """Paragraphs grouped into chunks of at most size characters (longer paragraphs are cut)"""
+    chunks, current = [], ''
+    for paragraph in _paragraphs(text):
+        while len(paragraph) > size:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(paragraph[:size])
+            paragraph = paragraph[size:]
+        if current and len(current) + len(paragraph) + 2 > size:
+            chunks.append(current)
+            current = ''
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _cut(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(' ', 1)[0].rstrip() + ' ...'
+
+
+def pick_snippets(sources: Dict[str, str], count: int, max_chars: int) -> List[str]:
+    """Up to count paragraphs that differ most from each other, each cut to max_chars"""
+    paragraphs = [paragraph for text in sources.values() for paragraph in _paragraphs(text)]
+    candidates = [paragraph for paragraph in paragraphs if len(paragraph) >= MIN_SNIPPET_CHARS] or paragraphs
+    if len(candidates) > MAX_SNIPPET_CANDIDATES:
+        step = len(candidates) / MAX_SNIPPET_CANDIDATES
+        candidates = [candidates[int(i * step)] for i in range(MAX_SNIPPET_CANDIDATES)]
+    candidates = [_cut(candidate, max_chars) for candidate in candidates]
+    if len(candidates) <= count:
+        return candidates
+
+    signatures = [dedup.minhash(candidate) for candidate in candidates]
+    # Start from the longest paragraph, then add the one least similar to those already chosen
+    chosen = [max(range(len(candidates)), key=lambda i: len(candidates[i]))]
+    closest = [dedup.similarity(signatures[i], signatures[chosen[0]]) for i in range(len(candidates))]
+    while len(chosen) < count:
+        best = min((i for i in range(len(candidates)) if i not in chosen), key=lambda i: closest[i])
+        chosen.append(best)
+        closest = [max(closest[i], dedup.similarity(signatures[i], signatures[best])) for i in range(len(candidates))]
+    return [candidates[i] for i in sorted(chosen)]
+
+
+def _condense(client: Dict, label: str, text: str, words: int) -> str:
+    """Brand-voice notes of at most words words on text"""
+    from services import _chat_completion
+
+    prompt = f"""Below are {label} from {client.get('company_name', 'a company')} ({client.get('industry', 'General')}).
+Describe the brand voice they show in at most {words} words: tone, vocabulary, sentence style, recurring themes and messages, formatting habits and typical calls-to-action. Write notes a copywriter can follow, no preamble.
+
+---
+{text}
+---"""
+    notes, _ = _chat_completion(
+        model=get_settings().model_small,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.2,
+        max_tokens=words * 2,
+        client_id=client.get('client_id')
+    )
+    return notes
+
+
+async def build_context(client: Dict, previous: Optional[Dict] = None, run: Callable = executors.run_generation) -> Dict:
+    """
+    Summary and snippets for the client's source fields, reusing previous chunk notes;
+    run runs the blocking steps (chunks are condensed in parallel on the background pool)
+    """
+    settings = get_settings()
+    sources = _sources(client)
+    source_chars = sum(len(text) for text in sources.values())
+    words = settings.brand_context_summary_words
+    chunk_notes: Dict[str, str] = {}
+
+    if source_chars <= settings.brand_context_chunk_chars:
+        text = '\n\n'.join(sources.values())
+        summary = await run(_condense, client, ' and '.join(SOURCE_LABELS[field] for field in sources), text, words)
+    else:
+        chunks: List[Tuple[str, str, str]] = []
+        for field, text in sources.items():
+            for chunk in _chunks(text, settings.brand_context_chunk_chars):
+                key = hashlib.sha256(f"{field}\n{chunk}".encode('utf-8')).hexdigest()[:16]
+                chunks.append((key, field, chunk))
+        previous_notes = (previous or {}).get('chunk_notes') or {}
+        missing = [(key, field, chunk) for key, field, chunk in chunks if key not in previous_notes]
+        brand_stats["chunks_reused"] += len(chunks) - len(missing)
+        brand_stats["chunks_condensed"] += len(missing)
+        # The pool size bounds how many chunks are condensed at once; each call keeps the usage context
+        notes = await asyncio.gather(*(
+            executors.run_background(_condense, client, SOURCE_LABELS[field], chunk, CHUNK_NOTE_WORDS)
+            for _, field, chunk in missing
+        ))
+        condensed = dict(zip((key for key, _, _ in missing), notes))
+        # Only the current chunks are kept, so the notes do not grow with every edit
+        chunk_notes = {key: condensed.get(key) or previous_notes[key] for key, _, _ in chunks}
+        summary = await run(_condense, client, 'notes on brand content', '\n\n'.join(chunk_notes.values()), words)
+
+    snippets = await run(pick_snippets, sources, settings.brand_context_snippets, settings.brand_context_snippet_chars)
+    return {
+        "summary": summary,
+        "snippets": snippets,
+        "chunk_notes": chunk_notes,
+        "source_hash": source_hash(client),
+        "source_chars": source_chars,
+        "updated_at": datetime.now().isoformat(),
+    }
+
+
+def context_chars(context: Dict) -> int:
+    return len(context.get('summary') or '') + sum(len(snippet) for snippet in context.get('snippets') or [])
+
+
+def prompt_lines(client_data: Dict) -> str:
+    """Brand context for a generation prompt: the summary and snippets when current, else capped past examples"""
+    context = client_data.get('brand_context')
+    if context and context.get('summary') and context.get('source_hash') == source_hash(client_data):
+        lines = [f"- Brand Voice: {context['summary']}"]
+        if context.get('snippets'):
+            lines.append("- Representative Examples:")
+            lines.extend(f"  {number}. {snippet}" for number, snippet in enumerate(context['snippets'], start=1))
+        return '\n'.join(lines)
+    # Short sources are used as they are; long ones are capped until they are condensed
+    limit = get_settings().brand_context_max_chars
+    sources = _sources(client_data)
+    lines = []
+    for field, text in sources.items():
+        lines.append(f"- {FIELD_TITLES[field]}: {_cut(text, max(limit // len(sources), 200))}")
+    return '\n'.join(lines)
+
+
+async def refresh(client: Dict, force: bool = False, background: bool = False) -> Optional[Dict]:
+    """
+    Condense the client's source fields unless brand_context already matches them;
+    stores the context on the client (and in client) and returns it, None on failure.
+    background: no request (and so no admission slot) is waiting, use the background pool
+    """
+    previous = client.get('brand_context')
+    if not force and previous and previous.get('source_hash') == source_hash(client):
+        brand_stats["unchanged"] += 1
+        return previous
+    sources = _sources(client)
+    if sum(len(text) for text in sources.values()) <= get_settings().brand_context_max_chars:
+        # Short enough to use verbatim; drop any context of earlier, longer sources
+        if previous is None:
+            return None
+        context = None
+    elif not get_settings().openai_configured:
+        brand_stats["skipped_not_configured"] += 1
+        return None
+    else:
+        started = time.perf_counter()
+        try:
+            run = executors.run_background if background else executors.run_generation
+            context = await build_context(client, previous, run)
+        except Exception as e:
+            brand_stats["errors"] += 1
+            print(f"Warning: Could not condense brand context for client {client.get('client_id')}: {str(e)}")
+            return None
+        brand_stats["refreshes"] += 1
+        brand_stats["seconds_total"] += time.perf_counter() - started
+        brand_stats["source_chars"] += context["source_chars"]
+        brand_stats["context_chars"] += context_chars(context)
+
+    # The source fields may have changed again while this ran; the newer refresh stores its own result
+    current = await storage.find_one('clients', {"client_id": client['client_id']})
+    if current is None or (context is not None and source_hash(current) != context["source_hash"]):
+        return context
+    await storage.update_one('clients', {"client_id": client['client_id']}, {
+        "brand_context": context,
+        "updated_at": datetime.now().isoformat()
+    })
+    cache.invalidate_client(client['client_id'])
+    client['brand_context'] = context
+    return context
+
+
+async def _refresh_in_background(client_id: str) -> None:
+    try:
+        while True:
+            _refresh_again.discard(client_id)
+            client = await storage.find_one('clients', {"client_id": client_id})
+            if client is not None:
+                await refresh(client, background=True)
+            if client_id not in _refresh_again:
+                return
+    finally:
+        _refresh_tasks.pop(client_id, None)
+
+
+def schedule_refresh(client_id: str) -> None:
+    """Refresh a client's brand context in the background (once more if one is already running)"""
+    if client_id in _refresh_tasks:
+        _refresh_again.add(client_id)
+        return
+    _refresh_tasks[client_id] = asyncio.create_task(_refresh_in_background(client_id))
+
+
+def get_brand_metrics() -> Dict:
+    source_chars = brand_stats["source_chars"]
+    refreshes = brand_stats["refreshes"]
+    return {
+        **brand_stats,
+        "seconds_total": round(brand_stats["seconds_total"], 3),
+        "compression_ratio": round(brand_stats["context_chars"] / source_chars, 4) if source_chars else None,
+        "avg_refresh_ms": round(brand_stats["seconds_total"] / refreshes * 1000, 1) if refreshes else None,
+        "refreshes_running": len(_refresh_tasks),
+    }
+
+metrics.register("brand_context", get_brand_metrics)
@@ -0,0 +1,177 @@
+"""
+Read-through cache for client documents
+
+Client profiles are read on every approve/regenerate/campaign request but change
+rarely, so they are cached in-process with a TTL and an LRU size bound.
+Invalidation:
+- local updates call invalidate_client(), which is published on the events bus
+- updates made by other workers arrive through a MongoDB change stream on the
+  clients collection (when the deployment supports change streams)
+- the whole cache is dropped when storage recovers from an outage, since
+  changes made elsewhere during the outage were not observed
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from config import get_settings
+import events
+import metrics
+import storage
+
+
+class TTLCache:
+    """Least-recently-used mapping whose entries expire ttl seconds after insertion"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return value
+
+    def put(self, key: str, value) -> None:
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        self.stats["invalidations"] += len(self._entries)
+        self._entries.clear()
+
+    def snapshot(self) -> Dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else None,
+        }
+
+
+# Created on first use so importing this module does not load settings
+_client_cache: Optional[TTLCache] = None
+
+# Bumped on every invalidation so a fetch that raced with an update is not cached
+_generation = 0
+
+_watch_task: Optional[asyncio.Task] = None
+_change_stream_status = "stopped"
+
+
+def _get_client_cache() -> TTLCache:
+    global _client_cache
+    if _client_cache is None:
+        settings = get_settings()
+        _client_cache = TTLCache(settings.client_cache_max_size, settings.client_cache_ttl)
+    return _client_cache
+
+
+async def get_client(client_id: Optional[str]) -> Optional[Dict]:
+    """Get a client document, from the cache when possible"""
+    if not client_id:
+        return None
+    client_cache = _get_client_cache()
+    cached = client_cache.get(client_id)
+    if cached is not None:
+        return dict(cached)
+
+    generation = _generation
+    client = await storage.find_one('clients', {"client_id": client_id})
+    if client is not None and generation == _generation:
+        client_cache.put(client_id, client)
+    return dict(client) if client is not None else None
+
+
+def _evict(payload: Dict) -> None:
+    global _generation
+    _generation += 1
+    client_cache = _get_client_cache()
+    client_id = payload.get("client_id")
+    if client_id:
+        client_cache.invalidate(client_id)
+    else:
+        client_cache.clear()
+
+
+def invalidate_client(client_id: Optional[str] = None) -> None:
+    """Drop a client (or every client when client_id is None) from the cache in this process"""
+    events.publish('clients.invalidate', {"client_id": client_id})
+
+
+events.subscribe('clients.invalidate', _evict)
+events.subscribe('storage.recovered', lambda payload: _evict({}))
+
+
+async def _watch_clients() -> None:
+    """Evict clients changed by other workers, as reported by a MongoDB change stream"""
+    global _change_stream_status
+    from pymongo.errors import OperationFailure
+
+    while True:
+        handle = storage.collection('clients')
+        if handle is None:
+            _change_stream_status = "waiting for MongoDB"
+            await asyncio.sleep(get_settings().storage_monitor_interval)
+            continue
+        try:
+            async with handle.watch(full_document='updateLookup') as stream:
+                _change_stream_status = "watching"
+                async for change in stream:
+                    document = change.get('fullDocument') or {}
+                    # Deletes only carry the _id, so fall back to clearing everything
+                    _evict({"client_id": document.get('client_id')})
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            # Standalone servers do not support change streams; rely on the TTL instead
+            _change_stream_status = f"unavailable ({e.code}), TTL only"
+            print(f"Warning: Client cache change stream unavailable: {str(e)}")
+            return
+        except Exception as e:
+            _change_stream_status = "reconnecting"
+            print(f"Warning: Client cache change stream interrupted: {str(e)}")
+            _evict({})
+            await asyncio.sleep(get_settings().storage_monitor_interval)
+
+
+async def start() -> None:
+    global _watch_task
+    if get_settings().client_cache_change_stream:
+        _watch_task = asyncio.create_task(_watch_clients())
+
+
+async def stop() -> None:
+    global _watch_task
+    if _watch_task is not None:
+        _watch_task.cancel()
+        _watch_task = None
+
+
+def get_cache_metrics() -> Dict:
+    return {"clients": {**_get_client_cache().snapshot(), "change_stream": _change_stream_status}}
+
+metrics.register("cache", get_cache_metrics)
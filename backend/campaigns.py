@@ -0,0 +1,477 @@
+"""
+Campaign queries and per-client campaign summaries
+
+- list_campaigns filters by client, platform, status and a date window,
+  sorts and pages on the server (MongoDB, on the indexes below, or the
+  in-memory store) instead of shipping every campaign to the browser
+- Per-client summaries (campaigns, active campaigns, total budget,
+  impressions, clicks) are documents in 'campaign_summaries', so reading
+  them is one document per client. They are maintained incrementally: each
+  campaign write event adds the difference between the old and the new
+  document to a pending delta, and pending deltas are flushed in the
+  background with one $inc upsert per client. Reads serve the stored documents
+  and never wait for a flush or a rebuild
+- A write whose event has no previous document (update_many, or a delete of
+  a document that was not in memory) gets its client recomputed from the
+  campaigns instead, or every client when the client is not known. All
+  summaries are recomputed once per process and after MongoDB recovers,
+  which also repairs deltas lost to a crash; a lease keeps workers from
+  rebuilding at the same time. While another worker holds it, clients with
+  pending deltas are recomputed instead, since its rebuild may already have
+  counted those writes
+- Recomputed summaries are written with a versioned update (every $inc bumps
+  the version too), so an increment another worker made since the summary was
+  read is never overwritten; the client is recomputed again instead
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+import database
+import events
+import metrics
+import storage
+
+FILTER_FIELDS = ('client_id', 'platform', 'status')
+
+# Each has an index to sort on (below), so a sorted page never sorts in memory
+SORT_FIELDS = (
+    'created_at', 'start_date', 'name', 'platform', 'status', 'budget', 'impressions', 'clicks', 'ctr',
+)
+
+# Stored as numbers so they sort and sum numerically
+NUMERIC_FIELDS = ('budget', 'impressions', 'clicks', 'ctr')
+
+SUMMARY_FIELDS = ('campaigns', 'active', 'budget', 'impressions', 'clicks')
+
+REBUILD_LEASE = 'campaign_summaries.rebuild'
+# Longer than a rebuild takes; a worker that dies mid-rebuild blocks others at most this long
+REBUILD_LEASE_SECONDS = 600
+# Versioned writes of one recomputation before it gives up until the next change
+RECOMPUTE_ATTEMPTS = 3
+
+# Collections that copy the client's company_name as client_name
+CLIENT_NAME_COLLECTIONS = ('campaigns', 'content')
+
+database.INDEXES.append(('campaigns', [('client_id', 1), ('created_at', -1)], {}))
+database.INDEXES.append(('campaigns', [('status', 1), ('created_at', -1)], {}))
+database.INDEXES.append(('campaigns', [('platform', 1), ('created_at', -1)], {}))
+database.INDEXES.append(('campaigns', [('created_at', -1)], {}))
+database.INDEXES.append(('campaigns', [('start_date', 1), ('end_date', 1)], {}))
+for _field in ('name', 'budget', 'impressions', 'clicks', 'ctr'):
+    database.INDEXES.append(('campaigns', [(_field, 1)], {}))
+database.INDEXES.append(('campaign_summaries', [('client_id', 1)], {"unique": True}))
+
+# client_id -> summary field -> amount not yet added to the stored summary
+_pending: Dict[str, Dict[str, float]] = {}
+# client_id -> latest client_name seen on its campaigns
+_names: Dict[str, str] = {}
+# Clients to recompute from their campaigns; a full rebuild is due once per process
+_stale: Set[str] = set()
+_rebuild_all = True
+_recomputing: Set[str] = set()
+_rebuilding = False
+
+_flush_lock = asyncio.Lock()
+_flush_task: Optional[asyncio.Task] = None
+
+campaign_stats = {
+    "queries": 0,
+    "summary_reads": 0,
+    "summary_flushes": 0,
+    "summary_increments": 0,
+    "summary_recomputes": 0,
+    "summary_rebuilds": 0,
+    "summary_rebuilds_skipped": 0,
+    "summary_conflicts": 0,
+    "client_renames": 0,
+}
+
+
+def _number(value) -> float:
+    if isinstance(value, bool) or value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def normalize(fields: Dict) -> Dict:
+    """fields with numeric campaign fields converted to numbers; ValueError when one is not a number"""
+    normalized = dict(fields)
+    for field in NUMERIC_FIELDS:
+        value = normalized.get(field)
+        if value is None or isinstance(value, (int, float)) and not isinstance(value, bool):
+            continue
+        if value == '':
+            normalized[field] = None
+            continue
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"'{field}' must be a number")
+        normalized[field] = int(number) if number.is_integer() else number
+    return normalized
+
+
+# ---------------------------------------------------------------------------
+# Queries
+# ---------------------------------------------------------------------------
+
+def build_query(filters: Dict[str, Optional[List[str]]], date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict:
+    """Equality/$in filters plus campaigns running at some point between date_from and date_to"""
+    query: Dict = {}
+    for field in FILTER_FIELDS:
+        values = [value for value in (filters.get(field) or []) if value and value != 'all']
+        if len(values) == 1:
+            query[field] = values[0]
+        elif values:
+            query[field] = {"$in": values}
+    # start_date/end_date are dates (YYYY-MM-DD), so plain string comparison orders them
+    if date_from:
+        query["end_date"] = {"$gte": date_from[:10]}
+    if date_to:
+        query["start_date"] = {"$lte": date_to[:10]}
+    return query
+
+
+async def list_campaigns(
+    filters: Dict[str, Optional[List[str]]],
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    sort: str = 'created_at',
+    order: str = 'desc',
+    page: int = 1,
+    page_size: int = 100,
+    read_only: bool = True
+) -> Dict:
+    """
+    One page of matching campaigns and the total; ValueError for an unknown sort field or order
+    (read_only=False reads from the primary)
+    """
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"Cannot sort by '{sort}', use one of: {', '.join(SORT_FIELDS)}")
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be 'asc' or 'desc'")
+    campaign_stats["queries"] += 1
+    query = build_query(filters, date_from, date_to)
+    campaigns, total = await asyncio.gather(
+        storage.find(
+            'campaigns', query, limit=page_size, read_only=read_only,
+            sort=[(sort, 1 if order == 'asc' else -1)], skip=(page - 1) * page_size
+        ),
+        storage.count('campaigns', query, read_only=read_only)
+    )
+    return {"total": total, "campaigns": campaigns}
+
+
+async def propagate_client_name(client_id: str, client_name: str) -> Dict[str, int]:
+    """Copy a renamed client's company_name to the client_name of its campaigns and content"""
+    query = {"client_id": client_id, "client_name": {"$ne": client_name}}
+    updated = await asyncio.gather(*[
+        storage.update_many(name, query, {"client_name": client_name})
+        for name in CLIENT_NAME_COLLECTIONS
+    ])
+    campaign_stats["client_renames"] += 1
+    return {name: len(keys) for name, keys in zip(CLIENT_NAME_COLLECTIONS, updated)}
+
+
+# ---------------------------------------------------------------------------
+# Summaries
+# ---------------------------------------------------------------------------
+
+def _contribution(campaign: Dict) -> Dict[str, float]:
+    return {
+        "campaigns": 1,
+        "active": 1 if campaign.get('status') == 'active' else 0,
+        "budget": _number(campaign.get('budget')),
+        "impressions": _number(campaign.get('impressions')),
+        "clicks": _number(campaign.get('clicks')),
+    }
+
+
+def _mark_stale(client_id: Optional[str]) -> None:
+    global _rebuild_all
+    if client_id is None:
+        _rebuild_all = True
+    else:
+        _stale.add(client_id)
+
+
+def _on_campaign_changed(payload: Dict) -> None:
+    previous = payload.get("previous")
+    document = payload.get("document")
+    if payload["op"] != 'insert' and previous is None:
+        # Without the document before the write there is no difference to add
+        _mark_stale((document or {}).get('client_id'))
+    else:
+        for campaign, sign in ((previous, -1), (document, 1)):
+            client_id = (campaign or {}).get('client_id')
+            if client_id is None:
+                continue
+            if _rebuilding or client_id in _recomputing:
+                # The recomputation may or may not have seen this write
+                _stale.add(client_id)
+                continue
+            delta = _pending.setdefault(client_id, dict.fromkeys(SUMMARY_FIELDS, 0))
+            for field, amount in _contribution(campaign).items():
+                delta[field] += sign * amount
+            if sign > 0 and campaign.get('client_name'):
+                _names[client_id] = campaign['client_name']
+    _schedule_flush()
+
+
+def _on_storage_reloaded(payload: Dict) -> None:
+    # Summary deltas written from memory during the outage may have replaced newer stored ones
+    _mark_stale(None)
+    _schedule_flush()
+
+events.subscribe('campaigns.changed', _on_campaign_changed)
+events.subscribe('storage.recovered', _on_storage_reloaded)
+
+
+async def _aggregate(client_id: Optional[str] = None) -> Dict[str, Dict]:
+    """Summaries computed from the campaigns, of one client or all of them"""
+    match = {"client_id": client_id} if client_id is not None else {}
+    handle = storage.collection('campaigns')
+    if handle is not None:
+        try:
+            number = lambda field: {"$convert": {"input": f"${field}", "to": "double", "onError": 0, "onNull": 0}}
+            groups = await handle.aggregate([
+                {"$match": match},
+                {"$group": {
+                    "_id": "$client_id",
+                    "client_name": {"$last": "$client_name"},
+                    "campaigns": {"$sum": 1},
+                    "active": {"$sum": {"$cond": [{"$eq": ["$status", "active"]}, 1, 0]}},
+                    "budget": {"$sum": number('budget')},
+                    "impressions": {"$sum": number('impressions')},
+                    "clicks": {"$sum": number('clicks')},
+                }},
+            ]).to_list(length=None)
+            return {group.pop("_id"): group for group in groups if group["_id"] is not None}
+        except Exception as e:
+            storage.fail_over(e)
+    summaries: Dict[str, Dict] = {}
+    for campaign in storage.memory['campaigns'].values():
+        key = campaign.get('client_id')
+        if key is None or not storage.matches(campaign, match):
+            continue
+        summary = summaries.setdefault(key, {"client_name": None, **dict.fromkeys(SUMMARY_FIELDS, 0)})
+        for field, amount in _contribution(campaign).items():
+            summary[field] += amount
+        summary["client_name"] = campaign.get('client_name') or summary["client_name"]
+    return summaries
+
+
+async def _store(client_id: str, summary: Optional[Dict], current: Optional[Dict]) -> bool:
+    """
+    Write a recomputed summary (None: the client has no campaigns) unless the stored one
+    changed since current was read; False on such a conflict
+    """
+    if current is None:
+        if summary is None:
+            return True
+        return bool(await storage.insert_missing('campaign_summaries', [{
+            "client_id": client_id,
+            **summary,
+            storage.VERSION_FIELD: 1,
+            "updated_at": datetime.now().isoformat()
+        }]))
+    query = storage.version_query({"client_id": client_id}, current.get(storage.VERSION_FIELD, 0))
+    if summary is None:
+        return await storage.delete_one('campaign_summaries', query)
+    updated = await storage.find_one_and_update('campaign_summaries', query, {
+        **summary,
+        "updated_at": datetime.now().isoformat()
+    }, inc={storage.VERSION_FIELD: 1})
+    return updated is not None
+
+
+def _unchanged(current: Optional[Dict], summary: Optional[Dict]) -> bool:
+    if current is None or summary is None:
+        return current is None and summary is None
+    return all(current.get(field) == value for field, value in summary.items())
+
+
+async def _recompute(client_id: str) -> None:
+    _recomputing.add(client_id)
+    try:
+        for _ in range(RECOMPUTE_ATTEMPTS):
+            # Read before the campaigns, so an increment made in between shows as a version change
+            current = await storage.find_one('campaign_summaries', {"client_id": client_id})
+            summary = (await _aggregate(client_id)).get(client_id)
+            if _unchanged(current, summary) or await _store(client_id, summary, current):
+                campaign_stats["summary_recomputes"] += 1
+                return
+            campaign_stats["summary_conflicts"] += 1
+    finally:
+        _recomputing.discard(client_id)
+
+
+async def _rebuild() -> None:
+    global _rebuilding
+    _rebuilding = True
+    try:
+        stored = {
+            summary['client_id']: summary
+            for summary in await storage.find('campaign_summaries', {}, limit=1000000)
+        }
+        computed = await _aggregate()
+        for client_id in {**stored, **computed}:
+            current, summary = stored.get(client_id), computed.get(client_id)
+            # Usually nothing changed, so a rebuild is mostly two reads
+            if _unchanged(current, summary):
+                continue
+            if not await _store(client_id, summary, current):
+                campaign_stats["summary_conflicts"] += 1
+                _stale.add(client_id)
+        campaign_stats["summary_rebuilds"] += 1
+    finally:
+        _rebuilding = False
+
+
+async def _rebuild_once() -> bool:
+    """Rebuild every summary unless another worker is rebuilding (which covers the writes so far)"""
+    global _rebuild_all
+    _rebuild_all = False
+    token = await storage.acquire_lease(REBUILD_LEASE, REBUILD_LEASE_SECONDS)
+    if token is None:
+        campaign_stats["summary_rebuilds_skipped"] += 1
+        # Its aggregate may already include the writes behind these deltas, so adding
+        # them could count them twice; a versioned recomputation cannot
+        _stale.update(_pending)
+        _pending.clear()
+        return False
+    try:
+        # Covers every pending delta and stale client up to now
+        _pending.clear()
+        _stale.clear()
+        await _rebuild()
+    except Exception:
+        _rebuild_all = True
+        raise
+    finally:
+        await storage.release_lease(REBUILD_LEASE, token)
+    return True
+
+
+async def flush_summaries() -> None:
+    """Add pending campaign deltas to the stored summaries and recompute stale ones"""
+    global _rebuild_all
+    async with _flush_lock:
+        try:
+            if _rebuild_all:
+                await _rebuild_once()
+            pending = dict(_pending)
+            names = dict(_names)
+            stale = set(_stale)
+            _pending.clear()
+            _names.clear()
+            _stale.clear()
+            for client_id in stale:
+                await _recompute(client_id)
+            for client_id, delta in pending.items():
+                if client_id in stale:
+                    continue
+                inc = {field: amount for field, amount in delta.items() if amount}
+                if not inc:
+                    continue
+                fields = {"updated_at": datetime.now().isoformat()}
+                if names.get(client_id):
+                    fields["client_name"] = names[client_id]
+                summary = await storage.find_one_and_update(
+                    'campaign_summaries', {"client_id": client_id}, fields,
+                    inc={**inc, storage.VERSION_FIELD: 1}, upsert=True
+                )
+                campaign_stats["summary_increments"] += 1
+                if summary is not None and summary.get('campaigns', 0) <= 0:
+                    # Only if no other worker added a campaign since
+                    await storage.delete_one('campaign_summaries', storage.version_query(
+                        {"client_id": client_id}, summary.get(storage.VERSION_FIELD, 0)
+                    ))
+        except Exception:
+            # Deltas taken out of pending are lost, so everything is recomputed next time
+            _rebuild_all = True
+            raise
+        campaign_stats["summary_flushes"] += 1
+
+
+def _work_pending() -> bool:
+    return bool(_pending or _stale or _rebuild_all)
+
+
+async def _flush_in_background() -> None:
+    global _flush_task
+    try:
+        # Writes made while a flush runs are picked up by the next round
+        while _work_pending():
+            await flush_summaries()
+    except Exception as e:
+        print(f"Warning: Could not update campaign summaries: {str(e)}")
+    finally:
+        _flush_task = None
+
+
+def _schedule_flush() -> None:
+    global _flush_task
+    if _flush_task is not None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _flush_task = loop.create_task(_flush_in_background())
+
+
+def _public(summary: Dict) -> Dict:
+    impressions = summary.get('impressions') or 0
+    return {
+        "client_id": summary['client_id'],
+        "client_name": summary.get('client_name'),
+        "campaigns": int(summary.get('campaigns') or 0),
+        "active": int(summary.get('active') or 0),
+        "budget": round(summary.get('budget') or 0, 2),
+        "impressions": int(impressions),
+        "clicks": int(summary.get('clicks') or 0),
+        "ctr": round((summary.get('clicks') or 0) / impressions * 100, 2) if impressions else 0,
+        "updated_at": summary.get('updated_at'),
+    }
+
+
+async def get_summaries() -> List[Dict]:
+    """Campaign summaries of every client with campaigns, by total budget"""
+    campaign_stats["summary_reads"] += 1
+    summaries = await storage.find('campaign_summaries', {}, limit=100000)
+    return sorted((_public(summary) for summary in summaries), key=lambda summary: summary["budget"], reverse=True)
+
+
+async def get_summary(client_id: str) -> Optional[Dict]:
+    campaign_stats["summary_reads"] += 1
+    summary = await storage.find_one('campaign_summaries', {"client_id": client_id})
+    return _public(summary) if summary is not None else None
+
+
+async def start() -> None:
+    """Recompute the stored summaries in the background"""
+    _schedule_flush()
+
+
+async def stop() -> None:
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        _flush_task = None
+
+
+def get_campaign_metrics() -> Dict:
+    return {
+        **campaign_stats,
+        "pending_clients": len(_pending),
+        "stale_clients": len(_stale),
+        "rebuild_due": _rebuild_all,
+    }
+
+metrics.register("campaigns", get_campaign_metrics)
@@ -0,0 +1,222 @@
+"""
+Server-sent event feed of content changes
+
+Two sources, chosen per connection:
+- MongoDB change streams (replica sets): every worker's writes are seen, and the
+  event id is the change stream resume token so reconnecting clients resume exactly
+- the in-process change log fed by storage write events (in-memory mode or
+  standalone MongoDB): a bounded ring buffer of recent events with sequence ids
+
+A client that reconnects with a Last-Event-ID that can no longer be resumed gets a
+single 'reset' event and should reload the pending list in full.
+"""
+import asyncio
+import json
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional, Set, Tuple
+from config import get_settings
+import events
+import metrics
+import storage
+
+LOCAL_ID_PREFIX = 'local-'
+
+# Recent content changes: (sequence, event)
+_log: Optional[Deque[Tuple[int, Dict]]] = None
+_sequence = 0
+_subscribers: Set[asyncio.Queue] = set()
+
+# Set once a change stream fails because the deployment does not support them
+_change_streams_supported = True
+
+changefeed_stats = {
+    "events_published": 0,
+    "connections": 0,
+    "resumed": 0,
+    "resets": 0,
+    "dropped_slow_subscribers": 0,
+}
+
+
+def _get_log() -> Deque[Tuple[int, Dict]]:
+    global _log
+    if _log is None:
+        _log = deque(maxlen=get_settings().changefeed_buffer_size)
+    return _log
+
+
+def _on_content_changed(payload: Dict) -> None:
+    global _sequence
+    _sequence += 1
+    event = {
+        "op": payload["op"],
+        "id": payload["key"],
+        "client_id": (payload.get("document") or payload.get("previous") or {}).get("client_id"),
+        "document": payload.get("document"),
+    }
+    _get_log().append((_sequence, event))
+    changefeed_stats["events_published"] += 1
+    for queue in list(_subscribers):
+        try:
+            queue.put_nowait((_sequence, event))
+        except asyncio.QueueFull:
+            # A subscriber that cannot keep up is told to reset instead of buffering without bound
+            _subscribers.discard(queue)
+            changefeed_stats["dropped_slow_subscribers"] += 1
+            queue.get_nowait()
+            queue.put_nowait(None)
+
+events.subscribe('content.changed', _on_content_changed)
+
+
+def format_event(event_id: Optional[str], event_type: str, data: Dict) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _reset_event() -> str:
+    changefeed_stats["resets"] += 1
+    return format_event(None, "reset", {"message": "Resume point expired, reload the list"})
+
+
+def _matches_client(event: Dict, client_id: Optional[str]) -> bool:
+    # Deletes of documents that were never loaded have no client_id, so everyone gets them
+    if not client_id or event.get("client_id") is None:
+        return True
+    return event["client_id"] == client_id
+
+
+async def _local_stream(client_id: Optional[str], last_event_id: Optional[str]) -> AsyncIterator[str]:
+    settings = get_settings()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=settings.changefeed_subscriber_queue_size)
+    _subscribers.add(queue)
+    try:
+        if last_event_id is not None:
+            log = _get_log()
+            try:
+                last_sequence = int(last_event_id[len(LOCAL_ID_PREFIX):])
+            except ValueError:
+                last_sequence = -1
+            oldest = log[0][0] if log else _sequence + 1
+            if last_sequence < 0 or last_sequence > _sequence or last_sequence + 1 < oldest:
+                yield _reset_event()
+            else:
+                changefeed_stats["resumed"] += 1
+                backlog = [(sequence, event) for sequence, event in log if sequence > last_sequence]
+                for sequence, event in backlog:
+                    if _matches_client(event, client_id):
+                        yield format_event(f"{LOCAL_ID_PREFIX}{sequence}", event["op"], event)
+                # Events published after the backlog snapshot are in the queue as well; skip duplicates
+                if backlog:
+                    last_sequence = backlog[-1][0]
+        else:
+            last_sequence = _sequence
+
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=settings.changefeed_keepalive_seconds)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if item is None:
+                yield _reset_event()
+                return
+            sequence, event = item
+            if sequence <= last_sequence or not _matches_client(event, client_id):
+                continue
+            yield format_event(f"{LOCAL_ID_PREFIX}{sequence}", event["op"], event)
+    finally:
+        _subscribers.discard(queue)
+
+
+async def _mongo_stream(client_id: Optional[str], last_event_id: Optional[str]) -> AsyncIterator[str]:
+    """Stream content changes from a MongoDB change stream; raises OperationFailure if unsupported"""
+    settings = get_settings()
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+    if client_id:
+        pipeline.append({"$match": {"$or": [
+            {"fullDocument.client_id": client_id},
+            {"operationType": "delete"},
+        ]}})
+    options = {"full_document": "updateLookup"}
+    if last_event_id:
+        options["resume_after"] = {"_data": last_event_id}
+        changefeed_stats["resumed"] += 1
+
+    loop = asyncio.get_running_loop()
+    handle = storage.collection('content')
+    async with handle.watch(pipeline, **options) as stream:
+        last_sent = loop.time()
+        while stream.alive:
+            change = await stream.try_next()
+            if change is None:
+                if loop.time() - last_sent >= settings.changefeed_keepalive_seconds:
+                    yield ": keepalive\n\n"
+                    last_sent = loop.time()
+                await asyncio.sleep(settings.changefeed_poll_seconds)
+                continue
+            last_sent = loop.time()
+            document = change.get("fullDocument")
+            if document is not None and '_id' in document:
+                document['_id'] = str(document['_id'])
+            op = "update" if change["operationType"] == "replace" else change["operationType"]
+            event = {
+                "op": op,
+                "id": (document or {}).get("id"),
+                "client_id": (document or {}).get("client_id"),
+                "document": document,
+            }
+            if op == "delete":
+                event["_id"] = str(change["documentKey"]["_id"])
+            yield format_event(change["_id"]["_data"], op, event)
+
+
+async def stream_content_changes(client_id: Optional[str], last_event_id: Optional[str]) -> AsyncIterator[str]:
+    """Yield SSE-formatted content change events, resuming after last_event_id when possible"""
+    global _change_streams_supported
+    changefeed_stats["connections"] += 1
+    yield f"retry: {get_settings().changefeed_retry_ms}\n\n"
+
+    local_resume = last_event_id is not None and last_event_id.startswith(LOCAL_ID_PREFIX)
+    if _change_streams_supported and storage.is_mongo_available() and not local_resume:
+        from pymongo.errors import OperationFailure
+        try:
+            async for chunk in _mongo_stream(client_id, last_event_id):
+                yield chunk
+            return
+        except OperationFailure as e:
+            if e.code == 40573:
+                # Standalone server: change streams are not available, use the local log
+                _change_streams_supported = False
+            else:
+                # Typically an expired or invalid resume token
+                print(f"Warning: Content change stream failed: {str(e)}")
+            if last_event_id is not None:
+                yield _reset_event()
+            last_event_id = None
+        except Exception as e:
+            print(f"Warning: Content change stream interrupted: {str(e)}")
+            yield _reset_event()
+            return
+    elif last_event_id is not None and not local_resume:
+        # A change stream token cannot be resumed from the local log
+        yield _reset_event()
+        last_event_id = None
+
+    async for chunk in _local_stream(client_id, last_event_id):
+        yield chunk
+
+
+def get_changefeed_metrics() -> Dict:
+    return {
+        **changefeed_stats,
+        "subscribers": len(_subscribers),
+        "buffered_events": len(_get_log()),
+        "change_streams_supported": _change_streams_supported,
+    }
+
+metrics.register("changefeed", get_changefeed_metrics)
@@ -0,0 +1,197 @@
+"""
+Negotiated response compression for API responses
+
+Complete (non-streaming) responses of a compressible type and at least
+COMPRESSION_MIN_SIZE bytes are compressed with brotli or gzip, whichever the
+client prefers in Accept-Encoding (brotli only when the 'brotli' package is
+installed). Bodies of COMPRESSION_THREAD_MIN_SIZE bytes or more are compressed
+in a worker thread so large responses do not block the event loop.
+
+Streaming responses (server-sent events, exports) and responses that already
+carry a Content-Encoding pass through untouched.
+"""
+import asyncio
+import gzip
+import time
+from typing import Dict, List, Optional
+from config import get_settings
+import metrics
+
+COMPRESSIBLE_TYPES = (
+    'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml',
+    'text/', 'image/svg+xml',
+)
+
+_brotli = None
+_brotli_checked = False
+
+compression_stats = {
+    "responses": 0,
+    "compressed": 0,
+    "skipped_small": 0,
+    "skipped_streaming": 0,
+    "offloaded": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+    "seconds_total": 0.0,
+    "encodings": {},
+}
+
+
+def _get_brotli():
+    global _brotli, _brotli_checked
+    if not _brotli_checked:
+        _brotli_checked = True
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = None
+    return _brotli
+
+
+def available_encodings() -> List[str]:
+    """Encodings this process can produce, preferred first"""
+    encodings = []
+    if get_settings().compression_brotli and _get_brotli() is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+
+def negotiate(accept_encoding: Optional[str], offered: List[str]) -> Optional[str]:
+    """Pick the offered encoding with the highest q-value in Accept-Encoding (ties go to offer order)"""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best = None
+    for encoding in offered:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (encoding, weight)
+    return best[0] if best else None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    settings = get_settings()
+    if encoding == 'br':
+        return _get_brotli().compress(body, quality=settings.compression_brotli_quality)
+    return gzip.compress(body, compresslevel=settings.compression_gzip_level, mtime=0)
+
+
+def _is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    return any(content_type.startswith(prefix) for prefix in COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing complete API responses"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b'accept-encoding':
+                accept_encoding = value.decode('latin-1')
+                break
+        encoding = negotiate(accept_encoding, available_encodings())
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                content_type = headers.get(b'content-type', b'').decode('latin-1')
+                # Partial content must stay byte-identical to the representation the range refers to
+                if (b'content-encoding' in headers or b'content-range' in headers
+                        or message["status"] in (204, 206, 304) or not _is_compressible(content_type)):
+                    passthrough = True
+                    await send(message)
+                    return
+                # Held back until the body shows whether compression applies
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b'')
+            compression_stats["responses"] += 1
+            if message.get("more_body"):
+                compression_stats["skipped_streaming"] += 1
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+            settings = get_settings()
+            if len(body) < settings.compression_min_size:
+                compression_stats["skipped_small"] += 1
+                await send(start_message)
+                await send(message)
+                return
+
+            started = time.perf_counter()
+            if len(body) >= settings.compression_thread_min_size:
+                compression_stats["offloaded"] += 1
+                compressed = await asyncio.to_thread(compress, body, encoding)
+            else:
+                compressed = compress(body, encoding)
+            compression_stats["seconds_total"] += time.perf_counter() - started
+            compression_stats["compressed"] += 1
+            compression_stats["bytes_in"] += len(body)
+            compression_stats["bytes_out"] += len(compressed)
+            compression_stats["encodings"][encoding] = compression_stats["encodings"].get(encoding, 0) + 1
+
+            headers = [
+                (name, value) for name, value in start_message.get("headers", [])
+                if name.lower() not in (b'content-length', b'vary')
+            ]
+            vary = b', '.join(value for name, value in start_message.get("headers", []) if name.lower() == b'vary')
+            if b'accept-encoding' not in vary.lower():
+                vary = vary + b', Accept-Encoding' if vary else b'Accept-Encoding'
+            headers += [
+                (b'content-encoding', encoding.encode()),
+                (b'content-length', str(len(compressed)).encode()),
+                (b'vary', vary),
+            ]
+            await send({**start_message, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, compressing_send)
+
+
+def get_compression_metrics() -> Dict:
+    bytes_in = compression_stats["bytes_in"]
+    compressed = compression_stats["compressed"]
+    return {
+        **compression_stats,
+        "seconds_total": round(compression_stats["seconds_total"], 4),
+        "ratio": round(compression_stats["bytes_out"] / bytes_in, 4) if bytes_in else None,
+        "avg_ms": round(compression_stats["seconds_total"] / compressed * 1000, 3) if compressed else None,
+        "brotli_available": _get_brotli() is not None,
+    }
+
+metrics.register("compression", get_compression_metrics)
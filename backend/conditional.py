@@ -0,0 +1,181 @@
+"""
+Conditional GET support (ETag / Last-Modified) for client, content and campaign reads
+
+- Single documents get a weak ETag from their 'version' field, or from their
+  newest change timestamp (updated_at, edited_at, ...) when they have none
+- List endpoints get a weak ETag from a per-collection change version kept in
+  the 'collection_versions' collection, which every worker reads: the worker
+  that writes a document bumps its collection's version right after the write
+  (and every version is bumped on storage recovery). The version and the list
+  are both read from the primary, version first, so a list body can be newer
+  than its ETag (one extra 200 later) but never older (a stale 304)
+
+Matching requests get 304 Not Modified before the body is read or serialized.
+"""
+import asyncio
+import hashlib
+import time
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Optional, Set
+from fastapi import Request, Response
+import database
+import events
+import metrics
+import storage
+
+COLLECTIONS = ('clients', 'content', 'campaigns')
+
+# Timestamp fields that record a document change, newest wins
+CHANGE_FIELDS = ('updated_at', 'edited_at', 'approved_at', 'published_at', 'onboarded_at', 'created_at')
+
+database.INDEXES.append(('collection_versions', [('name', 1)], {"unique": True}))
+
+# Collections written by this process whose shared version has not been bumped yet
+_dirty: Set[str] = set()
+_bump_task: Optional[asyncio.Task] = None
+
+conditional_stats: Dict[str, Dict] = {}
+version_stats = {"bumps": 0, "bump_errors": 0}
+
+
+async def _bump_dirty() -> None:
+    global _bump_task
+    try:
+        while _dirty:
+            name = _dirty.pop()
+            try:
+                await storage.find_one_and_update(
+                    'collection_versions', {"name": name}, {"changed_at": time.time()},
+                    inc={"version": 1}, upsert=True
+                )
+                version_stats["bumps"] += 1
+            except Exception as e:
+                version_stats["bump_errors"] += 1
+                print(f"Warning: Could not bump the {name} list version: {str(e)}")
+    finally:
+        _bump_task = None
+
+
+def _mark_changed(name: str) -> None:
+    global _bump_task
+    _dirty.add(name)
+    if _bump_task is not None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _bump_task = loop.create_task(_bump_dirty())
+
+
+def _mark_all_changed(payload: Dict) -> None:
+    # Writes made elsewhere during an outage were not observed
+    for name in COLLECTIONS:
+        _mark_changed(name)
+
+
+for _name in COLLECTIONS:
+    events.subscribe(f'{_name}.changed', lambda payload, name=_name: _mark_changed(name))
+events.subscribe('storage.recovered', _mark_all_changed)
+
+
+def _weak_tag(*parts) -> str:
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+async def collection_validator(name: str, variant: str = '') -> Dict:
+    """
+    ETag for a list over a collection (variant: the query parameters); read the list
+    from the primary after this, not with read_only=True
+    """
+    if _bump_task is not None:
+        # This worker's own writes are reflected before it answers
+        await asyncio.shield(_bump_task)
+    document = await storage.find_one('collection_versions', {"name": name}) or {}
+    return {
+        # changed_at tells apart versions replayed from a journal after an outage
+        "etag": _weak_tag(name, document.get('version', 0), document.get('changed_at', ''), variant),
+        # Several workers can change a collection within one second, which an HTTP date cannot tell apart
+        "last_modified": None,
+    }
+
+
+def _parse_timestamp(value) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def document_validator(name: str, key: str, document: Dict) -> Dict:
+    """ETag / Last-Modified for a single document"""
+    stamps = [document.get(field) for field in CHANGE_FIELDS if document.get(field)]
+    changed = max(stamps) if stamps else None
+    return {
+        "etag": _weak_tag(name, key, document.get('version', ''), changed or ''),
+        "last_modified": _parse_timestamp(changed) if changed else None,
+    }
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == '*':
+        return True
+    # Weak comparison: W/ prefixes are ignored
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    candidates = [candidate.strip() for candidate in header.split(',')]
+    return any((candidate[2:] if candidate.startswith('W/') else candidate) == opaque for candidate in candidates)
+
+
+def is_not_modified(request: Request, validator: Dict, endpoint: str) -> bool:
+    """True when the client's cached copy (If-None-Match, else If-Modified-Since) is still current"""
+    stats = conditional_stats.setdefault(endpoint, {"requests": 0, "conditional": 0, "not_modified": 0})
+    stats["requests"] += 1
+    if_none_match = request.headers.get('if-none-match')
+    if_modified_since = request.headers.get('if-modified-since')
+    if not if_none_match and not if_modified_since:
+        return False
+    stats["conditional"] += 1
+    if if_none_match:
+        fresh = _etag_matches(if_none_match, validator["etag"])
+    else:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have one-second resolution
+        fresh = validator["last_modified"] is not None and int(validator["last_modified"]) <= since
+    if fresh:
+        stats["not_modified"] += 1
+    return fresh
+
+
+def set_headers(response: Response, validator: Dict) -> None:
+    response.headers["ETag"] = validator["etag"]
+    if validator["last_modified"] is not None:
+        response.headers["Last-Modified"] = formatdate(validator["last_modified"], usegmt=True)
+    # Cached copies must be revalidated before reuse
+    response.headers["Cache-Control"] = "no-cache"
+
+
+def not_modified(validator: Dict) -> Response:
+    response = Response(status_code=304)
+    set_headers(response, validator)
+    return response
+
+
+def get_conditional_metrics() -> Dict:
+    endpoints = {}
+    for endpoint, stats in conditional_stats.items():
+        endpoints[endpoint] = {
+            **stats,
+            "not_modified_ratio": round(stats["not_modified"] / stats["requests"], 4) if stats["requests"] else None,
+        }
+    return {
+        **version_stats,
+        "pending_bumps": len(_dirty),
+        "endpoints": endpoints,
+    }
+
+metrics.register("conditional", get_conditional_metrics)
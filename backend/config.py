@@ -0,0 +1,275 @@
+"""
+Application settings for CampaignForge backend
+Loads the environment (and .env file) once into a typed settings object
+"""
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+# Collections whose read preference and write concern can be tuned individually
+MONGO_COLLECTIONS = ('clients', 'content', 'campaigns', 'usage', 'idempotency', 'batches', 'campaign_summaries', 'collection_versions', 'leases')
+
+
+def _env_str(name: str, default: Optional[str] = None) -> Optional[str]:
+    value = os.getenv(name)
+    return value if value not in (None, '') else default
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    try:
+        return int(value) if value not in (None, '') else default
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    try:
+        return float(value) if value not in (None, '') else default
+    except ValueError:
+        return default
+
+
+def _env_optional_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    try:
+        return int(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def _env_list(name: str) -> Tuple[str, ...]:
+    value = os.getenv(name) or ''
+    return tuple(item.strip() for item in value.split(',') if item.strip())
+
+
+@dataclass(frozen=True)
+class CollectionSettings:
+    """Per-collection routing: where read-only queries go and how writes are acknowledged"""
+    read_preference: str
+    write_concern: Optional[str]
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Typed view over the backend environment variables"""
+    mongodb_url: str
+    database_name: str
+    mongo_max_pool_size: int
+    mongo_min_pool_size: int
+    mongo_max_idle_time_ms: Optional[int]
+    mongo_wait_queue_timeout_ms: Optional[int]
+    mongo_server_selection_timeout_ms: int
+    mongo_compressors: Tuple[str, ...]
+    mongo_max_staleness_seconds: int
+    mongo_collections: Dict[str, CollectionSettings]
+    storage_journal_path: str
+    storage_monitor_interval: float
+    storage_warm_limit: int
+    storage_replay_batch_size: int
+    client_cache_ttl: float
+    client_cache_max_size: int
+    client_cache_change_stream: bool
+    changefeed_buffer_size: int
+    changefeed_subscriber_queue_size: int
+    changefeed_keepalive_seconds: float
+    changefeed_poll_seconds: float
+    changefeed_retry_ms: int
+    dedup_similarity_threshold: float
+    dedup_auto_regenerate: bool
+    validation_mode: str
+    validation_shorten_max_tokens: int
+    usage_flush_interval: float
+    usage_flush_batch_size: int
+    usage_client_budget_usd: float
+    usage_spend_ttl: float
+    model_small: str
+    model_large: str
+    model_routes: Tuple[str, ...]
+    generation_mode: str
+    combined_generation_model: str
+    combined_max_tokens: int
+    scheduler_enabled: bool
+    scheduler_batch_size: int
+    scheduler_lookahead_seconds: float
+    scheduler_window_size: int
+    scheduler_default_interval: float
+    scheduler_platform_intervals: Tuple[str, ...]
+    scheduler_max_attempts: int
+    scheduler_retry_seconds: float
+    scheduler_lease_seconds: float
+    idempotency_ttl_seconds: int
+    idempotency_wait_seconds: float
+    idempotency_lease_seconds: float
+    bulk_max_items: int
+    archive_target: str
+    archive_dir: str
+    archive_batch_size: int
+    archive_batch_pause_seconds: float
+    archive_upload_grace_seconds: float
+    export_batch_size: int
+    compression_min_size: int
+    compression_thread_min_size: int
+    compression_gzip_level: int
+    compression_brotli: bool
+    compression_brotli_quality: int
+    static_max_age_seconds: int
+    batch_dir: str
+    batch_poll_interval_seconds: float
+    batch_max_requests: int
+    batch_completion_window: str
+    brand_context_chunk_chars: int
+    brand_context_summary_words: int
+    brand_context_snippets: int
+    brand_context_snippet_chars: int
+    brand_context_max_chars: int
+    admission_generation_limit: int
+    admission_bulk_limit: int
+    admission_queue_size: int
+    admission_queue_timeout_seconds: float
+    ready_check_timeout_seconds: float
+    ready_cache_seconds: float
+    profiler_token: Optional[str]
+    profiler_dir: str
+    profiler_interval_ms: float
+    profiler_max_files: int
+    profiler_max_seconds: float
+    openai_api_key: Optional[str]
+    openai_base_url: Optional[str]
+    openai_timeout: float
+    openai_max_retries: int
+    n8n_webhook_url: str
+    n8n_api_key: str
+    warmup_on_startup: bool
+
+    @property
+    def openai_configured(self) -> bool:
+        return bool(self.openai_api_key) and self.openai_api_key != 'your_openai_api_key_here'
+
+
+def load_settings() -> Settings:
+    """Read .env and the process environment into a Settings object"""
+    # Imported here so python-dotenv is only loaded when settings are first needed
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    # Read-only (list/stats) queries default to secondaries; writes always use the primary
+    default_read_preference = _env_str('MONGO_READ_PREFERENCE', 'secondaryPreferred')
+    default_write_concern = _env_str('MONGO_WRITE_CONCERN')
+    mongo_collections = {
+        name: CollectionSettings(
+            read_preference=_env_str(f'MONGO_{name.upper()}_READ_PREFERENCE', default_read_preference),
+            write_concern=_env_str(f'MONGO_{name.upper()}_WRITE_CONCERN', default_write_concern),
+        )
+        for name in MONGO_COLLECTIONS
+    }
+
+    return Settings(
+        mongodb_url=_env_str('MONGODB_URL', 'mongodb://localhost:27017/'),
+        database_name=_env_str('DATABASE_NAME', 'campaignforge'),
+        mongo_max_pool_size=_env_int('MONGO_MAX_POOL_SIZE', 100),
+        mongo_min_pool_size=_env_int('MONGO_MIN_POOL_SIZE', 0),
+        mongo_max_idle_time_ms=_env_optional_int('MONGO_MAX_IDLE_TIME_MS'),
+        mongo_wait_queue_timeout_ms=_env_optional_int('MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+        mongo_server_selection_timeout_ms=_env_int('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+        mongo_compressors=_env_list('MONGO_COMPRESSORS'),
+        mongo_max_staleness_seconds=_env_int('MONGO_MAX_STALENESS_SECONDS', -1),
+        mongo_collections=mongo_collections,
+        storage_journal_path=_env_str('STORAGE_JOURNAL_PATH', 'data/storage_journal.jsonl'),
+        storage_monitor_interval=_env_float('STORAGE_MONITOR_INTERVAL', 5.0),
+        storage_warm_limit=_env_int('STORAGE_WARM_LIMIT', 10000),
+        storage_replay_batch_size=_env_int('STORAGE_REPLAY_BATCH_SIZE', 1000),
+        client_cache_ttl=_env_float('CLIENT_CACHE_TTL', 300.0),
+        client_cache_max_size=_env_int('CLIENT_CACHE_MAX_SIZE', 1024),
+        client_cache_change_stream=_env_bool('CLIENT_CACHE_CHANGE_STREAM', True),
+        changefeed_buffer_size=_env_int('CHANGEFEED_BUFFER_SIZE', 1000),
+        changefeed_subscriber_queue_size=_env_int('CHANGEFEED_SUBSCRIBER_QUEUE_SIZE', 1000),
+        changefeed_keepalive_seconds=_env_float('CHANGEFEED_KEEPALIVE_SECONDS', 15.0),
+        changefeed_poll_seconds=_env_float('CHANGEFEED_POLL_SECONDS', 0.5),
+        changefeed_retry_ms=_env_int('CHANGEFEED_RETRY_MS', 3000),
+        dedup_similarity_threshold=_env_float('DEDUP_SIMILARITY_THRESHOLD', 0.6),
+        dedup_auto_regenerate=_env_bool('DEDUP_AUTO_REGENERATE', False),
+        validation_mode=(_env_str('VALIDATION_MODE', 'truncate') or 'truncate').lower(),
+        validation_shorten_max_tokens=_env_int('VALIDATION_SHORTEN_MAX_TOKENS', 400),
+        usage_flush_interval=_env_float('USAGE_FLUSH_INTERVAL', 5.0),
+        usage_flush_batch_size=_env_int('USAGE_FLUSH_BATCH_SIZE', 500),
+        usage_client_budget_usd=_env_float('USAGE_CLIENT_BUDGET_USD', 0.0),
+        usage_spend_ttl=_env_float('USAGE_SPEND_TTL', 30.0),
+        model_small=_env_str('MODEL_SMALL', 'gpt-4o-mini'),
+        model_large=_env_str('MODEL_LARGE', 'gpt-4'),
+        model_routes=_env_list('MODEL_ROUTES'),
+        generation_mode=(_env_str('GENERATION_MODE', 'per_platform') or 'per_platform').lower(),
+        combined_generation_model=_env_str('COMBINED_GENERATION_MODEL', 'gpt-4o'),
+        combined_max_tokens=_env_int('COMBINED_MAX_TOKENS', 6000),
+        scheduler_enabled=_env_bool('SCHEDULER_ENABLED', True),
+        scheduler_batch_size=_env_int('SCHEDULER_BATCH_SIZE', 20),
+        scheduler_lookahead_seconds=_env_float('SCHEDULER_LOOKAHEAD_SECONDS', 300.0),
+        scheduler_window_size=_env_int('SCHEDULER_WINDOW_SIZE', 5000),
+        scheduler_default_interval=_env_float('SCHEDULER_DEFAULT_INTERVAL', 60.0),
+        scheduler_platform_intervals=_env_list('SCHEDULER_PLATFORM_INTERVALS'),
+        scheduler_max_attempts=_env_int('SCHEDULER_MAX_ATTEMPTS', 3),
+        scheduler_retry_seconds=_env_float('SCHEDULER_RETRY_SECONDS', 60.0),
+        scheduler_lease_seconds=_env_float('SCHEDULER_LEASE_SECONDS', 600.0),
+        idempotency_ttl_seconds=_env_int('IDEMPOTENCY_TTL_SECONDS', 86400),
+        idempotency_wait_seconds=_env_float('IDEMPOTENCY_WAIT_SECONDS', 120.0),
+        idempotency_lease_seconds=_env_float('IDEMPOTENCY_LEASE_SECONDS', 30.0),
+        bulk_max_items=_env_int('BULK_MAX_ITEMS', 10000),
+        archive_target=(_env_str('ARCHIVE_TARGET', 'mongo') or 'mongo').lower(),
+        archive_dir=_env_str('ARCHIVE_DIR', 'data/archive'),
+        archive_batch_size=_env_int('ARCHIVE_BATCH_SIZE', 200),
+        archive_batch_pause_seconds=_env_float('ARCHIVE_BATCH_PAUSE_SECONDS', 0.2),
+        archive_upload_grace_seconds=_env_float('ARCHIVE_UPLOAD_GRACE_SECONDS', 3600.0),
+        export_batch_size=_env_int('EXPORT_BATCH_SIZE', 500),
+        compression_min_size=_env_int('COMPRESSION_MIN_SIZE', 1024),
+        compression_thread_min_size=_env_int('COMPRESSION_THREAD_MIN_SIZE', 65536),
+        compression_gzip_level=_env_int('COMPRESSION_GZIP_LEVEL', 6),
+        compression_brotli=_env_bool('COMPRESSION_BROTLI', True),
+        compression_brotli_quality=_env_int('COMPRESSION_BROTLI_QUALITY', 5),
+        static_max_age_seconds=_env_int('STATIC_MAX_AGE_SECONDS', 3600),
+        batch_dir=_env_str('BATCH_DIR', 'data/batches'),
+        batch_poll_interval_seconds=_env_float('BATCH_POLL_INTERVAL_SECONDS', 60.0),
+        batch_max_requests=_env_int('BATCH_MAX_REQUESTS', 50000),
+        batch_completion_window=_env_str('BATCH_COMPLETION_WINDOW', '24h'),
+        brand_context_chunk_chars=_env_int('BRAND_CONTEXT_CHUNK_CHARS', 12000),
+        brand_context_summary_words=_env_int('BRAND_CONTEXT_SUMMARY_WORDS', 150),
+        brand_context_snippets=_env_int('BRAND_CONTEXT_SNIPPETS', 3),
+        brand_context_snippet_chars=_env_int('BRAND_CONTEXT_SNIPPET_CHARS', 300),
+        brand_context_max_chars=_env_int('BRAND_CONTEXT_MAX_CHARS', 4000),
+        admission_generation_limit=_env_int('ADMISSION_GENERATION_LIMIT', 8),
+        admission_bulk_limit=_env_int('ADMISSION_BULK_LIMIT', 4),
+        admission_queue_size=_env_int('ADMISSION_QUEUE_SIZE', 16),
+        admission_queue_timeout_seconds=_env_float('ADMISSION_QUEUE_TIMEOUT_SECONDS', 10.0),
+        ready_check_timeout_seconds=_env_float('READY_CHECK_TIMEOUT_SECONDS', 2.0),
+        ready_cache_seconds=_env_float('READY_CACHE_SECONDS', 5.0),
+        profiler_token=_env_str('PROFILER_TOKEN'),
+        profiler_dir=_env_str('PROFILER_DIR', 'data/profiles'),
+        profiler_interval_ms=_env_float('PROFILER_INTERVAL_MS', 5.0),
+        profiler_max_files=_env_int('PROFILER_MAX_FILES', 50),
+        profiler_max_seconds=_env_float('PROFILER_MAX_SECONDS', 120.0),
+        openai_api_key=_env_str('OPENAI_API_KEY'),
+        openai_base_url=_env_str('OPENAI_BASE_URL'),
+        openai_timeout=_env_float('OPENAI_TIMEOUT', 60.0),
+        openai_max_retries=_env_int('OPENAI_MAX_RETRIES', 3),
+        n8n_webhook_url=_env_str('N8N_WEBHOOK_URL', 'http://localhost:5678/webhook'),
+        n8n_api_key=_env_str('N8N_API_KEY', ''),
+        warmup_on_startup=_env_bool('WARMUP_ON_STARTUP', True),
+    )
+
+
+# Loaded on first access
+settings = None
+
+def get_settings() -> Settings:
+    """Get the application settings, loading them on first use"""
+    global settings
+    if settings is None:
+        settings = load_settings()
+    return settings
@@ -1,34 +1,198 @@
 """
 Database connection and configuration using Motor (async MongoDB driver)
 """
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# MongoDB connection string
-MONGODB_URL = os.getenv('MONGODB_URL', 'mongodb://localhost:27017/')
-DATABASE_NAME = os.getenv('DATABASE_NAME', 'campaignforge')
+import importlib.util
+from typing import Dict
+from config import get_settings, MONGO_COLLECTIONS
+import metrics
 
 # Global database connection
 client = None
 database = None
 
+# Collection handles, built once per connection
+# - primary handles: default reads and all writes, with the configured write concern
+# - read-only handles: list/stats queries, routed by the per-collection read preference
+_primary_collections: Dict = {}
+_read_only_collections: Dict = {}
+
+# Indexes created on connect: (collection, keys, options)
+INDEXES = [
+    ('clients', [('client_id', 1)], {}),
+    ('content', [('id', 1)], {}),
+    ('content', [('status', 1), ('client_id', 1)], {}),
+    ('campaigns', [('id', 1)], {}),
+]
+
+# Python packages required by each wire compressor (zlib is in the stdlib)
+_COMPRESSOR_MODULES = {'zstd': 'zstandard', 'snappy': 'snappy', 'zlib': 'zlib'}
+
+# Connection pool counters, updated by the pymongo pool listener
+pool_stats = {
+    "pools": 0,
+    "connections_open": 0,
+    "connections_checked_out": 0,
+    "connections_created": 0,
+    "connections_closed": 0,
+    "checkouts": 0,
+    "checkout_failures": 0,
+    "pool_clears": 0,
+}
+
+
+def _available_compressors(requested):
+    """Drop compressors whose Python package is not installed instead of failing to connect"""
+    compressors = []
+    for name in requested:
+        module = _COMPRESSOR_MODULES.get(name)
+        if module is None or importlib.util.find_spec(module) is None:
+            print(f"Warning: MongoDB compressor '{name}' is not available and will be skipped")
+            continue
+        compressors.append(name)
+    return compressors
+
+
+def _build_pool_listener():
+    """Create a pymongo connection pool listener that feeds pool_stats"""
+    from pymongo import monitoring
+
+    class PoolStatsListener(monitoring.ConnectionPoolListener):
+        def pool_created(self, event):
+            pool_stats["pools"] += 1
+
+        def pool_ready(self, event):
+            pass
+
+        def pool_cleared(self, event):
+            pool_stats["pool_clears"] += 1
+
+        def pool_closed(self, event):
+            pool_stats["pools"] = max(0, pool_stats["pools"] - 1)
+
+        def connection_created(self, event):
+            pool_stats["connections_created"] += 1
+            pool_stats["connections_open"] += 1
+
+        def connection_ready(self, event):
+            pass
+
+        def connection_closed(self, event):
+            pool_stats["connections_closed"] += 1
+            pool_stats["connections_open"] = max(0, pool_stats["connections_open"] - 1)
+
+        def connection_check_out_started(self, event):
+            pass
+
+        def connection_check_out_failed(self, event):
+            pool_stats["checkout_failures"] += 1
+
+        def connection_checked_out(self, event):
+            pool_stats["checkouts"] += 1
+            pool_stats["connections_checked_out"] += 1
+
+        def connection_checked_in(self, event):
+            pool_stats["connections_checked_out"] = max(0, pool_stats["connections_checked_out"] - 1)
+
+    return PoolStatsListener()
+
+
+def _read_preference(name: str, max_staleness: int):
+    """Map a read preference mode name to a pymongo read preference"""
+    from pymongo import read_preferences
+
+    modes = {
+        'primary': read_preferences.Primary,
+        'primaryPreferred': read_preferences.PrimaryPreferred,
+        'secondary': read_preferences.Secondary,
+        'secondaryPreferred': read_preferences.SecondaryPreferred,
+        'nearest': read_preferences.Nearest,
+    }
+    mode = modes.get(name)
+    if mode is None:
+        raise ValueError(f"Unknown MongoDB read preference: {name}")
+    if mode is read_preferences.Primary:
+        return mode()
+    return mode(max_staleness=max_staleness)
+
+
+def _write_concern(value):
+    """Build a pymongo write concern from a setting such as 'majority' or '1'"""
+    if value is None:
+        return None
+    from pymongo.write_concern import WriteConcern
+    return WriteConcern(w=int(value) if value.isdigit() else value)
+
+
+def _client_options(settings) -> Dict:
+    options = {
+        "maxPoolSize": settings.mongo_max_pool_size,
+        "minPoolSize": settings.mongo_min_pool_size,
+        "serverSelectionTimeoutMS": settings.mongo_server_selection_timeout_ms,
+        "event_listeners": [_build_pool_listener()],
+    }
+    if settings.mongo_max_idle_time_ms is not None:
+        options["maxIdleTimeMS"] = settings.mongo_max_idle_time_ms
+    if settings.mongo_wait_queue_timeout_ms is not None:
+        options["waitQueueTimeoutMS"] = settings.mongo_wait_queue_timeout_ms
+    compressors = _available_compressors(settings.mongo_compressors)
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+
+def _build_collection_handles(settings):
+    """Create the primary and read-only handle for each configured collection"""
+    from pymongo import ReadPreference
+
+    _primary_collections.clear()
+    _read_only_collections.clear()
+    for name in MONGO_COLLECTIONS:
+        collection_settings = settings.mongo_collections[name]
+        write_concern = _write_concern(collection_settings.write_concern)
+        _primary_collections[name] = database.get_collection(
+            name,
+            read_preference=ReadPreference.PRIMARY,
+            write_concern=write_concern
+        )
+        _read_only_collections[name] = database.get_collection(
+            name,
+            read_preference=_read_preference(
+                collection_settings.read_preference,
+                settings.mongo_max_staleness_seconds
+            ),
+            write_concern=write_concern
+        )
+
+
 async def connect_to_mongo():
     """Connect to MongoDB"""
     global client, database
+    settings = get_settings()
     try:
-        client = AsyncIOMotorClient(MONGODB_URL)
-        database = client[DATABASE_NAME]
+        # Imported here so motor/pymongo are only loaded when connecting
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(settings.mongodb_url, **_client_options(settings))
+        database = client[settings.database_name]
+        _build_collection_handles(settings)
         # Test connection
         await client.admin.command('ping')
-        print(f"✅ Connected to MongoDB: {DATABASE_NAME}")
+        print(f"✅ Connected to MongoDB: {settings.database_name}")
         return database
     except Exception as e:
         print(f"❌ Error connecting to MongoDB: {str(e)}")
         raise
 
+async def ensure_indexes():
+    """Create the indexes in INDEXES (a no-op for indexes that already exist)"""
+    for name, keys, options in INDEXES:
+        try:
+            await get_collection(name).create_index(keys, **options)
+        except Exception as e:
+            from pymongo.errors import ConnectionFailure
+            if isinstance(e, ConnectionFailure):
+                raise
+            print(f"Warning: Could not create index {keys} on {name}: {str(e)}")
+
 async def close_mongo_connection():
     """Close MongoDB connection"""
     global client
@@ -40,17 +204,40 @@ def get_database():
     """Get database instance"""
     return database
 
-def get_clients_collection():
-    """Get clients collection"""
-    db = get_database()
-    return db.clients if db is not None else None
+def get_collection(name: str, read_only: bool = False):
+    """Get a collection handle by name (read_only=True routes reads by the configured read preference)"""
+    if database is None:
+        return None
+    handles = _read_only_collections if read_only else _primary_collections
+    return handles.get(name, database[name])
+
+def get_clients_collection(read_only: bool = False):
+    """Get clients collection (read_only=True routes reads by the configured read preference)"""
+    return get_collection('clients', read_only)
+
+def get_content_collection(read_only: bool = False):
+    """Get content collection (read_only=True routes reads by the configured read preference)"""
+    return get_collection('content', read_only)
+
+def get_campaigns_collection(read_only: bool = False):
+    """Get campaigns collection (read_only=True routes reads by the configured read preference)"""
+    return get_collection('campaigns', read_only)
+
 
-def get_content_collection():
-    """Get content collection"""
-    db = get_database()
-    return db.content if db is not None else None
+def get_pool_metrics() -> Dict:
+    """Connection pool utilization for the metrics endpoint"""
+    settings = get_settings()
+    max_pool_size = settings.mongo_max_pool_size
+    # maxPoolSize applies per server, so capacity grows with the number of pools
+    capacity = max_pool_size * max(1, pool_stats["pools"])
+    return {
+        **pool_stats,
+        "max_pool_size": max_pool_size,
+        "utilization": round(pool_stats["connections_checked_out"] / capacity, 4) if capacity else None,
+        "read_preferences": {
+            name: collection_settings.read_preference
+            for name, collection_settings in settings.mongo_collections.items()
+        },
+    }
 
-def get_campaigns_collection():
-    """Get campaigns collection"""
-    db = get_database()
-    return db.campaigns if db is not None else None
+metrics.register("mongo_pool", get_pool_metrics)
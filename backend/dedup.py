@@ -0,0 +1,357 @@
+"""
+Near-duplicate detection for generated content
+
+Each content item gets a MinHash signature (64 hash functions) over its word
+bigrams, which estimates the Jaccard similarity of two texts. Signatures are
+split into 16 bands of 4 rows and stored in one hash table per band (LSH), so a
+lookup only compares against items sharing at least one band instead of the
+whole collection. Pairs at 0.8 similarity become candidates with probability
+above 0.99, pairs at the default 0.6 threshold with probability about 0.9.
+
+The index covers every content document, not just the ones mirrored in memory:
+it is built at startup (and after storage recovers) from a streamed scan of the
+content collection, hashing a batch at a time on the background thread pool,
+and kept current from content change events. Lookups run in worker threads and
+wait for the first build. While MongoDB is unavailable, the index is built from
+the memory store instead.
+"""
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from config import get_settings
+import events
+import executors
+import metrics
+import storage
+
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+
+# Universal hashing h(x) = (a * x + b) mod p over 64-bit shingle hashes
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+_WORD_RE = re.compile(r"[a-z0-9#@']+")
+
+# Documents read and hashed per step of a build
+BUILD_BATCH_SIZE = 1000
+
+dedup_stats = {
+    "lookups": 0,
+    "lookup_seconds_total": 0.0,
+    "near_duplicates_flagged": 0,
+    "auto_regenerations": 0,
+    "builds": 0,
+    "lookup_errors": 0,
+}
+
+
+def _shingles(text: str) -> Set[int]:
+    words = _WORD_RE.findall(text.lower())
+    grams = [f"{a} {b}" for a, b in zip(words, words[1:])] or words
+    return {
+        int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest(), 'big')
+        for gram in grams
+    }
+
+
+def minhash(text: Optional[str]) -> Tuple[int, ...]:
+    """MinHash signature of text's word bigrams"""
+    shingles = _shingles(text or '')
+    if not shingles:
+        return tuple([_PRIME] * NUM_PERMUTATIONS)
+    return tuple(min((a * x + b) % _PRIME for x in shingles) for a, b in _PERMUTATIONS)
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERMUTATIONS
+
+
+class MinHashLSHIndex:
+    """Banded LSH index of MinHash signatures keyed by content id"""
+
+    def __init__(self):
+        self.signatures: Dict[str, Tuple[int, ...]] = {}
+        # key -> hash of the indexed text, so updates that leave the text alone skip the MinHash
+        self.text_hashes: Dict[str, int] = {}
+        self.bands: List[Dict[Tuple[int, ...], Set[str]]] = [defaultdict(set) for _ in range(BANDS)]
+
+    @staticmethod
+    def _band_values(signature: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+        return [signature[band * ROWS:(band + 1) * ROWS] for band in range(BANDS)]
+
+    def add(self, key: str, text: Optional[str]) -> None:
+        if text and key in self.signatures and self.text_hashes.get(key) == hash(text):
+            return
+        self.remove(key)
+        if not text:
+            return
+        signature = minhash(text)
+        self.signatures[key] = signature
+        self.text_hashes[key] = hash(text)
+        for band, value in enumerate(self._band_values(signature)):
+            self.bands[band][value].add(key)
+
+    def remove(self, key: str) -> None:
+        signature = self.signatures.pop(key, None)
+        self.text_hashes.pop(key, None)
+        if signature is None:
+            return
+        for band, value in enumerate(self._band_values(signature)):
+            bucket = self.bands[band].get(value)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.bands[band][value]
+
+    def query(self, text: Optional[str], threshold: float, exclude: Optional[str] = None) -> List[Dict]:
+        """Items whose estimated similarity to text is at least threshold, most similar first"""
+        if not text:
+            return []
+        signature = minhash(text)
+        candidates: Set[str] = set()
+        for band, value in enumerate(self._band_values(signature)):
+            candidates.update(self.bands[band].get(value, ()))
+        candidates.discard(exclude)
+        matches = []
+        for key in candidates:
+            score = similarity(signature, self.signatures[key])
+            if score >= threshold:
+                matches.append({"id": key, "similarity": round(score, 3)})
+        matches.sort(key=lambda match: match["similarity"], reverse=True)
+        return matches
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+
+_index: Optional[MinHashLSHIndex] = None
+# Lookups run in worker threads (generation) while updates arrive on the event loop;
+# the lock only guards swaps and single updates, never a whole build
+_lock = threading.Lock()
+# One list per build in progress, collecting the changes that arrive while it runs
+_builds: List[List[Dict]] = []
+# Bumped when storage is reloaded, so builds started before it are not installed
+_generation = 0
+
+# The application's event loop, which builds the index (None when the app is not running)
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_build_task: Optional[asyncio.Task] = None
+
+
+def _apply(index: MinHashLSHIndex, payload: Dict) -> None:
+    key = payload["key"]
+    if payload["op"] == 'delete':
+        index.remove(key)
+        return
+    document = payload.get("document") or storage.memory['content'].get(key)
+    if document is not None:
+        index.add(key, document.get('content'))
+
+
+def _add_all(index: MinHashLSHIndex, documents: List[Dict]) -> None:
+    key_field = storage.KEY_FIELDS['content']
+    for document in documents:
+        index.add(document[key_field], document.get('content'))
+
+
+async def _scan() -> AsyncIterator[List[Dict]]:
+    """Key and text of every content document, a batch at a time (the memory store while MongoDB is down)"""
+    key_field = storage.KEY_FIELDS['content']
+    handle = storage.collection('content')
+    if handle is not None:
+        sent = False
+        try:
+            cursor = handle.find({}, {"_id": 0, key_field: 1, "content": 1}).batch_size(BUILD_BATCH_SIZE)
+            batch = []
+            async for document in cursor:
+                batch.append(document)
+                if len(batch) >= BUILD_BATCH_SIZE:
+                    sent = True
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+            return
+        except Exception as e:
+            storage.fail_over(e)
+            if sent:
+                # Part of the collection is hashed already; the next lookup starts over
+                raise
+    documents = list(storage.memory['content'].values())
+    for start in range(0, len(documents), BUILD_BATCH_SIZE):
+        yield documents[start:start + BUILD_BATCH_SIZE]
+
+
+def _install(index: MinHashLSHIndex, changes: List[Dict], generation: int) -> Optional[MinHashLSHIndex]:
+    """Apply the changes made during a build and install its index; None if storage was reloaded meanwhile"""
+    global _index
+    with _lock:
+        _builds.remove(changes)
+        for payload in changes:
+            _apply(index, payload)
+        if _index is not None:
+            # Another build finished first
+            return _index
+        if generation != _generation:
+            return None
+        _index = index
+        dedup_stats["builds"] += 1
+        return index
+
+
+async def _build() -> MinHashLSHIndex:
+    """Build the index from a full scan of the content collection and install it"""
+    while True:
+        with _lock:
+            changes: List[Dict] = []
+            _builds.append(changes)
+            generation = _generation
+        index = MinHashLSHIndex()
+        try:
+            async for documents in _scan():
+                # The MinHash of a batch runs on the background pool, so the event loop keeps serving
+                await executors.run_background(_add_all, index, documents)
+        except BaseException:
+            with _lock:
+                _builds.remove(changes)
+            raise
+        installed = _install(index, changes, generation)
+        if installed is not None:
+            return installed
+
+
+def _build_finished(task: asyncio.Task) -> None:
+    global _build_task
+    if _build_task is task:
+        _build_task = None
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Warning: Could not build the near-duplicate index: {str(task.exception())}")
+
+
+def _schedule_build() -> asyncio.Task:
+    global _build_task
+    if _build_task is None:
+        _build_task = asyncio.get_running_loop().create_task(_build())
+        _build_task.add_done_callback(_build_finished)
+    return _build_task
+
+
+async def _wait_for_index() -> MinHashLSHIndex:
+    if _index is not None:
+        return _index
+    return await asyncio.shield(_schedule_build())
+
+
+def _build_from_memory() -> MinHashLSHIndex:
+    """Build and install the index from the memory store in this thread (when the app is not running)"""
+    with _lock:
+        if _index is not None:
+            return _index
+        changes: List[Dict] = []
+        _builds.append(changes)
+        generation = _generation
+    index = MinHashLSHIndex()
+    try:
+        _add_all(index, list(storage.memory['content'].values()))
+    except BaseException:
+        with _lock:
+            _builds.remove(changes)
+        raise
+    return _install(index, changes, generation) or index
+
+
+def _get_index() -> MinHashLSHIndex:
+    """The index, waiting for the build on first use"""
+    index = _index
+    if index is not None:
+        return index
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if _loop is not None and running is not _loop:
+        # Called from a worker thread: the build streams from MongoDB on the event loop
+        return asyncio.run_coroutine_threadsafe(_wait_for_index(), _loop).result()
+    return _build_from_memory()
+
+
+def _on_content_changed(payload: Dict) -> None:
+    with _lock:
+        for changes in _builds:
+            changes.append(payload)
+        if _index is not None:
+            _apply(_index, payload)
+
+
+def _on_storage_reloaded(payload: Dict) -> None:
+    global _index, _generation
+    with _lock:
+        _index = None
+        _generation += 1
+    if _loop is not None:
+        # Rebuilt in the background; a build already running starts over when it finishes
+        _loop.call_soon_threadsafe(_schedule_build)
+
+events.subscribe('content.changed', _on_content_changed)
+events.subscribe('storage.recovered', _on_storage_reloaded)
+
+
+async def start() -> None:
+    """Build the index in the background, so the first lookup does not wait for the whole scan"""
+    global _loop
+    _loop = asyncio.get_running_loop()
+    _schedule_build()
+
+
+async def stop() -> None:
+    global _loop, _build_task
+    _loop = None
+    if _build_task is not None:
+        _build_task.cancel()
+        _build_task = None
+
+
+def find_near_duplicates(text: Optional[str], exclude: Optional[str] = None) -> List[Dict]:
+    """Existing content items whose text is a near-duplicate of text (call from a worker thread)"""
+    threshold = get_settings().dedup_similarity_threshold
+    started = time.perf_counter()
+    try:
+        index = _get_index()
+    except Exception as e:
+        # Flagging is advisory: content is generated without it until a build succeeds
+        dedup_stats["lookup_errors"] += 1
+        print(f"Warning: Near-duplicate check skipped: {str(e)}")
+        return []
+    with _lock:
+        matches = index.query(text, threshold, exclude=exclude)
+    dedup_stats["lookups"] += 1
+    dedup_stats["lookup_seconds_total"] += time.perf_counter() - started
+    if matches:
+        dedup_stats["near_duplicates_flagged"] += 1
+    return matches
+
+
+def get_dedup_metrics() -> Dict:
+    lookups = dedup_stats["lookups"]
+    return {
+        "lookups": lookups,
+        "avg_lookup_ms": round(dedup_stats["lookup_seconds_total"] / lookups * 1000, 4) if lookups else None,
+        "near_duplicates_flagged": dedup_stats["near_duplicates_flagged"],
+        "auto_regenerations": dedup_stats["auto_regenerations"],
+        "indexed": len(_index) if _index is not None else 0,
+        "builds": dedup_stats["builds"],
+        "building": _build_task is not None,
+        "lookup_errors": dedup_stats["lookup_errors"],
+        "similarity_threshold": get_settings().dedup_similarity_threshold,
+    }
+
+metrics.register("dedup", get_dedup_metrics)
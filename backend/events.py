@@ -0,0 +1,28 @@
+"""
+In-process publish/subscribe bus
+Used as the local stand-in for cross-worker notifications (e.g. cache invalidation)
+"""
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+_subscribers: Dict[str, List[Callable[[Dict], None]]] = defaultdict(list)
+
+
+def subscribe(topic: str, callback: Callable[[Dict], None]) -> None:
+    """Call callback(payload) for every event published on topic"""
+    if callback not in _subscribers[topic]:
+        _subscribers[topic].append(callback)
+
+
+def unsubscribe(topic: str, callback: Callable[[Dict], None]) -> None:
+    if callback in _subscribers[topic]:
+        _subscribers[topic].remove(callback)
+
+
+def publish(topic: str, payload: Dict) -> None:
+    """Deliver payload to the topic's subscribers; a failing subscriber does not stop the others"""
+    for callback in list(_subscribers[topic]):
+        try:
+            callback(payload)
+        except Exception as e:
+            print(f"Warning: Event subscriber for '{topic}' failed: {str(e)}")
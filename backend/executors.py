@@ -0,0 +1,69 @@
+"""
+Thread pools for blocking model calls
+
+- generation: the blocking work of admitted generation requests (onboarding,
+  regenerate), one thread per admission slot so an admitted request never waits
+  for a thread
+- background: work no request waits for (brand-context refreshes after a client
+  edit, and condensing brand-context chunks in parallel), kept small so it cannot
+  take threads from admitted requests
+
+Neither is the default executor, which also serves uploads and response
+compression, so a burst of generation cannot starve cheap reads of threads.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from config import get_settings
+import profiler
+
+# Generation threads when admission is disabled (ADMISSION_GENERATION_LIMIT=0)
+DEFAULT_GENERATION_WORKERS = 8
+
+BACKGROUND_WORKERS = 4
+
+_generation_executor: Optional[ThreadPoolExecutor] = None
+_background_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_generation_executor() -> ThreadPoolExecutor:
+    global _generation_executor
+    if _generation_executor is None:
+        workers = get_settings().admission_generation_limit or DEFAULT_GENERATION_WORKERS
+        _generation_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='generation')
+    return _generation_executor
+
+
+def _get_background_executor() -> ThreadPoolExecutor:
+    global _background_executor
+    if _background_executor is None:
+        _background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix='background')
+    return _background_executor
+
+
+async def _run(executor: ThreadPoolExecutor, func: Callable, *args):
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    # A profiled request also samples the thread doing its work
+    return await loop.run_in_executor(executor, functools.partial(context.run, profiler.traced(func), *args))
+
+
+async def run_generation(func: Callable, *args):
+    """Run blocking work of an admitted generation request, keeping context variables"""
+    return await _run(_get_generation_executor(), func, *args)
+
+
+async def run_background(func: Callable, *args):
+    """Run blocking work that holds no admission slot, keeping context variables"""
+    return await _run(_get_background_executor(), func, *args)
+
+
+def shutdown() -> None:
+    global _generation_executor, _background_executor
+    for executor in (_generation_executor, _background_executor):
+        if executor is not None:
+            executor.shutdown(wait=False)
+    _generation_executor = None
+    _background_executor = None
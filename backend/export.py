@@ -0,0 +1,176 @@
+"""
+Streaming export of content, clients and campaigns
+
+Documents are read from a MongoDB cursor EXPORT_BATCH_SIZE at a time (or from
+the in-memory store in the same batches) and written out as NDJSON or CSV one
+batch per chunk, optionally gzip-compressed as they stream, so memory use does
+not grow with the size of the collection.
+
+When MongoDB is unavailable the export reads the in-memory store instead; when
+it fails mid-export the stream is aborted (the client sees a truncated transfer)
+rather than continued from memory, which may not hold every document.
+"""
+import csv
+import io
+import json
+import time
+import zlib
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from config import get_settings
+import metrics
+import storage
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Per collection: filterable fields, the timestamp used by date_from/date_to, default CSV columns
+EXPORTS = {
+    'content': {
+        'filters': ('platform', 'content_type', 'status', 'client_id'),
+        'date_field': 'created_at',
+        'columns': ('id', 'client_id', 'client_name', 'platform', 'content_type', 'status', 'content', 'created_at'),
+    },
+    'clients': {
+        'filters': ('status', 'industry'),
+        'date_field': 'onboarded_at',
+        'columns': ('client_id', 'company_name', 'industry', 'brand_tone', 'target_audience', 'status', 'onboarded_at'),
+    },
+    'campaigns': {
+        'filters': ('client_id', 'platform', 'status'),
+        'date_field': 'created_at',
+        'columns': ('id', 'name', 'client_id', 'client_name', 'platform', 'budget', 'status', 'start_date', 'end_date', 'created_at'),
+    },
+}
+
+export_stats = {
+    "exports": 0,
+    "documents": 0,
+    "bytes": 0,
+    "aborted": 0,
+    "seconds_total": 0.0,
+}
+
+
+def build_query(name: str, filters: Dict[str, Optional[List[str]]], date_from: Optional[str], date_to: Optional[str]) -> Dict:
+    """Equality/$in filters plus a date range on the collection's timestamp field"""
+    query: Dict = {}
+    for field, values in filters.items():
+        values = [value for value in (values or []) if value and value != 'all']
+        if len(values) == 1:
+            query[field] = values[0]
+        elif values:
+            query[field] = {"$in": values}
+    date_range: Dict = {}
+    if date_from:
+        date_range["$gte"] = date_from
+    if date_to:
+        # Date-only upper bounds include the whole day
+        date_range["$lte"] = f"{date_to}T23:59:59.999999" if len(date_to) == 10 else date_to
+    if date_range:
+        query[EXPORTS[name]['date_field']] = date_range
+    return query
+
+
+def _project(document: Dict, fields: Optional[List[str]]) -> Dict:
+    if fields:
+        return {field: document.get(field) for field in fields}
+    return {key: value for key, value in document.items() if key != '_id'}
+
+
+async def _memory_batches(name: str, query: Dict, batch_size: int) -> AsyncIterator[List[Dict]]:
+    store = storage.memory[name]
+    keys = sorted(store)
+    for start in range(0, len(keys), batch_size):
+        batch = [store.get(key) for key in keys[start:start + batch_size]]
+        yield [dict(document) for document in batch if document is not None and storage.matches(document, query)]
+
+
+async def _batches(name: str, query: Dict, fields: Optional[List[str]]) -> AsyncIterator[List[Dict]]:
+    """Matching documents in key order, a batch at a time"""
+    key_field = storage.KEY_FIELDS[name]
+    batch_size = get_settings().export_batch_size
+    handle = storage.collection(name, read_only=True)
+    if handle is not None:
+        projection = {field: 1 for field in (*fields, key_field)} if fields else {}
+        projection['_id'] = 0
+        sent = False
+        try:
+            cursor = handle.find(query, projection).sort(key_field, 1).batch_size(batch_size)
+            batch = []
+            async for document in cursor:
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    sent = True
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+            return
+        except Exception as e:
+            storage.fail_over(e)
+            if sent:
+                export_stats["aborted"] += 1
+                print(f"Warning: Export of {name} aborted: {str(e)}")
+                raise
+    async for batch in _memory_batches(name, query, batch_size):
+        if batch:
+            yield batch
+
+
+def _ndjson(documents: Iterable[Dict]) -> str:
+    return ''.join(json.dumps(document, default=str) + '\n' for document in documents)
+
+
+def _csv(documents: Iterable[Dict], columns: List[str], header: bool) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    for document in documents:
+        row = []
+        for column in columns:
+            value = document.get(column)
+            # Nested values (images, n8n results) are kept as JSON in a single cell
+            row.append(json.dumps(value, default=str) if isinstance(value, (dict, list)) else value)
+        writer.writerow(row)
+    return buffer.getvalue()
+
+
+async def stream_export(
+    name: str,
+    query: Dict,
+    export_format: str,
+    fields: Optional[List[str]] = None,
+    compress: bool = False
+) -> AsyncIterator[bytes]:
+    """Encoded (and optionally gzip-compressed) export chunks, one per batch"""
+    started = time.perf_counter()
+    export_stats["exports"] += 1
+    columns = list(fields or EXPORTS[name]['columns'])
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    header = True
+    try:
+        if export_format == 'csv':
+            # The header goes out even when nothing matches
+            text = _csv([], columns, header=True)
+            header = False
+            yield compressor.compress(text.encode('utf-8')) if compressor else text.encode('utf-8')
+        async for batch in _batches(name, query, fields):
+            documents = [_project(document, fields) for document in batch]
+            text = _csv(documents, columns, header) if export_format == 'csv' else _ndjson(documents)
+            data = text.encode('utf-8')
+            export_stats["documents"] += len(documents)
+            export_stats["bytes"] += len(data)
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor:
+            yield compressor.flush()
+    finally:
+        export_stats["seconds_total"] += time.perf_counter() - started
+
+
+def get_export_metrics() -> Dict:
+    return {**export_stats, "seconds_total": round(export_stats["seconds_total"], 3)}
+
+metrics.register("export", get_export_metrics)
@@ -0,0 +1,308 @@
+"""
+Idempotency-Key support for mutating endpoints
+
+A POST/PUT/PATCH/DELETE request carrying an Idempotency-Key header runs once:
+its response is stored in the 'idempotency' collection (removed by a TTL index
+after IDEMPOTENCY_TTL_SECONDS) and replayed, with its status and headers, for later
+requests with the same key.
+
+- A duplicate that arrives while the first request is still running waits for
+  its result: in-process through a shared future, across workers by polling the
+  stored record, which is inserted as 'pending' before the work starts
+- A pending record holds a lease (lease_until) that the running worker renews;
+  if the worker dies, a retry takes the request over once the lease has expired
+- Reusing a key with a different request body is rejected with 422
+- 5xx responses are not stored, so the client can retry them
+"""
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+from config import get_settings
+import database
+import metrics
+import storage
+
+HEADER = 'idempotency-key'
+MUTATING_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+database.INDEXES.append(('idempotency', [('key', 1)], {"unique": True}))
+database.INDEXES.append(('idempotency', [('expires_at', 1)], {"expireAfterSeconds": 0}))
+
+# Stored key -> future of the response being computed in this process
+_in_flight: Dict[str, asyncio.Future] = {}
+
+idempotency_stats = {
+    "requests": 0,
+    "executed": 0,
+    "replayed": 0,
+    "joined_in_flight": 0,
+    "waited_on_other_worker": 0,
+    "taken_over": 0,
+    "conflicts": 0,
+    "fingerprint_mismatches": 0,
+}
+
+
+# Recomputed (or added) when a response is sent
+_UNSTORED_HEADERS = ('content-length', 'idempotent-replayed')
+
+
+def _error(status_code: int, message: str) -> Dict:
+    return {
+        "status_code": status_code,
+        "headers": [["content-type", "application/json"]],
+        "body": json.dumps({"success": False, "message": message}),
+    }
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value) -> Optional[datetime]:
+    """A stored time as an aware UTC datetime (pymongo reads naive UTC; old journals held strings)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _expired(record: Dict) -> bool:
+    expires_at = _as_utc(record.get('expires_at'))
+    return expires_at is not None and expires_at <= _utcnow()
+
+
+def _lease_until() -> datetime:
+    return _utcnow() + timedelta(seconds=get_settings().idempotency_lease_seconds)
+
+
+def _lease_expired(record: Dict) -> bool:
+    # Pending records written before leases existed count as abandoned
+    lease_until = _as_utc(record.get('lease_until'))
+    return lease_until is None or lease_until <= _utcnow()
+
+
+def _headers(response: Dict) -> List[List[str]]:
+    """Stored response headers (records from before headers were kept only have content_type)"""
+    if "headers" in response:
+        return response["headers"]
+    return [["content-type", response.get("content_type", "application/json")]]
+
+
+def _is_duplicate_key(error: Exception) -> bool:
+    try:
+        from pymongo.errors import DuplicateKeyError
+    except ImportError:
+        return False
+    return isinstance(error, DuplicateKeyError)
+
+
+async def _load(key: str) -> Optional[Dict]:
+    record = await storage.find_one('idempotency', {"key": key})
+    if record is not None and _expired(record):
+        await storage.delete_one('idempotency', {"key": key})
+        return None
+    return record
+
+
+async def _wait_for_other_worker(key: str) -> None:
+    """Poll a record another worker is computing until it completes, goes away, loses its lease or the wait times out"""
+    idempotency_stats["waited_on_other_worker"] += 1
+    deadline = time.monotonic() + get_settings().idempotency_wait_seconds
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.25)
+        record = await _load(key)
+        if record is None or record.get('state') == 'completed' or _lease_expired(record):
+            return
+
+
+async def _acquire(key: str, fingerprint: str) -> Optional[Dict]:
+    """
+    None once this worker runs the request (it inserted the pending record, or took over
+    one whose lease expired), else the response to return instead
+    """
+    waited = False
+    while True:
+        record = await _load(key)
+        if record is None:
+            try:
+                await storage.insert_one('idempotency', {
+                    "key": key,
+                    "fingerprint": fingerprint,
+                    "state": "pending",
+                    "created_at": datetime.now().isoformat(),
+                    "lease_until": _lease_until(),
+                    "expires_at": _utcnow() + timedelta(seconds=get_settings().idempotency_ttl_seconds),
+                })
+                return None
+            except Exception as e:
+                if not _is_duplicate_key(e):
+                    raise
+                # Another worker inserted the key between our lookup and insert
+                continue
+        if record.get('fingerprint') != fingerprint:
+            idempotency_stats["fingerprint_mismatches"] += 1
+            return _error(422, "Idempotency-Key was already used with a different request")
+        if record.get('state') == 'completed':
+            idempotency_stats["replayed"] += 1
+            return {**record["response"], "replayed": True}
+        if _lease_expired(record):
+            # The worker running it stopped renewing the lease; only one retry gets to take over
+            taken = await storage.find_one_and_update(
+                'idempotency',
+                {"key": key, "state": "pending", "lease_until": record.get('lease_until')},
+                {"lease_until": _lease_until()}
+            )
+            if taken is not None:
+                idempotency_stats["taken_over"] += 1
+                return None
+            continue
+        if waited:
+            idempotency_stats["conflicts"] += 1
+            return _error(409, "A request with this Idempotency-Key is still in progress")
+        waited = True
+        await _wait_for_other_worker(key)
+
+
+async def _renew_lease(key: str) -> None:
+    interval = get_settings().idempotency_lease_seconds / 3
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await storage.update_one('idempotency', {"key": key, "state": "pending"}, {"lease_until": _lease_until()})
+        except Exception as e:
+            print(f"Warning: Could not renew the Idempotency-Key lease: {str(e)}")
+
+
+async def run(key: str, fingerprint: str, call: Callable[[], Awaitable[Dict]]) -> Dict:
+    """
+    Run call() once per key and return its response, shaped
+    {"status_code", "headers", "body", "replayed"}
+    """
+    idempotency_stats["requests"] += 1
+    in_flight = _in_flight.get(key)
+    if in_flight is not None:
+        idempotency_stats["joined_in_flight"] += 1
+        response = await asyncio.shield(in_flight)
+        if response.get("fingerprint") != fingerprint:
+            idempotency_stats["fingerprint_mismatches"] += 1
+            return _error(422, "Idempotency-Key was already used with a different request")
+        return {**response, "replayed": True}
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    owned = False
+    try:
+        response = await _acquire(key, fingerprint)
+        if response is not None:
+            future.set_result({**response, "fingerprint": fingerprint})
+            return response
+
+        owned = True
+        idempotency_stats["executed"] += 1
+        renewal = asyncio.create_task(_renew_lease(key))
+        try:
+            response = await call()
+        finally:
+            renewal.cancel()
+        if response["status_code"] < 500:
+            await storage.update_one('idempotency', {"key": key}, {"state": "completed", "response": response})
+        else:
+            await storage.delete_one('idempotency', {"key": key})
+        future.set_result({**response, "fingerprint": fingerprint})
+        return {**response, "replayed": False}
+    except BaseException as e:
+        if not future.done():
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("Request was cancelled"))
+            # Mark the exception as retrieved when nobody joined
+            future.exception()
+            if owned:
+                await storage.delete_one('idempotency', {"key": key})
+        raise
+    finally:
+        _in_flight.pop(key, None)
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware running mutating requests with an Idempotency-Key through run()"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS:
+            await self.app(scope, receive, send)
+            return
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope["headers"]}
+        idempotency_key = headers.get(HEADER)
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        # Multipart boundaries are random per attempt, so they are left out of the fingerprint
+        content_type = headers.get('content-type', '')
+        fingerprint_body = body
+        if 'boundary=' in content_type:
+            boundary = content_type.split('boundary=', 1)[1].split(';')[0].strip('"').encode('latin-1')
+            fingerprint_body = body.replace(boundary, b'')
+        fingerprint = hashlib.sha256(
+            scope["path"].encode() + b'?' + scope.get("query_string", b'') + b'\n' + fingerprint_body
+        ).hexdigest()
+        key = f"{scope['method']} {scope['path']} {idempotency_key}"
+
+        async def call() -> Dict:
+            sent = False
+
+            async def replay_receive():
+                nonlocal sent
+                if sent:
+                    return {"type": "http.disconnect"}
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+
+            captured = {"status_code": 500, "headers": [], "body": b''}
+
+            async def capture_send(message):
+                if message["type"] == "http.response.start":
+                    captured["status_code"] = message["status"]
+                    captured["headers"] = [
+                        [name.decode('latin-1').lower(), value.decode('latin-1')]
+                        for name, value in message.get("headers", [])
+                        if name.decode('latin-1').lower() not in _UNSTORED_HEADERS
+                    ]
+                elif message["type"] == "http.response.body":
+                    captured["body"] += message.get("body", b'')
+
+            await self.app(scope, replay_receive, capture_send)
+            captured["body"] = captured["body"].decode('utf-8', errors='replace')
+            return captured
+
+        response = await run(key, fingerprint, call)
+        payload = response["body"].encode('utf-8')
+        await send({
+            "type": "http.response.start",
+            "status": response["status_code"],
+            "headers": [
+                *((name.encode('latin-1'), value.encode('latin-1')) for name, value in _headers(response)),
+                (b'content-length', str(len(payload)).encode()),
+                (b'idempotent-replayed', b'true' if response.get("replayed") else b'false'),
+            ],
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+
+def get_idempotency_metrics() -> Dict:
+    return {**idempotency_stats, "in_flight": len(_in_flight)}
+
+metrics.register("idempotency", get_idempotency_metrics)
@@ -1,18 +1,38 @@
-from fastapi import FastAPI, File, UploadFile, Form, Query
+from fastapi import FastAPI, File, UploadFile, Form, Query, Header, Body, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from typing import Optional, List
 from pydantic import BaseModel
 from datetime import datetime
-import uvicorn
+import asyncio
 import uuid
 import os
 from pathlib import Path
 from bson import ObjectId
 from contextlib import asynccontextmanager
-from services import generate_content_for_all_platforms, generate_content, regenerate_content, post_to_n8n
-from database import connect_to_mongo, close_mongo_connection, get_database, get_clients_collection, get_content_collection, get_campaigns_collection
+from config import get_settings
+import metrics
+from services import generate_content_for_all_platforms, generate_content, regenerate_content, check_near_duplicates, post_to_n8n, warmup
+import storage
+import admission
+import archive
+import assets
+import batch
+import brand
+import cache
+import campaigns
+import changefeed
+import compression
+import conditional
+import dedup
+import executors
+import export
+import idempotency
+import profiler
+import search
+import scheduler
+import usage
+import validation
 
 def convert_objectid_to_str(obj):
     """Recursively convert ObjectId to string in dictionaries"""
@@ -24,13 +44,69 @@ def convert_objectid_to_str(obj):
         return [convert_objectid_to_str(item) for item in obj]
     return obj
 
+def _expected_version(body: Optional[dict]) -> Optional[int]:
+    """Version a change is based on (optional 'version' in the request body); ValueError if it is not valid"""
+    version = (body or {}).get('version')
+    if version is None:
+        return None
+    if isinstance(version, bool) or not isinstance(version, int) or version < 0:
+        raise ValueError("version must be a non-negative integer")
+    return version
+
+def _write_failed(kind: str, current: Optional[dict]) -> JSONResponse:
+    """404 for a missing document, 409 with the current document for a version conflict"""
+    if current is None:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": f"{kind} not found"}
+        )
+    return JSONResponse(
+        status_code=409,
+        content={
+            "success": False,
+            "message": f"{kind} was changed by another request, reload it and try again",
+            "current_version": current.get(storage.VERSION_FIELD, 0),
+            "data": current
+        }
+    )
+
+async def _warm_up_then_admit():
+    # warmup() only logs its failures; cancelled at shutdown, it never admits
+    await asyncio.to_thread(warmup)
+    await admission.start()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    await connect_to_mongo()
+    # Startup (falls back to the in-memory store if MongoDB is unreachable)
+    await storage.start()
+    await cache.start()
+    await usage.start()
+    await scheduler.start()
+    await archive.start()
+    await batch.start()
+    await campaigns.start()
+    await dedup.start()
+    # Report ready (and admit expensive requests) only once everything above is running and
+    # the OpenAI/requests SDKs are loaded (in the background instead of at import time)
+    warmup_task = None
+    if get_settings().warmup_on_startup:
+        warmup_task = asyncio.create_task(_warm_up_then_admit())
+    else:
+        await admission.start()
     yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
     # Shutdown
-    await close_mongo_connection()
+    await admission.stop()
+    await dedup.stop()
+    executors.shutdown()
+    await campaigns.stop()
+    await batch.stop()
+    await archive.stop()
+    await scheduler.stop()
+    await usage.stop()
+    await cache.stop()
+    await storage.stop()
 
 app = FastAPI(title="CampaignForge API", version="1.0.0", lifespan=lifespan)
 
@@ -38,8 +114,16 @@ app = FastAPI(title="CampaignForge API", version="1.0.0", lifespan=lifespan)
 UPLOAD_DIR = Path("uploads/images")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-# Serve uploaded images statically
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Serve uploaded images statically (cache headers, conditional requests, byte ranges)
+app.mount("/uploads", assets.StaticAssets(directory="uploads"), name="uploads")
+
+# Replay stored responses for retried mutating requests (Idempotency-Key header);
+# added before CORS so CORS headers are applied to replayed responses too
+app.add_middleware(idempotency.IdempotencyMiddleware)
+
+# Queue or shed onboarding/regenerate/bulk requests above their in-flight limits (429/503 with
+# Retry-After); outside idempotency so shed requests are not stored as their key's response
+app.add_middleware(admission.AdmissionMiddleware)
 
 # CORS middleware to allow frontend requests
 app.add_middleware(
@@ -50,6 +134,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so replayed idempotent responses are compressed as well
+app.add_middleware(compression.CompressionMiddleware)
+
+# Samples requests that carry X-Profiler-Token or hit a route armed through /api/admin/profiler;
+# outside everything else, so admission queueing and compression show up in profiles too
+app.add_middleware(profiler.ProfilerMiddleware)
+
 # Pydantic models for request validation
 class ClientOnboardingRequest(BaseModel):
     brand_tone: str
@@ -64,7 +155,7 @@ class ClientOnboardingRequest(BaseModel):
     budget_range: Optional[str] = None
     primary_channels: Optional[str] = None
 
-# MongoDB collections will be accessed via helper functions from database.py
+# Data access goes through storage.py (MongoDB with in-memory failover)
 
 @app.get("/")
 async def root():
@@ -74,6 +165,100 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness for load balancers: dependency health and generation queue depth (503 when not ready)"""
+    result = await admission.readiness()
+    return JSONResponse(status_code=200 if result["ready"] else 503, content=result)
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Get in-process metrics (connection pool utilization, caches, ...)"""
+    return {
+        "success": True,
+        "timestamp": datetime.now().isoformat(),
+        "metrics": metrics.snapshot()
+    }
+
+# Profiler admin endpoints (need PROFILER_TOKEN, sent as X-Profiler-Token)
+PROFILER_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+def _profiler_denied(token: Optional[str]) -> Optional[JSONResponse]:
+    if not profiler.enabled():
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Profiler is disabled (set PROFILER_TOKEN)"}
+        )
+    if not profiler.authorized(token):
+        return JSONResponse(
+            status_code=403,
+            content={"success": False, "message": "Missing or invalid X-Profiler-Token"}
+        )
+    return None
+
+@app.post("/api/admin/profiler")
+async def arm_profiler(request: dict, x_profiler_token: Optional[str] = Header(None)):
+    """Profile the next requests to a route ({"route": "/api/content/{content_id}/regenerate", "method": "POST", "count": 5})"""
+    denied = _profiler_denied(x_profiler_token)
+    if denied is not None:
+        return denied
+    route = request.get('route')
+    method = str(request.get('method', 'POST')).upper()
+    count = request.get('count', 1)
+    if not isinstance(route, str) or not route.startswith('/') or method not in PROFILER_METHODS:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": f"route must be a path template and method one of: {', '.join(PROFILER_METHODS)}"}
+        )
+    if isinstance(count, bool) or not isinstance(count, int) or not 1 <= count <= profiler.MAX_ARMED_COUNT:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": f"count must be between 1 and {profiler.MAX_ARMED_COUNT}"}
+        )
+    entry = profiler.arm(method, route, count)
+    return {
+        "success": True,
+        "message": f"Profiling the next {entry['remaining']} {method} {route} requests",
+        "armed": entry
+    }
+
+@app.get("/api/admin/profiler")
+async def get_profiler(x_profiler_token: Optional[str] = Header(None)):
+    """Armed routes and stored profiles, newest first"""
+    denied = _profiler_denied(x_profiler_token)
+    if denied is not None:
+        return denied
+    return {
+        "success": True,
+        "armed": profiler.armed(),
+        "profiles": await asyncio.to_thread(profiler.list_profiles)
+    }
+
+@app.delete("/api/admin/profiler")
+async def disarm_profiler(x_profiler_token: Optional[str] = Header(None)):
+    """Stop profiling armed routes"""
+    denied = _profiler_denied(x_profiler_token)
+    if denied is not None:
+        return denied
+    return {
+        "success": True,
+        "message": f"Disarmed {profiler.disarm()} routes"
+    }
+
+@app.get("/api/admin/profiler/profiles/{name}")
+async def download_profile(name: str, x_profiler_token: Optional[str] = Header(None)):
+    """A stored profile in collapsed-stack format (flamegraph.pl, speedscope, inferno)"""
+    denied = _profiler_denied(x_profiler_token)
+    if denied is not None:
+        return denied
+    path = profiler.profile_path(name)
+    if path is None:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Profile not found"}
+        )
+    return FileResponse(path, media_type="text/plain; charset=utf-8")
+
 @app.post("/api/client/onboard")
 async def onboard_client(
     brand_tone: str = Form(...),
@@ -159,32 +344,23 @@ async def onboard_client(
             "status": "onboarded"
         }
         
-        # Save to MongoDB
-        clients_collection = get_clients_collection()
-        if clients_collection is not None:
-            await clients_collection.insert_one(client_data)
-        else:
-            # Fallback to in-memory if DB not connected
-            if not hasattr(app.state, 'clients_db'):
-                app.state.clients_db = []
-            app.state.clients_db.append(client_data)
+        # Save to MongoDB (or the in-memory store while MongoDB is unavailable)
+        await storage.insert_one('clients', client_data)
         
         # Generate initial content for all platforms
         try:
-            generated_content = generate_content_for_all_platforms(client_data)
-            content_collection = get_content_collection()
+            with usage.context('onboard', client_uuid):
+                # Condense pasted examples once instead of resending them with every prompt
+                await brand.refresh(client_data)
+                # Blocking OpenAI calls run on the generation thread pool so the event loop
+                # (and the default executor serving reads) stays responsive
+                generated_content = await executors.run_generation(generate_content_for_all_platforms, client_data)
             
             for content_item in generated_content:
                 content_item['id'] = str(uuid.uuid4())
                 content_item['created_at'] = datetime.now().isoformat()
-                
-                if content_collection is not None:
-                    await content_collection.insert_one(content_item)
-                else:
-                    # Fallback to in-memory
-                    if not hasattr(app.state, 'content_db'):
-                        app.state.content_db = []
-                    app.state.content_db.append(content_item)
+            
+            await storage.insert_many('content', generated_content)
         except Exception as e:
             print(f"Warning: Could not generate initial content: {str(e)}")
         
@@ -211,75 +387,117 @@ async def onboard_client(
         )
 
 @app.get("/api/clients")
-async def get_clients():
+async def get_clients(request: Request, response: Response):
     """Get all onboarded clients"""
-    clients_collection = get_clients_collection()
-    
-    if clients_collection is not None:
-        clients = await clients_collection.find({}).to_list(length=1000)
-        # Convert ObjectId to string for JSON serialization
-        for client in clients:
-            if '_id' in client:
-                client['_id'] = str(client['_id'])
-        return {
-            "success": True,
-            "count": len(clients),
-            "clients": clients
-        }
-    else:
-        # Fallback to in-memory
-        clients_db = getattr(app.state, 'clients_db', [])
-        return {
-            "success": True,
-            "count": len(clients_db),
-            "clients": clients_db
-        }
+    validator = await conditional.collection_validator('clients')
+    if conditional.is_not_modified(request, validator, 'clients'):
+        return conditional.not_modified(validator)
+    
+    # From the primary, like the version in the ETag, so the body is never older than the ETag
+    clients = await storage.find('clients', {}, limit=1000)
+    conditional.set_headers(response, validator)
+    return {
+        "success": True,
+        "count": len(clients),
+        "clients": clients
+    }
 
 @app.get("/api/client/{client_id}")
-async def get_client(client_id: str):
+async def get_client(client_id: str, request: Request, response: Response):
     """Get specific client by ID"""
-    clients_collection = get_clients_collection()
-    
-    if clients_collection is not None:
-        client = await clients_collection.find_one({"client_id": client_id})
-        if client is not None:
-            if '_id' in client:
-                client['_id'] = str(client['_id'])
-            return {"success": True, "client": client}
-    else:
-        # Fallback to in-memory
-        clients_db = getattr(app.state, 'clients_db', [])
-        client = next((c for c in clients_db if c["client_id"] == client_id), None)
-        if client is not None:
-            return {"success": True, "client": client}
+    client = await cache.get_client(client_id)
+    if client is not None:
+        validator = conditional.document_validator('clients', client_id, client)
+        if conditional.is_not_modified(request, validator, 'client'):
+            return conditional.not_modified(validator)
+        conditional.set_headers(response, validator)
+        return {"success": True, "client": client}
     
     return JSONResponse(
         status_code=404,
         content={"success": False, "message": "Client not found"}
     )
 
+@app.put("/api/client/{client_id}")
+async def update_client(client_id: str, request: dict):
+    """Update a client's profile"""
+    update_data = {k: v for k, v in request.items() if k not in ('client_id', '_id', 'onboarded_at', 'brand_context')}
+    update_data['updated_at'] = datetime.now().isoformat()
+    
+    updated = await storage.update_one('clients', {"client_id": client_id}, update_data)
+    if not updated:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Client not found"}
+        )
+    cache.invalidate_client(client_id)
+    if update_data.get('company_name'):
+        # Campaigns and content copy the name; only documents with the old name are written
+        await campaigns.propagate_client_name(client_id, update_data['company_name'])
+    if any(field in update_data for field in brand.SOURCE_FIELDS):
+        # Re-condensed in the background; only changed chunks go to the model again
+        brand.schedule_refresh(client_id)
+    
+    client = await storage.find_one('clients', {"client_id": client_id})
+    return {
+        "success": True,
+        "message": "Client updated",
+        "client": client
+    }
+
+async def _submit_client_job(client_id: str, mode: str):
+    client = await storage.find_one('clients', {"client_id": client_id})
+    if client is None:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Client not found"}
+        )
+    job = await archive.submit(client, mode)
+    return JSONResponse(
+        status_code=202,
+        content={
+            "success": True,
+            "message": f"Client {mode} job queued",
+            "job": job
+        }
+    )
+
+@app.post("/api/client/{client_id}/archive")
+async def archive_client(client_id: str):
+    """Move a client with its content and campaigns to the archive (background job)"""
+    return await _submit_client_job(client_id, 'archive')
+
+@app.delete("/api/client/{client_id}")
+async def delete_client(client_id: str):
+    """Delete a client with its content, campaigns and uploaded images (background job)"""
+    return await _submit_client_job(client_id, 'delete')
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Status and progress of a client archive/delete job"""
+    job = archive.get_job(job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Job not found"}
+        )
+    return {"success": True, "job": job}
+
 # Content Management Endpoints
 @app.get("/api/content/pending")
-async def get_pending_content(client_id: Optional[str] = Query(None)):
+async def get_pending_content(request: Request, response: Response, client_id: Optional[str] = Query(None)):
     """Get all pending content for approval"""
-    content_collection = get_content_collection()
+    validator = await conditional.collection_validator('content', f"pending:{client_id or 'all'}")
+    if conditional.is_not_modified(request, validator, 'content_pending'):
+        return conditional.not_modified(validator)
     
-    if content_collection is not None:
-        query = {"status": "pending"}
-        if client_id and client_id != 'all':
-            query["client_id"] = client_id
-        
-        pending = await content_collection.find(query).to_list(length=1000)
-        # Convert ObjectId to string
-        for item in pending:
-            if '_id' in item:
-                item['_id'] = str(item['_id'])
-    else:
-        # Fallback to in-memory
-        content_db = getattr(app.state, 'content_db', [])
-        pending = [c for c in content_db if c.get('status') == 'pending']
-        if client_id and client_id != 'all':
-            pending = [c for c in pending if c.get('client_id') == client_id]
+    query = {"status": "pending"}
+    if client_id and client_id != 'all':
+        query["client_id"] = client_id
+    
+    # From the primary, like the version in the ETag, so the body is never older than the ETag
+    pending = await storage.find('content', query, limit=1000)
+    conditional.set_headers(response, validator)
     
     return {
         "success": True,
@@ -287,142 +505,431 @@ async def get_pending_content(client_id: Optional[str] = Query(None)):
         "content": pending
     }
 
-@app.post("/api/content/{content_id}/approve")
-async def approve_content_endpoint(content_id: str):
-    """Approve content and post to n8n"""
-    content_collection = get_content_collection()
-    clients_collection = get_clients_collection()
-    
-    if content_collection is not None:
-        content = await content_collection.find_one({"id": content_id})
-        if content is None:
-            return JSONResponse(
-                status_code=404,
-                content={"success": False, "message": "Content not found"}
+@app.get("/api/content/search")
+async def search_content_endpoint(
+    q: Optional[str] = Query(None),
+    platform: Optional[List[str]] = Query(None),
+    content_type: Optional[List[str]] = Query(None),
+    status: Optional[List[str]] = Query(None),
+    client_id: Optional[List[str]] = Query(None),
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=200)
+):
+    """Search content by keywords with platform/content_type/status/client facets and a date range"""
+    result = await search.search_content(
+        q=q,
+        filters={
+            "platform": platform,
+            "content_type": content_type,
+            "status": status,
+            "client_id": client_id
+        },
+        date_from=date_from,
+        date_to=date_to,
+        page=page,
+        page_size=page_size
+    )
+    return {
+        "success": True,
+        "query": q,
+        "page": page,
+        "page_size": page_size,
+        "count": result["total"],
+        "content": result["results"],
+        "facets": result["facets"],
+        # Served from memory during a MongoDB outage, which holds only part of the content
+        "partial": result["partial"]
+    }
+
+@app.get("/api/content/stream")
+async def stream_content(
+    client_id: Optional[str] = Query(None),
+    last_event_id: Optional[str] = Header(None),
+    resume_after: Optional[str] = Query(None)
+):
+    """Server-sent events for content inserts, updates and deletes"""
+    if client_id == 'all':
+        client_id = None
+    return StreamingResponse(
+        changefeed.stream_content_changes(client_id, last_event_id or resume_after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+BULK_STATUSES = ('pending', 'approved')
+# Content in these publish states is already on its way out, so it is not approved again
+ACTIVE_PUBLISH_STATUSES = ('scheduled', 'publishing', 'published')
+
+async def _bulk_target(request: dict):
+    """
+    Query for the content a bulk request selects, from {"ids": [...]} or a
+    {"filter": {...}} over the search facets and a created_at range; returns
+    (query, requested ids or None, error response or None)
+    """
+    max_items = get_settings().bulk_max_items
+    ids = request.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(content_id, str) for content_id in ids):
+            return None, None, JSONResponse(
+                status_code=400,
+                content={"success": False, "message": "ids must be a list of content ids"}
             )
-        
-        # Update status
-        await content_collection.update_one(
-            {"id": content_id},
-            {"$set": {
-                "status": "approved",
-                "approved_at": datetime.now().isoformat()
-            }}
+        if len(ids) > max_items:
+            return None, None, JSONResponse(
+                status_code=400,
+                content={"success": False, "message": f"At most {max_items} items per bulk request"}
+            )
+        ids = list(dict.fromkeys(ids))
+        return {"id": {"$in": ids}}, ids, None
+    
+    selection = request.get('filter')
+    if not isinstance(selection, dict):
+        return None, None, JSONResponse(
+            status_code=400,
+            content={"success": False, "message": "Provide ids or a filter"}
         )
-        content['status'] = 'approved'
-        content['approved_at'] = datetime.now().isoformat()
-        
-        # Get client data
-        if clients_collection is not None:
-            client = await clients_collection.find_one({"client_id": content.get('client_id')})
+    # Facet values may be given as a single value or a list
+    query = search.build_filters(
+        {field: value if isinstance(value, list) else [value] for field, value in selection.items()
+         if field in search.FACET_FIELDS},
+        date_from=selection.get('date_from'),
+        date_to=selection.get('date_to')
+    )
+    if not query:
+        return None, None, JSONResponse(
+            status_code=400,
+            content={"success": False, "message": "The filter must select by at least one field"}
+        )
+    matched = await storage.count('content', query)
+    if matched > max_items:
+        return None, None, JSONResponse(
+            status_code=400,
+            content={"success": False, "message": f"Filter matches {matched} items, at most {max_items} per bulk request"}
+        )
+    return query, None, None
+
+def _bulk_summary(results: List[dict]) -> dict:
+    counts = {}
+    for result in results:
+        counts[result["result"]] = counts.get(result["result"], 0) + 1
+    return {"success": True, "count": len(results), "summary": counts, "results": results}
+
+@app.post("/api/content/bulk/delete")
+async def bulk_delete_content(request: dict):
+    """Delete content by ids or filter ({"ids": [...]} or {"filter": {"client_id": ..., "status": "pending"}})"""
+    query, ids, error = await _bulk_target(request)
+    if error is not None:
+        return error
+    deleted = set(await storage.delete_many('content', query))
+    targets = ids if ids is not None else sorted(deleted)
+    return _bulk_summary([
+        {"id": content_id, "result": "deleted" if content_id in deleted else "not_found"}
+        for content_id in targets
+    ])
+
+@app.post("/api/content/bulk/edit")
+async def bulk_edit_content(request: dict):
+    """Edit several content items in one write ({"items": [{"id": ..., "content": ...}]})"""
+    items = request.get('items')
+    max_items = get_settings().bulk_max_items
+    if not isinstance(items, list):
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": "items must be a list of {id, content}"}
+        )
+    if len(items) > max_items:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": f"At most {max_items} items per bulk request"}
+        )
+    
+    valid = {}
+    for item in items:
+        if isinstance(item, dict) and isinstance(item.get('id'), str) and isinstance(item.get('content'), str):
+            valid[item['id']] = item['content']
+    existing = await storage.find('content', {"id": {"$in": list(valid)}}, limit=len(valid))
+    platforms = {content['id']: content.get('platform') for content in existing}
+    
+    edited_at = datetime.now().isoformat()
+    updated = set(await storage.bulk_update('content', {
+        content_id: {"content": valid[content_id], "edited_at": edited_at}
+        for content_id in platforms
+    }, inc={storage.VERSION_FIELD: 1}))
+    
+    results = []
+    for item in items:
+        content_id = item.get('id') if isinstance(item, dict) else None
+        if content_id not in valid:
+            results.append({"id": content_id, "result": "invalid"})
+        elif content_id not in updated:
+            results.append({"id": content_id, "result": "not_found"})
         else:
-            clients_db = getattr(app.state, 'clients_db', [])
-            client = next((c for c in clients_db if c["client_id"] == content.get('client_id')), None)
-        
-        # Post to n8n
-        if client is not None:
-            n8n_result = post_to_n8n(
-                platform=content.get('platform'),
-                content=content.get('content'),
-                client_data=client
-            )
-            await content_collection.update_one(
-                {"id": content_id},
-                {"$set": {"n8n_result": n8n_result}}
-            )
-            content['n8n_result'] = n8n_result
-        
-        if '_id' in content:
-            content['_id'] = str(content['_id'])
-    else:
-        # Fallback to in-memory
-        content_db = getattr(app.state, 'content_db', [])
-        clients_db = getattr(app.state, 'clients_db', [])
-        content = next((c for c in content_db if c.get('id') == content_id), None)
+            results.append({
+                "id": content_id,
+                "result": "updated",
+                "violations": validation.validate(platforms[content_id], valid[content_id])
+            })
+    return _bulk_summary(results)
+
+@app.post("/api/content/bulk/status")
+async def bulk_update_status(request: dict):
+    """
+    Set the status of content selected by ids or filter ({"status": "pending" | "approved"}).
+    Approved items are scheduled for publishing; content over its platform limits, already
+    scheduled or published is skipped, and content being published cannot go back to pending.
+    """
+    status = request.get('status')
+    if status not in BULK_STATUSES:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": f"status must be one of: {', '.join(BULK_STATUSES)}"}
+        )
+    scheduler_enabled = get_settings().scheduler_enabled
+    if status == 'approved' and not scheduler_enabled:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": "Bulk approval requires the scheduler (SCHEDULER_ENABLED)"}
+        )
+    query, ids, error = await _bulk_target(request)
+    if error is not None:
+        return error
+    
+    contents = await storage.find('content', query, limit=get_settings().bulk_max_items)
+    now = datetime.now().isoformat()
+    updates = {}
+    outcomes = {}
+    for content in contents:
+        content_id = content['id']
+        publish_status = content.get('publish_status')
+        if status == 'approved' and publish_status in ACTIVE_PUBLISH_STATUSES:
+            outcomes[content_id] = {"id": content_id, "result": "skipped", "publish_status": publish_status}
+            continue
+        if status == 'pending' and publish_status == 'publishing':
+            outcomes[content_id] = {"id": content_id, "result": "refused", "publish_status": publish_status}
+            continue
+        if status == 'approved':
+            violations = validation.validate(content.get('platform'), content.get('content'))
+            if violations:
+                outcomes[content_id] = {"id": content_id, "result": "invalid", "violations": violations}
+                continue
+            updates[content_id] = {
+                "status": "approved",
+                "approved_at": now,
+                "publish_status": "scheduled",
+                "scheduled_at": scheduler.assign_slot(content.get('platform')),
+                "publish_attempts": 0
+            }
+        else:
+            updates[content_id] = {"status": status}
+            if content.get('publish_status') == 'scheduled':
+                # Back to review: the scheduled post must not go out
+                updates[content_id]["publish_status"] = "cancelled"
+    
+    # Written only while publish_status is what was read, so a concurrent claim is never overwritten
+    updated = await storage.bulk_update(
+        'content', updates, inc={storage.VERSION_FIELD: 1},
+        conditions={content['id']: {"publish_status": content.get('publish_status')} for content in contents}
+    )
+    platforms = {content['id']: content.get('platform') for content in contents}
+    for content_id in updated:
+        fields = updates[content_id]
+        outcomes[content_id] = {"id": content_id, "result": "updated"}
+        if fields.get("publish_status") == "scheduled":
+            scheduler.enqueue(content_id, platforms[content_id], fields["scheduled_at"])
+            outcomes[content_id]["scheduled_at"] = fields["scheduled_at"]
+    
+    for content_id in updates:
+        outcomes.setdefault(content_id, {"id": content_id, "result": "conflict"})
+    
+    targets = ids if ids is not None else [content['id'] for content in contents]
+    return _bulk_summary([outcomes.get(content_id, {"id": content_id, "result": "not_found"}) for content_id in targets])
+
+@app.post("/api/content/{content_id}/approve")
+async def approve_content_endpoint(content_id: str, request: Optional[dict] = Body(None)):
+    """
+    Approve content and schedule it for posting to n8n
+    (optional body: {"scheduled_at": ISO time, "version": the version being approved})
+    """
+    try:
+        expected_version = _expected_version(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "message": str(e)})
+    approved_at = datetime.now().isoformat()
+    fields = {
+        "status": "approved",
+        "approved_at": approved_at
+    }
+    if not get_settings().scheduler_enabled:
+        return await _approve_and_post(content_id, fields, expected_version)
+    
+    content = await storage.find_one('content', {"id": content_id})
+    if content is None or (expected_version is not None and content.get(storage.VERSION_FIELD, 0) != expected_version):
+        return _write_failed('Content', content)
+    if content.get('publish_status') in ACTIVE_PUBLISH_STATUSES:
+        return _already_publishing(content)
+    
+    # Content edited past the platform limits would only be rejected by n8n
+    violations = validation.validate(content.get('platform'), content.get('content'))
+    if violations:
+        return _limits_exceeded(content, violations)
+    
+    try:
+        scheduled_at = scheduler.assign_slot(content.get('platform'), (request or {}).get('scheduled_at'))
+    except (TypeError, ValueError):
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": "scheduled_at must be an ISO 8601 time"}
+        )
+    fields.update({"publish_status": "scheduled", "scheduled_at": scheduled_at, "publish_attempts": 0})
+    # Only the validated version is approved; an edit or approval that landed since is a conflict
+    content, current = await storage.update_versioned('content', content_id, fields, content.get(storage.VERSION_FIELD, 0))
+    if content is None:
+        return _write_failed('Content', current)
+    scheduler.enqueue(content_id, content.get('platform'), scheduled_at)
+    return {
+        "success": True,
+        "message": f"Content approved and scheduled for {scheduled_at}",
+        "data": content
+    }
+
+def _already_publishing(content: dict) -> JSONResponse:
+    return JSONResponse(
+        status_code=409,
+        content={
+            "success": False,
+            "message": f"Content is already {content.get('publish_status')}",
+            "data": content
+        }
+    )
+
+def _limits_exceeded(content: dict, violations: list) -> JSONResponse:
+    return JSONResponse(
+        status_code=422,
+        content={
+            "success": False,
+            "message": f"Content exceeds {content.get('platform')} limits",
+            "violations": violations
+        }
+    )
+
+async def _approve_and_post(content_id: str, fields: dict, expected_version: Optional[int]):
+    """Approve and post immediately: claim, post to n8n, store the result (two writes)"""
+    # The claim is the read: it only matches content that is not scheduled, publishing or
+    # published (and at the expected version), so a concurrent approval gets a 409, not a second post
+    claim = {**fields, "publish_status": "publishing", "claimed_at": fields["approved_at"]}
+    query = {"id": content_id, "publish_status": {"$nin": list(ACTIVE_PUBLISH_STATUSES)}}
+    if expected_version is not None:
+        query = storage.version_query(query, expected_version)
+    previous = await storage.find_one_and_update('content', query, claim, inc={storage.VERSION_FIELD: 1}, return_before=True)
+    if previous is None:
+        current = await storage.find_one('content', {"id": content_id})
+        if current is not None and current.get('publish_status') in ACTIVE_PUBLISH_STATUSES:
+            return _already_publishing(current)
+        return _write_failed('Content', current)
+    content = {**previous, **claim, storage.VERSION_FIELD: previous.get(storage.VERSION_FIELD, 0) + 1}
+    # What the claim replaced, written back if the content is not posted after all
+    unclaimed = {field: previous.get(field) for field in claim}
+    
+    # Content edited past the platform limits would only be rejected by n8n
+    violations = validation.validate(content.get('platform'), content.get('content'))
+    if violations:
+        await storage.update_versioned('content', content_id, unclaimed, content[storage.VERSION_FIELD])
+        return _limits_exceeded(content, violations)
+    
+    client = await cache.get_client(content.get('client_id'))
+    if client is None:
+        content, current = await storage.update_versioned('content', content_id, {
+            "publish_status": unclaimed["publish_status"],
+            "claimed_at": unclaimed["claimed_at"]
+        })
         if content is None:
-            return JSONResponse(
-                status_code=404,
-                content={"success": False, "message": "Content not found"}
-            )
-        
-        content['status'] = 'approved'
-        content['approved_at'] = datetime.now().isoformat()
-        
-        client = next((c for c in clients_db if c["client_id"] == content.get('client_id')), None)
-        
-        if client is not None:
-            n8n_result = post_to_n8n(
-                platform=content.get('platform'),
-                content=content.get('content'),
-                client_data=client
-            )
-            content['n8n_result'] = n8n_result
+            return _write_failed('Content', current)
+        return {
+            "success": True,
+            "message": "Content approved (client not found, not posted)",
+            "data": content
+        }
+    
+    n8n_result = await asyncio.to_thread(
+        post_to_n8n,
+        platform=content.get('platform'),
+        content=content.get('content'),
+        client_data=client
+    )
+    published = bool(n8n_result.get('success'))
+    result_fields = {"n8n_result": n8n_result, "publish_status": "published" if published else "failed"}
+    if published:
+        result_fields["published_at"] = datetime.now().isoformat()
+    # The post went out under the claim, so its result is stored whatever changed since
+    content, current = await storage.update_versioned('content', content_id, result_fields)
+    if content is None:
+        return _write_failed('Content', current)
     
     return {
         "success": True,
-        "message": "Content approved and posted",
+        "message": "Content approved and posted" if published else "Content approved, posting to n8n failed",
         "data": content
     }
 
+@app.get("/api/schedule")
+async def get_schedule(platform: Optional[str] = Query(None), limit: int = Query(100, ge=1, le=1000)):
+    """Approved content waiting to be published, in publish order"""
+    if platform == 'all':
+        platform = None
+    items = await scheduler.upcoming(platform, limit)
+    return {
+        "success": True,
+        "count": len(items),
+        "scheduled": items
+    }
+
+@app.delete("/api/content/{content_id}/schedule")
+async def cancel_schedule(content_id: str):
+    """Cancel a scheduled post that has not been published yet"""
+    cancelled = await scheduler.cancel(content_id)
+    if not cancelled:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "No scheduled post for this content"}
+        )
+    return {
+        "success": True,
+        "message": "Scheduled post cancelled"
+    }
+
 @app.put("/api/content/{content_id}/edit")
 async def edit_content_endpoint(content_id: str, request: dict):
-    """Edit content"""
-    content_collection = get_content_collection()
+    """Edit content (optional 'version': the edit only applies to that version, else 409)"""
+    try:
+        expected_version = _expected_version(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "message": str(e)})
     
-    if content_collection is not None:
-        content = await content_collection.find_one({"id": content_id})
-        if content is None:
-            return JSONResponse(
-                status_code=404,
-                content={"success": False, "message": "Content not found"}
-            )
-        
-        await content_collection.update_one(
-            {"id": content_id},
-            {"$set": {
-                "content": request.get('content', content['content']),
-                "edited_at": datetime.now().isoformat()
-            }}
-        )
-        content['content'] = request.get('content', content['content'])
-        content['edited_at'] = datetime.now().isoformat()
-        if '_id' in content:
-            content['_id'] = str(content['_id'])
-    else:
-        # Fallback to in-memory
-        content_db = getattr(app.state, 'content_db', [])
-        content = next((c for c in content_db if c.get('id') == content_id), None)
-        if content is None:
-            return JSONResponse(
-                status_code=404,
-                content={"success": False, "message": "Content not found"}
-            )
-        
-        content['content'] = request.get('content', content['content'])
-        content['edited_at'] = datetime.now().isoformat()
+    fields = {"edited_at": datetime.now().isoformat()}
+    if 'content' in request:
+        fields['content'] = request['content']
+    content, current = await storage.update_versioned('content', content_id, fields, expected_version)
+    if content is None:
+        return _write_failed('Content', current)
     
     return {
         "success": True,
         "message": "Content updated",
-        "data": content
+        "data": content,
+        "violations": validation.validate(content.get('platform'), content.get('content'))
     }
 
 @app.delete("/api/content/{content_id}")
 async def delete_content_endpoint(content_id: str):
     """Delete content"""
-    content_collection = get_content_collection()
-    
-    if content_collection is not None:
-        result = await content_collection.delete_one({"id": content_id})
-        if result.deleted_count == 0:
-            return JSONResponse(
-                status_code=404,
-                content={"success": False, "message": "Content not found"}
-            )
-    else:
-        # Fallback to in-memory
-        if hasattr(app.state, 'content_db'):
-            app.state.content_db = [c for c in app.state.content_db if c.get('id') != content_id]
+    deleted = await storage.delete_one('content', {"id": content_id})
+    if not deleted:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Content not found"}
+        )
     
     return {
         "success": True,
@@ -431,35 +938,16 @@ async def delete_content_endpoint(content_id: str):
 
 @app.post("/api/content/{content_id}/regenerate")
 async def regenerate_content_endpoint(content_id: str, request: dict):
-    """Regenerate content"""
-    content_collection = get_content_collection()
-    clients_collection = get_clients_collection()
+    """Regenerate content (optional 'version': only regenerate that version, else 409)"""
+    try:
+        expected_version = _expected_version(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "message": str(e)})
+    content = await storage.find_one('content', {"id": content_id})
+    if content is None or (expected_version is not None and content.get(storage.VERSION_FIELD, 0) != expected_version):
+        return _write_failed('Content', content)
     
-    if content_collection is not None:
-        content = await content_collection.find_one({"id": content_id})
-        if content is None:
-            return JSONResponse(
-                status_code=404,
-                content={"success": False, "message": "Content not found"}
-            )
-        
-        if clients_collection is not None:
-            client = await clients_collection.find_one({"client_id": content.get('client_id')})
-        else:
-            clients_db = getattr(app.state, 'clients_db', [])
-            client = next((c for c in clients_db if c["client_id"] == content.get('client_id')), None)
-    else:
-        # Fallback to in-memory
-        content_db = getattr(app.state, 'content_db', [])
-        clients_db = getattr(app.state, 'clients_db', [])
-        content = next((c for c in content_db if c.get('id') == content_id), None)
-        if content is None:
-            return JSONResponse(
-                status_code=404,
-                content={"success": False, "message": "Content not found"}
-            )
-        
-        client = next((c for c in clients_db if c["client_id"] == content.get('client_id')), None)
+    client = await cache.get_client(content.get('client_id'))
     
     if client is None:
         return JSONResponse(
@@ -467,6 +955,13 @@ async def regenerate_content_endpoint(content_id: str, request: dict):
             content={"success": False, "message": "Client not found"}
         )
     
+    over_budget = await usage.check_budget(client)
+    if over_budget is not None:
+        return JSONResponse(
+            status_code=429,
+            content={"success": False, "message": "Monthly generation budget exceeded", **over_budget}
+        )
+    
     try:
         # Get existing content for regeneration
         existing_content = content.get('content', '')
@@ -474,34 +969,30 @@ async def regenerate_content_endpoint(content_id: str, request: dict):
         content_type = request.get('content_type', content.get('content_type'))
         improvement_focus = request.get('improvement_focus', None)
         
-        # Regenerate content with improved prompt
-        new_content = regenerate_content(
-            client_data=client,
-            platform=platform,
-            content_type=content_type,
-            existing_content=existing_content,
-            improvement_focus=improvement_focus
-        )
-        
-        # Update content with regenerated version
-        regeneration_count = content.get('regeneration_count', 0) + 1
-        
-        if content_collection is not None:
-            await content_collection.update_one(
-                {"id": content_id},
-                {"$set": {
-                    "content": new_content,
-                    "regenerated_at": datetime.now().isoformat(),
-                    "regeneration_count": regeneration_count
-                }}
+        def regenerate():
+            # Regenerate content with improved prompt
+            new_content = regenerate_content(
+                client_data=client,
+                platform=platform,
+                content_type=content_type,
+                existing_content=existing_content,
+                improvement_focus=improvement_focus
             )
+            return check_near_duplicates(client, platform, content_type, new_content, exclude=content_id)
         
-        content['content'] = new_content
-        content['regenerated_at'] = datetime.now().isoformat()
-        content['regeneration_count'] = regeneration_count
+        with usage.context('regenerate', client['client_id']):
+            new_content, duplicates = await executors.run_generation(regenerate)
         
-        if '_id' in content:
-            content['_id'] = str(content['_id'])
+        # Update content with regenerated version, unless it was edited while the model ran
+        fields = {
+            "content": new_content,
+            "regenerated_at": datetime.now().isoformat(),
+            "regeneration_count": content.get('regeneration_count', 0) + 1,
+            "near_duplicate_of": duplicates
+        }
+        content, current = await storage.update_versioned('content', content_id, fields, content.get(storage.VERSION_FIELD, 0))
+        if content is None:
+            return _write_failed('Content', current)
         
         return {
             "success": True,
@@ -514,6 +1005,159 @@ async def regenerate_content_endpoint(content_id: str, request: dict):
             content={"success": False, "message": f"Error regenerating content: {str(e)}"}
         )
 
+# Batch Generation Endpoints
+@app.post("/api/batch")
+async def create_batch_job(request: dict):
+    """Queue an offline generate/regenerate run for many clients through the OpenAI Batch API"""
+    mode = request.get('mode', 'generate')
+    if mode not in batch.MODES:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": f"mode must be one of: {', '.join(batch.MODES)}"}
+        )
+    client_ids = request.get('client_ids')
+    platforms = request.get('platforms')
+    for name, value in (('client_ids', client_ids), ('platforms', platforms)):
+        if value is not None and (not isinstance(value, list) or not value):
+            return JSONResponse(
+                status_code=400,
+                content={"success": False, "message": f"{name} must be a non-empty list"}
+            )
+    if not get_settings().openai_configured:
+        return JSONResponse(
+            status_code=503,
+            content={"success": False, "message": "OpenAI API key not configured"}
+        )
+    job = await batch.submit(
+        mode,
+        client_ids=client_ids,
+        topic=request.get('topic'),
+        improvement_focus=request.get('improvement_focus'),
+        platforms=platforms
+    )
+    return JSONResponse(
+        status_code=202,
+        content={"success": True, "message": "Batch job queued", "job": job}
+    )
+
+@app.get("/api/batch")
+async def list_batch_jobs(limit: int = Query(50, ge=1, le=1000)):
+    """Batch jobs, most recent first"""
+    jobs = await batch.list_jobs(limit)
+    return {"success": True, "count": len(jobs), "jobs": jobs}
+
+@app.get("/api/batch/{job_id}")
+async def get_batch_job(job_id: str):
+    """Status, per-batch progress and result counts of a batch job"""
+    job = await batch.get_job(job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Batch job not found"}
+        )
+    return {"success": True, "job": job}
+
+@app.post("/api/batch/{job_id}/cancel")
+async def cancel_batch_job(job_id: str):
+    """Cancel a submitted batch job; results that already finished are still written"""
+    try:
+        job = await batch.cancel(job_id)
+    except Exception as e:
+        return JSONResponse(
+            status_code=502,
+            content={"success": False, "message": f"Error cancelling batch job: {str(e)}"}
+        )
+    if job is None:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Batch job not found"}
+        )
+    return {"success": True, "job": job}
+
+# Usage Endpoints
+@app.get("/api/usage")
+async def get_usage(
+    group_by: str = Query("client_id"),
+    client_id: Optional[str] = Query(None),
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None)
+):
+    """OpenAI tokens, images and estimated cost grouped by client_id/platform/endpoint/day/model"""
+    fields = [field.strip() for field in group_by.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in usage.GROUP_FIELDS]
+    if unknown or not fields:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "success": False,
+                "message": f"group_by must be a comma separated list of: {', '.join(usage.GROUP_FIELDS)}"
+            }
+        )
+    
+    groups = await usage.aggregate(fields, client_id=client_id, date_from=date_from, date_to=date_to)
+    return {
+        "success": True,
+        "group_by": fields,
+        "total_cost_usd": round(sum(group["cost_usd"] for group in groups), 6),
+        "count": len(groups),
+        "usage": groups
+    }
+
+# Export Endpoints
+@app.get("/api/export/{collection}")
+async def export_collection(
+    collection: str,
+    format: str = Query('ndjson'),
+    fields: Optional[str] = Query(None),
+    platform: Optional[List[str]] = Query(None),
+    content_type: Optional[List[str]] = Query(None),
+    status: Optional[List[str]] = Query(None),
+    client_id: Optional[List[str]] = Query(None),
+    industry: Optional[List[str]] = Query(None),
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None),
+    accept_encoding: Optional[str] = Header(None)
+):
+    """Stream every matching content item, client or campaign as NDJSON or CSV (gzip when accepted)"""
+    if collection not in export.EXPORTS:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": f"Exports are available for: {', '.join(export.EXPORTS)}"}
+        )
+    if format not in export.FORMATS:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": f"format must be one of: {', '.join(export.FORMATS)}"}
+        )
+    requested = {
+        "platform": platform, "content_type": content_type, "status": status,
+        "client_id": client_id, "industry": industry
+    }
+    unsupported = [field for field, values in requested.items() if values and field not in export.EXPORTS[collection]['filters']]
+    if unsupported:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": f"Unsupported filters for {collection}: {', '.join(unsupported)}"}
+        )
+    query = export.build_query(
+        collection,
+        {field: values for field, values in requested.items() if values},
+        date_from,
+        date_to
+    )
+    field_list = [field.strip() for field in (fields or '').split(',') if field.strip()] or None
+    compress = compression.negotiate(accept_encoding, ['gzip']) == 'gzip'
+    
+    filename = f"{collection}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        export.stream_export(collection, query, format, field_list, compress),
+        media_type=export.FORMATS[format],
+        headers=headers
+    )
+
 # Analytics Endpoints
 @app.get("/api/analytics")
 async def get_analytics(time_range: str = Query("7d")):
@@ -549,24 +1193,10 @@ async def get_analytics(time_range: str = Query("7d")):
 @app.get("/api/dashboard/stats")
 async def get_dashboard_stats():
     """Get dashboard statistics"""
-    clients_collection = get_clients_collection()
-    content_collection = get_content_collection()
-    campaigns_collection = get_campaigns_collection()
-    
-    if clients_collection is not None and content_collection is not None and campaigns_collection is not None:
-        total_clients = await clients_collection.count_documents({})
-        pending_content = await content_collection.count_documents({"status": "pending"})
-        approved_content = await content_collection.count_documents({"status": "approved"})
-        active_campaigns = await campaigns_collection.count_documents({"status": "active"})
-    else:
-        # Fallback to in-memory
-        clients_db = getattr(app.state, 'clients_db', [])
-        content_db = getattr(app.state, 'content_db', [])
-        campaigns_db = getattr(app.state, 'campaigns_db', [])
-        total_clients = len(clients_db)
-        pending_content = len([c for c in content_db if c.get('status') == 'pending'])
-        approved_content = len([c for c in content_db if c.get('status') == 'approved'])
-        active_campaigns = len([c for c in campaigns_db if c.get('status') == 'active'])
+    total_clients = await storage.count('clients', {}, read_only=True)
+    pending_content = await storage.count('content', {"status": "pending"}, read_only=True)
+    approved_content = await storage.count('content', {"status": "approved"}, read_only=True)
+    active_campaigns = await storage.count('campaigns', {"status": "active"}, read_only=True)
     
     return {
         "success": True,
@@ -578,47 +1208,82 @@ async def get_dashboard_stats():
 
 # Campaign Endpoints
 @app.get("/api/campaigns")
-async def get_campaigns():
-    """Get all campaigns"""
-    campaigns_collection = get_campaigns_collection()
-    
-    if campaigns_collection is not None:
-        campaigns = await campaigns_collection.find({}).to_list(length=1000)
-        for campaign in campaigns:
-            if '_id' in campaign:
-                campaign['_id'] = str(campaign['_id'])
-        return {
-            "success": True,
-            "count": len(campaigns),
-            "campaigns": campaigns
-        }
-    else:
-        # Fallback to in-memory
-        campaigns_db = getattr(app.state, 'campaigns_db', [])
-        return {
-            "success": True,
-            "count": len(campaigns_db),
-            "campaigns": campaigns_db
-        }
+async def get_campaigns(
+    request: Request,
+    response: Response,
+    client_id: Optional[List[str]] = Query(None),
+    platform: Optional[List[str]] = Query(None),
+    status: Optional[List[str]] = Query(None),
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None),
+    sort: str = Query('created_at'),
+    order: str = Query('desc'),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(100, ge=1, le=1000)
+):
+    """Campaigns filtered by client/platform/status and running between date_from and date_to, sorted and paged"""
+    validator = await conditional.collection_validator('campaigns', request.url.query)
+    if conditional.is_not_modified(request, validator, 'campaigns'):
+        return conditional.not_modified(validator)
+    
+    try:
+        result = await campaigns.list_campaigns(
+            filters={"client_id": client_id, "platform": platform, "status": status},
+            date_from=date_from,
+            date_to=date_to,
+            sort=sort,
+            order=order,
+            page=page,
+            page_size=page_size,
+            # From the primary, like the version in the ETag, so the body is never older than the ETag
+            read_only=False
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "message": str(e)})
+    conditional.set_headers(response, validator)
+    return {
+        "success": True,
+        "page": page,
+        "page_size": page_size,
+        "count": result["total"],
+        "campaigns": result["campaigns"]
+    }
+
+@app.get("/api/campaigns/summaries")
+async def get_campaign_summaries():
+    """Per-client campaign totals: campaigns, active campaigns, budget, impressions, clicks, CTR"""
+    summaries = await campaigns.get_summaries()
+    return {
+        "success": True,
+        "count": len(summaries),
+        "summaries": summaries
+    }
+
+@app.get("/api/campaigns/summaries/{client_id}")
+async def get_campaign_summary(client_id: str):
+    """Campaign totals of one client"""
+    summary = await campaigns.get_summary(client_id)
+    if summary is None:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "No campaigns for this client"}
+        )
+    return {"success": True, "summary": summary}
 
 @app.post("/api/campaigns")
 async def create_campaign_endpoint(campaign: dict):
     """Create a new campaign"""
+    try:
+        campaign = campaigns.normalize(campaign)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "message": str(e)})
     campaign_uuid = str(uuid.uuid4())
-    clients_collection = get_clients_collection()
-    campaigns_collection = get_campaigns_collection()
     
     # Get client name
     client_name = "Unknown"
-    if clients_collection is not None:
-        client = await clients_collection.find_one({"client_id": campaign.get("client_id")})
-        if client is not None:
-            client_name = client.get("company_name", "Unknown")
-    else:
-        clients_db = getattr(app.state, 'clients_db', [])
-        client = next((c for c in clients_db if c["client_id"] == campaign.get("client_id")), None)
-        if client is not None:
-            client_name = client.get("company_name", "Unknown")
+    client = await cache.get_client(campaign.get("client_id"))
+    if client is not None:
+        client_name = client.get("company_name", "Unknown")
     
     campaign_data = {
         "id": campaign_uuid,
@@ -638,13 +1303,7 @@ async def create_campaign_endpoint(campaign: dict):
         "created_at": datetime.now().isoformat()
     }
     
-    if campaigns_collection is not None:
-        await campaigns_collection.insert_one(campaign_data)
-    else:
-        # Fallback to in-memory
-        if not hasattr(app.state, 'campaigns_db'):
-            app.state.campaigns_db = []
-        app.state.campaigns_db.append(campaign_data)
+    await storage.insert_one('campaigns', campaign_data)
     
     # Convert ObjectId to string for JSON serialization
     campaign_data_serializable = convert_objectid_to_str(campaign_data)
@@ -657,43 +1316,25 @@ async def create_campaign_endpoint(campaign: dict):
 
 @app.put("/api/campaigns/{campaign_id}")
 async def update_campaign_endpoint(campaign_id: str, campaign: dict):
-    """Update a campaign"""
-    campaigns_collection = get_campaigns_collection()
+    """Update a campaign (optional 'version': the update only applies to that version, else 409)"""
+    try:
+        expected_version = _expected_version(campaign)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "message": str(e)})
     
-    if campaigns_collection is not None:
-        campaign_item = await campaigns_collection.find_one({"id": campaign_id})
-        if campaign_item is None:
-            return JSONResponse(
-                status_code=404,
-                content={"success": False, "message": "Campaign not found"}
-            )
-        
-        update_data = {k: v for k, v in campaign.items() if k != 'id'}
-        update_data['updated_at'] = datetime.now().isoformat()
-        
-        await campaigns_collection.update_one(
-            {"id": campaign_id},
-            {"$set": update_data}
-        )
-        
-        campaign_item.update(update_data)
-        if '_id' in campaign_item:
-            campaign_item['_id'] = str(campaign_item['_id'])
-    else:
-        # Fallback to in-memory
-        campaigns_db = getattr(app.state, 'campaigns_db', [])
-        campaign_item = next((c for c in campaigns_db if c.get('id') == campaign_id), None)
-        if campaign_item is None:
-            return JSONResponse(
-                status_code=404,
-                content={"success": False, "message": "Campaign not found"}
-            )
-        
-        for key, value in campaign.items():
-            if key != 'id':
-                campaign_item[key] = value
-        
-        campaign_item['updated_at'] = datetime.now().isoformat()
+    try:
+        update_data = campaigns.normalize({k: v for k, v in campaign.items() if k not in ('id', '_id', storage.VERSION_FIELD)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "message": str(e)})
+    if 'client_id' in update_data:
+        # Moved to another client: client_name follows, as on create
+        client = await cache.get_client(update_data['client_id'])
+        update_data['client_name'] = client.get("company_name", "Unknown") if client is not None else "Unknown"
+    update_data['updated_at'] = datetime.now().isoformat()
+    
+    campaign_item, current = await storage.update_versioned('campaigns', campaign_id, update_data, expected_version)
+    if campaign_item is None:
+        return _write_failed('Campaign', current)
     
     return {
         "success": True,
@@ -704,19 +1345,12 @@ async def update_campaign_endpoint(campaign_id: str, campaign: dict):
 @app.delete("/api/campaigns/{campaign_id}")
 async def delete_campaign_endpoint(campaign_id: str):
     """Delete a campaign"""
-    campaigns_collection = get_campaigns_collection()
-    
-    if campaigns_collection is not None:
-        result = await campaigns_collection.delete_one({"id": campaign_id})
-        if result.deleted_count == 0:
-            return JSONResponse(
-                status_code=404,
-                content={"success": False, "message": "Campaign not found"}
-            )
-    else:
-        # Fallback to in-memory
-        if hasattr(app.state, 'campaigns_db'):
-            app.state.campaigns_db = [c for c in app.state.campaigns_db if c.get('id') != campaign_id]
+    deleted = await storage.delete_one('campaigns', {"id": campaign_id})
+    if not deleted:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Campaign not found"}
+        )
     
     return {
         "success": True,
@@ -724,4 +1358,5 @@ async def delete_campaign_endpoint(campaign_id: str):
     }
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,23 @@
+"""
+Lightweight in-process metrics registry
+Each subsystem registers a callable returning a JSON-serializable snapshot
+"""
+from typing import Callable, Dict
+
+_providers: Dict[str, Callable[[], Dict]] = {}
+
+
+def register(name: str, provider: Callable[[], Dict]) -> None:
+    """Register (or replace) the snapshot provider for a metrics section"""
+    _providers[name] = provider
+
+
+def snapshot() -> Dict:
+    """Collect the current value of every registered metrics section"""
+    sections = {}
+    for name, provider in _providers.items():
+        try:
+            sections[name] = provider()
+        except Exception as e:
+            sections[name] = {"error": str(e)}
+    return sections
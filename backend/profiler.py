@@ -0,0 +1,376 @@
+"""
+On-demand sampling profiler for individual requests
+
+Profiling is off unless PROFILER_TOKEN is set. A request is then profiled when
+it carries the token in an X-Profiler-Token header, or when an admin armed its
+route for the next N requests (POST /api/admin/profiler with the same header).
+
+While at least one request is profiled, a background thread samples every
+PROFILER_INTERVAL_MS. Sampling is async-aware, so each request is sampled on
+its own even while other requests share the event loop:
+
+- when the request's task is running, the event loop thread's stack is sampled
+- when it is suspended, the task's await chain is sampled instead, which shows
+  wall time spent waiting on MongoDB, OpenAI or a worker thread; blocking work
+  on the generation and background pools (executors) adds that thread's stack
+
+Each profile is written to PROFILER_DIR in collapsed-stack format ("frame;frame
+count" per line), which flamegraph.pl, speedscope and inferno read directly.
+Only the newest PROFILER_MAX_FILES files are kept. When nothing is armed and no
+header is sent, a request costs one header scan.
+"""
+import asyncio
+import contextvars
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from starlette.routing import compile_path
+from config import get_settings
+import metrics
+
+HEADER = b'x-profiler-token'
+
+# The admin endpoints authenticate with the same header and are never profiled themselves
+ADMIN_PREFIX = '/api/admin/profiler'
+
+# Upper bound on the number of requests one arming profiles
+MAX_ARMED_COUNT = 100
+
+_FILE_NAME_RE = re.compile(r'^[\w.-]+\.collapsed$')
+
+# Profile of the request running in this context, so worker threads can join it
+_current: contextvars.ContextVar = contextvars.ContextVar('profile', default=None)
+
+# (method, route template) -> {"pattern", "remaining", "armed_at"}
+_armed: Dict[tuple, Dict] = {}
+
+_active: Dict[int, '_Profile'] = {}
+_lock = threading.Lock()
+_sampler: Optional[threading.Thread] = None
+
+# filename -> label, so stacks do not repeat path handling on every sample
+_file_labels: Dict[str, str] = {}
+
+profiler_stats = {
+    "profiles_written": 0,
+    "samples_total": 0,
+    "rejected_tokens": 0,
+    "write_errors": 0,
+}
+
+
+def enabled() -> bool:
+    return bool(get_settings().profiler_token)
+
+
+def authorized(token: Optional[str]) -> bool:
+    """True when token is the configured PROFILER_TOKEN"""
+    expected = get_settings().profiler_token
+    if not expected or not token:
+        return False
+    if hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8')):
+        return True
+    profiler_stats["rejected_tokens"] += 1
+    return False
+
+
+# ---------------------------------------------------------------------------
+# Stacks
+# ---------------------------------------------------------------------------
+
+def _file_label(filename: str) -> str:
+    label = _file_labels.get(filename)
+    if label is None:
+        # Libraries keep their package path, application modules just the file name
+        normalized = filename.replace('\\', '/')
+        _, marker, rest = normalized.rpartition('-packages/')
+        label = rest if marker else os.path.basename(normalized)
+        _file_labels[filename] = label
+    return label
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{_file_label(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}".replace(';', ',')
+
+
+def _frame_stack(frame, root=None, entry_code=None) -> List[str]:
+    """
+    Labels from the outermost frame down to frame, starting at the root frame or
+    below the frame running entry_code when either is on the stack
+    """
+    frames = []
+    while frame is not None:
+        if frame is root:
+            frames.append(frame)
+            break
+        if entry_code is not None and frame.f_code is entry_code:
+            break
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return [_label(f) for f in frames]
+
+
+def _await_chain(coro) -> List[str]:
+    """Labels of a suspended coroutine and everything it awaits, ending with what it waits on"""
+    labels = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None) or getattr(coro, 'ag_frame', None)
+        if frame is None:
+            # A future, or an awaitable implemented in C
+            labels.append(f"[awaiting {type(coro).__name__}]")
+            break
+        labels.append(_label(frame))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None) or getattr(coro, 'ag_await', None)
+    return labels
+
+
+class _Profile:
+    """Samples of one request"""
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.task = asyncio.current_task()
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.threads: Dict[int, object] = {}
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self.truncated = False
+
+    def sample(self, frames: Dict[int, object]) -> None:
+        if time.perf_counter() - self.started > get_settings().profiler_max_seconds:
+            self.truncated = True
+            return
+        coro = self.task.get_coro()
+        if asyncio.current_task(self.loop) is self.task:
+            # The event loop frames above the request's coroutine are left out
+            stacks = [_frame_stack(frames.get(self.loop_thread), root=getattr(coro, 'cr_frame', None))]
+        else:
+            chain = _await_chain(coro)
+            stacks = [
+                chain[:-1] + ['[thread]'] + _frame_stack(frames[thread_id], entry_code=entry_code)
+                for thread_id, entry_code in list(self.threads.items())
+                if thread_id in frames
+            ] or [chain]
+        for stack in stacks:
+            self.counts[';'.join(stack)] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+def _sample_loop() -> None:
+    global _sampler
+    while True:
+        interval = get_settings().profiler_interval_ms / 1000
+        with _lock:
+            profiles = list(_active.values())
+            if not profiles:
+                _sampler = None
+                return
+        frames = sys._current_frames()
+        for profile in profiles:
+            try:
+                profile.sample(frames)
+            except Exception:
+                # The task moved on while it was sampled; the next tick catches it
+                pass
+        del frames
+        time.sleep(interval)
+
+
+def _start(profile: '_Profile') -> None:
+    global _sampler
+    with _lock:
+        _active[id(profile)] = profile
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, name='profiler', daemon=True)
+            _sampler.start()
+
+
+def _stop(profile: '_Profile') -> None:
+    with _lock:
+        _active.pop(id(profile), None)
+
+
+def traced(func):
+    """Wrap blocking work so the profile of the request that started it also samples its thread"""
+    def run(*args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return func(*args, **kwargs)
+        thread_id = threading.get_ident()
+        # Sampled from below this wrapper, so the pool's own frames are left out
+        profile.threads[thread_id] = run.__code__
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.threads.pop(thread_id, None)
+    return run
+
+
+# ---------------------------------------------------------------------------
+# Storage
+# ---------------------------------------------------------------------------
+
+def _profile_dir() -> Path:
+    return Path(get_settings().profiler_dir)
+
+
+def _file_name(profile: '_Profile') -> str:
+    path = re.sub(r'[^\w-]+', '_', profile.path.strip('/')) or 'root'
+    return f"{profile.started_at.strftime('%Y%m%dT%H%M%S%f')}-{profile.method.lower()}-{path[:80]}.collapsed"
+
+
+def _write(name: str, text: str) -> None:
+    directory = _profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / name).write_text(text, encoding='utf-8')
+    # Oldest profiles go first once the directory is over its bound
+    files = sorted(directory.glob('*.collapsed'), key=lambda path: path.name)
+    for path in files[:max(0, len(files) - get_settings().profiler_max_files)]:
+        path.unlink(missing_ok=True)
+
+
+def list_profiles() -> List[Dict]:
+    directory = _profile_dir()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in sorted(directory.glob('*.collapsed'), key=lambda path: path.name, reverse=True):
+        stat = path.stat()
+        profiles.append({
+            "name": path.name,
+            "bytes": stat.st_size,
+            "written_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        })
+    return profiles
+
+
+def profile_path(name: str) -> Optional[Path]:
+    """Path of a stored profile, None for unknown or unsafe names"""
+    if not _FILE_NAME_RE.match(name):
+        return None
+    path = _profile_dir() / name
+    return path if path.is_file() else None
+
+
+# ---------------------------------------------------------------------------
+# Arming
+# ---------------------------------------------------------------------------
+
+def arm(method: str, route: str, count: int) -> Dict:
+    """Profile the next count requests to route (a path template such as /api/content/{content_id}/regenerate)"""
+    pattern, _, _ = compile_path(route)
+    entry = {
+        "method": method.upper(),
+        "route": route,
+        "pattern": pattern,
+        "remaining": min(count, MAX_ARMED_COUNT),
+        "armed_at": datetime.now().isoformat(),
+    }
+    _armed[(entry["method"], route)] = entry
+    return _public(entry)
+
+
+def disarm(method: Optional[str] = None, route: Optional[str] = None) -> int:
+    keys = [key for key in _armed if (method is None or key[0] == method.upper()) and (route is None or key[1] == route)]
+    for key in keys:
+        del _armed[key]
+    return len(keys)
+
+
+def armed() -> List[Dict]:
+    return [_public(entry) for entry in _armed.values()]
+
+
+def _public(entry: Dict) -> Dict:
+    return {key: value for key, value in entry.items() if key != 'pattern'}
+
+
+def _take_armed(method: str, path: str) -> Optional[str]:
+    for key, entry in list(_armed.items()):
+        if entry["method"] == method and entry["pattern"].match(path):
+            entry["remaining"] -= 1
+            if entry["remaining"] <= 0:
+                del _armed[key]
+            return f"armed:{entry['route']}"
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Middleware
+# ---------------------------------------------------------------------------
+
+class ProfilerMiddleware:
+    """ASGI middleware profiling requests that carry the token header or hit an armed route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled() or scope["path"].startswith(ADMIN_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        reason = None
+        for name, value in scope["headers"]:
+            if name == HEADER:
+                if authorized(value.decode('latin-1')):
+                    reason = "header"
+                break
+        if reason is None and _armed:
+            reason = _take_armed(scope["method"], scope["path"])
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = _Profile(scope["method"], scope["path"], reason)
+        name = _file_name(profile)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b'x-profile-id', name.encode('latin-1'))]
+            await send(message)
+
+        token = _current.set(profile)
+        _start(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _stop(profile)
+            _current.reset(token)
+            seconds = time.perf_counter() - profile.started
+            profiler_stats["samples_total"] += profile.samples
+            try:
+                await asyncio.to_thread(_write, name, profile.collapsed())
+                profiler_stats["profiles_written"] += 1
+                truncated = " (sampling stopped at PROFILER_MAX_SECONDS)" if profile.truncated else ""
+                print(f"🔥 Profiled {profile.method} {profile.path} ({profile.reason}): {profile.samples} samples in {seconds:.2f}s{truncated} -> {name}")
+            except OSError as e:
+                profiler_stats["write_errors"] += 1
+                print(f"Warning: Could not write profile {name}: {str(e)}")
+
+
+def get_profiler_metrics() -> Dict:
+    return {
+        **profiler_stats,
+        "enabled": enabled(),
+        "active": len(_active),
+        "armed_routes": len(_armed),
+    }
+
+metrics.register("profiler", get_profiler_metrics)
@@ -0,0 +1,126 @@
+"""
+Model routing for content generation
+
+Picks a model and completion token budget per (platform, content_type):
+short social posts go to the small, fast model and long-form content (blogs,
+video scripts) to the large one. A generation from the small model that fails
+local validation, hits its token budget or comes back empty is escalated to the
+large model, once.
+
+Routes can be overridden with MODEL_ROUTES, a comma separated list of
+'<platform>/<content_type>=<model>:<max_tokens>' entries where either side of
+the '/' may be '*', e.g. 'Twitter/post=gpt-4o-mini:150,*/blog=gpt-4:1800'.
+"""
+from typing import Dict, Optional, Tuple
+from config import get_settings
+import metrics
+
+SMALL = 'small'
+LARGE = 'large'
+
+# (platform, content_type) -> (model tier or model name, max completion tokens)
+DEFAULT_ROUTES = {
+    ('*', 'post'): (SMALL, 500),
+    ('Twitter', 'post'): (SMALL, 150),
+    ('*', 'ad_copy'): (SMALL, 400),
+    ('*', 'newsletter'): (SMALL, 900),
+    ('*', 'blog'): (LARGE, 1500),
+    ('*', 'video_script'): (LARGE, 2000),
+    ('*', '*'): (LARGE, 1000),
+}
+
+_routes: Optional[Dict[Tuple[str, str], Tuple[str, int]]] = None
+
+route_stats: Dict[str, Dict] = {}
+
+
+def _parse_routes(entries) -> Dict[Tuple[str, str], Tuple[str, int]]:
+    routes = {}
+    for entry in entries:
+        try:
+            target, choice = entry.split('=', 1)
+            platform, content_type = target.split('/', 1)
+            model, max_tokens = choice.rsplit(':', 1)
+            routes[(platform.strip(), content_type.strip())] = (model.strip(), int(max_tokens))
+        except ValueError:
+            print(f"Warning: Ignoring invalid MODEL_ROUTES entry: {entry}")
+    return routes
+
+
+def _get_routes() -> Dict[Tuple[str, str], Tuple[str, int]]:
+    global _routes
+    if _routes is None:
+        _routes = {**DEFAULT_ROUTES, **_parse_routes(get_settings().model_routes)}
+    return _routes
+
+
+def _resolve_model(model: str) -> str:
+    settings = get_settings()
+    if model == SMALL:
+        return settings.model_small
+    if model == LARGE:
+        return settings.model_large
+    return model
+
+
+def select_route(platform: str, content_type: str) -> Dict:
+    """Model and token budget for a generation, most specific route first"""
+    routes = _get_routes()
+    for key in ((platform, content_type), ('*', content_type), (platform, '*'), ('*', '*')):
+        if key in routes:
+            model, max_tokens = routes[key]
+            break
+    model = _resolve_model(model)
+    large_model = get_settings().model_large
+    return {
+        "name": f"{platform}/{content_type}",
+        "model": model,
+        "max_tokens": max_tokens,
+        # Escalations get at least the default long-form budget
+        "escalation_model": large_model if model != large_model else None,
+        "escalation_max_tokens": max(max_tokens * 2, 1000),
+    }
+
+
+def _stats(route: Dict) -> Dict:
+    return route_stats.setdefault(route["name"], {
+        "calls": 0,
+        "escalations": 0,
+        "latency_ms_total": 0.0,
+        "cost_usd": 0.0,
+        "models": {},
+    })
+
+
+def record_call(route: Dict, entry: Dict) -> None:
+    """Account a usage ledger entry to its route"""
+    stats = _stats(route)
+    stats["calls"] += 1
+    stats["latency_ms_total"] += entry["latency_ms"]
+    stats["cost_usd"] += entry["cost_usd"]
+    stats["models"][entry["model"]] = stats["models"].get(entry["model"], 0) + 1
+
+
+def record_escalation(route: Dict) -> None:
+    _stats(route)["escalations"] += 1
+
+
+def get_routing_metrics() -> Dict:
+    settings = get_settings()
+    routes = {}
+    for name, stats in route_stats.items():
+        calls = stats["calls"]
+        # Every escalation adds a second call to the same generation
+        generations = calls - stats["escalations"]
+        routes[name] = {
+            "calls": calls,
+            "escalations": stats["escalations"],
+            "escalation_ratio": round(stats["escalations"] / generations, 4) if generations > 0 else None,
+            "avg_latency_ms": round(stats["latency_ms_total"] / calls, 1) if calls else None,
+            "cost_usd": round(stats["cost_usd"], 6),
+            "avg_cost_per_generation_usd": round(stats["cost_usd"] / generations, 6) if generations > 0 else None,
+            "models": dict(stats["models"]),
+        }
+    return {"model_small": settings.model_small, "model_large": settings.model_large, "routes": routes}
+
+metrics.register("routing", get_routing_metrics)
@@ -0,0 +1,336 @@
+"""
+Scheduled publishing of approved content
+
+Approving content stores a target publish time on the content document
+(publish_status='scheduled', scheduled_at) instead of posting right away.
+Without an explicit time, posts for the same platform are spaced by the
+platform's pacing interval, so a burst of approvals is spread out.
+
+The dispatcher keeps only the near future in memory: a heap of items due
+within the lookahead window (at most SCHEDULER_WINDOW_SIZE of them), refilled
+with a range query on the (publish_status, scheduled_at) index. Due items are
+claimed with a conditional update (so stale heap entries and other workers
+cannot publish twice), posted to n8n in batches and retried with backoff.
+
+A claim records claimed_at; items left 'publishing' for longer than
+SCHEDULER_LEASE_SECONDS (a worker died mid-post) are requeued by the
+dispatcher, which looks for them every half lease.
+"""
+import asyncio
+import heapq
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from config import get_settings
+import cache
+import database
+import events
+import metrics
+import storage
+
+database.INDEXES.append(('content', [('publish_status', 1), ('scheduled_at', 1)], {}))
+
+# (due timestamp, content id, platform, scheduled_at as stored)
+_heap: List[Tuple[float, str, str, str]] = []
+# content id -> scheduled_at of its newest heap entry
+_queued: Dict[str, str] = {}
+# Every scheduled item due before this timestamp is in the heap
+_horizon = 0.0
+# True when the last refill hit the window size (more items are due before the lookahead)
+_window_full = False
+# platform -> last assigned slot / earliest next dispatch (timestamps)
+_last_slot: Dict[str, float] = {}
+_next_allowed: Dict[str, float] = {}
+
+# Timestamp of the next look for items left 'publishing' past the lease
+_next_requeue = 0.0
+
+_wakeup: Optional[asyncio.Event] = None
+_dispatch_task: Optional[asyncio.Task] = None
+
+scheduler_stats = {
+    "scheduled": 0,
+    "published": 0,
+    "failed": 0,
+    "retries": 0,
+    "stale_skipped": 0,
+    "paced_deferrals": 0,
+    "refills": 0,
+    "requeued_stale": 0,
+    "batches": 0,
+    "lag_seconds_total": 0.0,
+}
+
+
+def _platform_interval(platform: str) -> float:
+    settings = get_settings()
+    for entry in settings.scheduler_platform_intervals:
+        name, _, seconds = entry.partition('=')
+        if name.strip() == platform:
+            try:
+                return float(seconds)
+            except ValueError:
+                break
+    return settings.scheduler_default_interval
+
+
+def parse_time(value: str) -> float:
+    """Timestamp of an ISO 8601 time; raises ValueError for invalid input"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed.timestamp()
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+def assign_slot(platform: str, requested: Optional[str] = None) -> str:
+    """
+    Publish time for newly approved content: the requested time, or the next free
+    slot for the platform (now, or one pacing interval after the last slot)
+    """
+    if requested:
+        return _iso(parse_time(requested))
+    slot = max(time.time(), _last_slot.get(platform, 0.0) + _platform_interval(platform))
+    _last_slot[platform] = slot
+    return _iso(slot)
+
+
+def _push(content_id: str, platform: str, scheduled_at: str) -> None:
+    due = parse_time(scheduled_at)
+    if due > _horizon or _queued.get(content_id) == scheduled_at:
+        # Beyond the window: picked up by a later refill
+        return
+    _queued[content_id] = scheduled_at
+    heapq.heappush(_heap, (due, content_id, platform, scheduled_at))
+
+
+def enqueue(content_id: str, platform: str, scheduled_at: str) -> None:
+    """Register content that was just stored with publish_status='scheduled'"""
+    scheduler_stats["scheduled"] += 1
+    due = parse_time(scheduled_at)
+    _last_slot[platform] = max(_last_slot.get(platform, 0.0), due)
+    _push(content_id, platform, scheduled_at)
+    if _wakeup is not None and _heap and _heap[0][1] == content_id:
+        _wakeup.set()
+
+
+async def _due_documents(until: Optional[str], limit: int, platform: Optional[str] = None) -> List[Dict]:
+    """Scheduled content due before until (or at any time), earliest first"""
+    query: Dict = {"publish_status": "scheduled"}
+    query["scheduled_at"] = {"$lte": until} if until else {"$exists": True}
+    if platform:
+        query["platform"] = platform
+    handle = storage.collection('content')
+    if handle is not None:
+        try:
+            documents = await handle.find(query).sort('scheduled_at', 1).limit(limit).to_list(length=limit)
+            for document in documents:
+                document['_id'] = str(document['_id'])
+            return documents
+        except Exception as e:
+            storage.fail_over(e)
+    documents = [document for document in storage.memory['content'].values() if storage.matches(document, query)]
+    documents.sort(key=lambda document: document['scheduled_at'])
+    return [dict(document) for document in documents[:limit]]
+
+
+async def _refill() -> None:
+    """Load scheduled items due within the lookahead window into the heap"""
+    global _horizon, _window_full
+    settings = get_settings()
+    horizon = time.time() + settings.scheduler_lookahead_seconds
+    documents = await _due_documents(_iso(horizon), settings.scheduler_window_size)
+    _window_full = len(documents) >= settings.scheduler_window_size
+    if _window_full:
+        # Later items stay in MongoDB until the heap has drained
+        horizon = parse_time(documents[-1]['scheduled_at'])
+    _horizon = horizon
+    for document in documents:
+        platform = document.get('platform')
+        _last_slot[platform] = max(_last_slot.get(platform, 0.0), parse_time(document['scheduled_at']))
+        _push(document['id'], platform, document['scheduled_at'])
+    scheduler_stats["refills"] += 1
+
+
+async def _publish(item: Tuple[float, str, str, str]) -> None:
+    from services import post_to_n8n
+
+    due, content_id, platform, scheduled_at = item
+    settings = get_settings()
+    claimed = await storage.update_one(
+        'content',
+        {"id": content_id, "publish_status": "scheduled", "scheduled_at": scheduled_at},
+        {"publish_status": "publishing", "claimed_at": datetime.now().isoformat()}
+    )
+    if not claimed:
+        # Rescheduled, cancelled, deleted or taken by another worker
+        scheduler_stats["stale_skipped"] += 1
+        return
+
+    content = await storage.find_one('content', {"id": content_id}) or {}
+    scheduler_stats["lag_seconds_total"] += max(0.0, time.time() - due)
+    client = await cache.get_client(content.get('client_id'))
+    if client is None:
+        result = {"success": False, "message": "Client not found"}
+    else:
+        result = await asyncio.to_thread(post_to_n8n, platform, content.get('content'), client, scheduled_at)
+
+    attempts = content.get('publish_attempts', 0) + 1
+    if result.get('success'):
+        scheduler_stats["published"] += 1
+        fields = {"publish_status": "published", "published_at": datetime.now().isoformat()}
+    elif attempts < settings.scheduler_max_attempts:
+        scheduler_stats["retries"] += 1
+        retry_at = _iso(time.time() + settings.scheduler_retry_seconds * attempts)
+        fields = {"publish_status": "scheduled", "scheduled_at": retry_at}
+    else:
+        scheduler_stats["failed"] += 1
+        fields = {"publish_status": "failed"}
+    fields.update({"n8n_result": result, "publish_attempts": attempts})
+    await storage.update_one('content', {"id": content_id}, fields)
+    if fields["publish_status"] == "scheduled":
+        _push(content_id, platform, fields["scheduled_at"])
+
+
+def _take_due_batch() -> List[Tuple[float, str, str, str]]:
+    """Pop due items (up to the batch size), deferring platforms still within their pacing interval"""
+    now = time.time()
+    batch = []
+    deferred = []
+    while _heap and _heap[0][0] <= now and len(batch) < get_settings().scheduler_batch_size:
+        item = heapq.heappop(_heap)
+        due, content_id, platform, scheduled_at = item
+        if _queued.get(content_id) != scheduled_at:
+            continue
+        allowed = _next_allowed.get(platform, 0.0)
+        if allowed > now:
+            scheduler_stats["paced_deferrals"] += 1
+            deferred.append((allowed, content_id, platform, scheduled_at))
+            continue
+        _queued.pop(content_id, None)
+        _next_allowed[platform] = now + _platform_interval(platform)
+        batch.append(item)
+    for item in deferred:
+        heapq.heappush(_heap, item)
+    return batch
+
+
+def _refill_due() -> bool:
+    settings = get_settings()
+    if _window_full:
+        return len(_queued) <= settings.scheduler_window_size // 2
+    return time.time() >= _horizon - settings.scheduler_lookahead_seconds / 2
+
+
+async def _dispatch_loop() -> None:
+    global _next_requeue
+    settings = get_settings()
+    while True:
+        try:
+            if time.time() >= _next_requeue:
+                _next_requeue = time.time() + settings.scheduler_lease_seconds / 2
+                await requeue_stale()
+            if _refill_due():
+                await _refill()
+            batch = _take_due_batch()
+            if batch:
+                scheduler_stats["batches"] += 1
+                results = await asyncio.gather(*(_publish(item) for item in batch), return_exceptions=True)
+                for result in results:
+                    if isinstance(result, Exception):
+                        print(f"Warning: Scheduled publish failed: {str(result)}")
+                continue
+            next_refill = float('inf') if _window_full else _horizon - settings.scheduler_lookahead_seconds / 2
+            next_due = _heap[0][0] if _heap else next_refill
+            timeout = min(max(0.05, min(next_due, next_refill, _next_requeue) - time.time()), settings.scheduler_lookahead_seconds)
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Warning: Scheduler dispatch failed: {str(e)}")
+            await asyncio.sleep(settings.storage_monitor_interval)
+
+
+def _reset(payload: Dict) -> None:
+    """Drop the in-memory window; the next loop iteration reloads it from storage"""
+    global _horizon, _window_full
+    _heap.clear()
+    _queued.clear()
+    _horizon = 0.0
+    _window_full = False
+    if _wakeup is not None:
+        _wakeup.set()
+
+events.subscribe('storage.recovered', _reset)
+
+
+async def upcoming(platform: Optional[str] = None, limit: int = 100) -> List[Dict]:
+    """Scheduled content in publish order"""
+    return await _due_documents(None, limit, platform)
+
+
+async def cancel(content_id: str) -> bool:
+    """Unschedule content that has not been published yet"""
+    cancelled = await storage.update_one(
+        'content', {"id": content_id, "publish_status": "scheduled"}, {"publish_status": "cancelled"}
+    )
+    _queued.pop(content_id, None)
+    return cancelled
+
+
+async def requeue_stale() -> int:
+    """Reschedule content whose publishing claim is older than the lease; returns how many"""
+    cutoff = _iso(time.time() - get_settings().scheduler_lease_seconds)
+    requeued = 0
+    for document in await storage.find('content', {"publish_status": "publishing"}, limit=10000):
+        claimed_at = document.get('claimed_at')
+        if claimed_at and claimed_at >= cutoff:
+            continue
+        scheduled_at = document.get('scheduled_at') or _iso(time.time())
+        # Conditional on the same claim, so an item a live worker just finished stays put
+        if await storage.update_one(
+            'content',
+            {"id": document['id'], "publish_status": "publishing", "claimed_at": claimed_at},
+            {"publish_status": "scheduled", "scheduled_at": scheduled_at}
+        ):
+            requeued += 1
+            _push(document['id'], document.get('platform'), scheduled_at)
+    scheduler_stats["requeued_stale"] += requeued
+    if requeued:
+        print(f"⏰ Requeued {requeued} items left publishing past the lease")
+    return requeued
+
+
+async def start() -> None:
+    global _dispatch_task, _wakeup, _next_requeue
+    if not get_settings().scheduler_enabled:
+        return
+    # The first loop iteration requeues items a previous run left publishing
+    _next_requeue = 0.0
+    _wakeup = asyncio.Event()
+    _dispatch_task = asyncio.create_task(_dispatch_loop())
+
+
+async def stop() -> None:
+    global _dispatch_task
+    if _dispatch_task is not None:
+        _dispatch_task.cancel()
+        _dispatch_task = None
+
+
+def get_scheduler_metrics() -> Dict:
+    dispatched = scheduler_stats["published"] + scheduler_stats["failed"] + scheduler_stats["retries"]
+    return {
+        **scheduler_stats,
+        "enabled": get_settings().scheduler_enabled,
+        "queued_in_window": len(_queued),
+        "window_until": _iso(_horizon) if _horizon else None,
+        "avg_lag_seconds": round(scheduler_stats["lag_seconds_total"] / dispatched, 3) if dispatched else None,
+    }
+
+metrics.register("scheduler", get_scheduler_metrics)
@@ -0,0 +1,250 @@
+"""
+Full-text and faceted search over generated content
+
+- MongoDB: a text index on content/client_name, queried with $text and an
+  aggregation $facet stage so results, total and facet counts come back together
+- In-memory mode: an inverted index with BM25 ranking, kept up to date from
+  storage write events and rebuilt lazily after storage reloads from MongoDB.
+  It only serves while MongoDB is unavailable and covers the documents held in
+  memory; when that is part of the collection (the mirror is capped at
+  STORAGE_WARM_LIMIT) results are marked partial instead of silently missing
+  the rest
+"""
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+import database
+import events
+import storage
+
+# Fields that can be used as facets and filters
+FACET_FIELDS = ('platform', 'content_type', 'status', 'client_id')
+
+# Fields covered by the text index (weights mirror the MongoDB text index)
+TEXT_FIELDS = {'content': 10, 'client_name': 2, 'platform': 1}
+
+database.INDEXES.append(
+    ('content', [(field, 'text') for field in TEXT_FIELDS], {"weights": TEXT_FIELDS, "name": "content_text"})
+)
+database.INDEXES.append(('content', [('created_at', -1)], {}))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it',
+    'of', 'on', 'or', 'our', 'that', 'the', 'this', 'to', 'we', 'with', 'you', 'your',
+}
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return [token for token in _TOKEN_RE.findall(text.lower()) if len(token) > 1 and token not in _STOPWORDS]
+
+
+class InvertedIndex:
+    """Term -> {document key: weighted term frequency}, scored with BM25"""
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self.doc_terms: Dict[str, Counter] = {}
+        self.doc_lengths: Dict[str, float] = {}
+        self.total_length = 0.0
+
+    def add(self, key: str, document: Dict) -> None:
+        self.remove(key)
+        terms: Counter = Counter()
+        for field, weight in TEXT_FIELDS.items():
+            for token in tokenize(document.get(field)):
+                terms[token] += weight
+        self.doc_terms[key] = terms
+        length = sum(terms.values())
+        self.doc_lengths[key] = length
+        self.total_length += length
+        for term, frequency in terms.items():
+            self.postings[term][key] = frequency
+
+    def remove(self, key: str) -> None:
+        terms = self.doc_terms.pop(key, None)
+        if terms is None:
+            return
+        self.total_length -= self.doc_lengths.pop(key, 0.0)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self.postings[term]
+
+    def search(self, query: str) -> Dict[str, float]:
+        """Score every document containing at least one query term"""
+        documents = len(self.doc_terms)
+        if not documents:
+            return {}
+        average_length = self.total_length / documents or 1.0
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (documents - len(posting) + 0.5) / (len(posting) + 0.5))
+            for key, frequency in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[key] / average_length)
+                scores[key] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+
+_index: Optional[InvertedIndex] = None
+
+
+def _get_index() -> InvertedIndex:
+    """Build the in-memory index from the storage memory store on first use"""
+    global _index
+    if _index is None:
+        _index = InvertedIndex()
+        for key, document in storage.memory['content'].items():
+            _index.add(key, document)
+    return _index
+
+
+def _on_content_changed(payload: Dict) -> None:
+    if _index is None:
+        return
+    if payload["op"] == 'delete' or payload.get("document") is None:
+        _index.remove(payload["key"])
+        if payload["op"] != 'delete' and payload["key"] in storage.memory['content']:
+            _index.add(payload["key"], storage.memory['content'][payload["key"]])
+    else:
+        _index.add(payload["key"], payload["document"])
+
+
+def _on_storage_reloaded(payload: Dict) -> None:
+    global _index
+    _index = None
+
+events.subscribe('content.changed', _on_content_changed)
+events.subscribe('storage.recovered', _on_storage_reloaded)
+
+
+def build_filters(
+    filters: Dict[str, Optional[List[str]]],
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+) -> Dict:
+    """Turn facet selections and a created_at range into a MongoDB-style query"""
+    query: Dict = {}
+    for field in FACET_FIELDS:
+        values = [value for value in (filters.get(field) or []) if value and value != 'all']
+        if len(values) == 1:
+            query[field] = values[0]
+        elif values:
+            query[field] = {"$in": values}
+    created_at: Dict = {}
+    if date_from:
+        created_at["$gte"] = date_from
+    if date_to:
+        # Date-only upper bounds include the whole day (created_at is an ISO timestamp)
+        created_at["$lte"] = f"{date_to}T23:59:59.999999" if len(date_to) == 10 else date_to
+    if created_at:
+        query["created_at"] = created_at
+    return query
+
+
+def _facet_counts(documents: List[Dict]) -> Dict[str, List[Dict]]:
+    facets = {}
+    for field in FACET_FIELDS:
+        counts = Counter(document.get(field) for document in documents if document.get(field) is not None)
+        facets[field] = [{"value": value, "count": count} for value, count in counts.most_common()]
+    return facets
+
+
+def _search_memory(q: Optional[str], query: Dict, skip: int, limit: int) -> Dict:
+    store = storage.memory['content']
+    if q:
+        scores = _get_index().search(q)
+        candidates = [(score, store[key]) for key, score in scores.items() if key in store]
+    else:
+        candidates = [(0.0, document) for document in store.values()]
+    matched = [(score, document) for score, document in candidates if storage.matches(document, query)]
+    matched.sort(key=lambda item: (item[0], item[1].get('created_at') or ''), reverse=True)
+
+    results = []
+    for score, document in matched[skip:skip + limit]:
+        result = dict(document)
+        if q:
+            result['score'] = round(score, 4)
+        results.append(result)
+    return {
+        "total": len(matched),
+        "results": results,
+        "facets": _facet_counts([document for _, document in matched]),
+        "partial": not storage.mirror_complete('content'),
+    }
+
+
+async def _search_mongo(handle, q: Optional[str], query: Dict, skip: int, limit: int) -> Dict:
+    match = dict(query)
+    if q:
+        match["$text"] = {"$search": q}
+        sort = {"score": {"$meta": "textScore"}, "created_at": -1}
+    else:
+        sort = {"created_at": -1}
+
+    page = [{"$sort": sort}, {"$skip": skip}, {"$limit": limit}]
+    if q:
+        page.append({"$addFields": {"score": {"$meta": "textScore"}}})
+    facet_stage = {"results": page, "total": [{"$count": "count"}]}
+    for field in FACET_FIELDS:
+        facet_stage[field] = [
+            {"$match": {field: {"$ne": None}}},
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+        ]
+
+    output = await handle.aggregate([{"$match": match}, {"$facet": facet_stage}]).to_list(length=1)
+    output = output[0] if output else {}
+    results = []
+    for document in output.get("results", []):
+        if '_id' in document:
+            document['_id'] = str(document['_id'])
+        if 'score' in document:
+            document['score'] = round(document['score'], 4)
+        results.append(document)
+    total = output.get("total", [])
+    return {
+        "total": total[0]["count"] if total else 0,
+        "results": results,
+        "facets": {
+            field: [{"value": bucket["_id"], "count": bucket["count"]} for bucket in output.get(field, [])]
+            for field in FACET_FIELDS
+        },
+        "partial": False,
+    }
+
+
+async def search_content(
+    q: Optional[str],
+    filters: Dict[str, Optional[List[str]]],
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20
+) -> Dict:
+    """Keyword search with facet filters, a created_at range and relevance-ranked pagination"""
+    q = (q or '').strip() or None
+    query = build_filters(filters, date_from, date_to)
+    skip = (page - 1) * page_size
+
+    handle = storage.collection('content', read_only=True)
+    if handle is not None:
+        try:
+            return await _search_mongo(handle, q, query, skip, page_size)
+        except Exception as e:
+            storage.fail_over(e)
+    return _search_memory(q, query, skip, page_size)
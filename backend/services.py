@@ -2,92 +2,255 @@
 Service layer for CampaignForge backend
 Handles OpenAI integration, content generation, and n8n integration
 """
-import os
-from openai import OpenAI
-from dotenv import load_dotenv
-import requests
-from typing import Dict, List, Optional
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import get_settings
+import brand
+import dedup
+import metrics
+import routing
+import usage
+import validation
 
-load_dotenv()
+# OpenAI and requests are imported on first use (or by warmup()) so that
+# importing this module stays cheap for health probes and cold starts
 
 # Initialize OpenAI client (lazy initialization to handle missing API key)
 openai_client = None
 
+GENERATE_TEMPERATURE = 0.7
+REGENERATE_TEMPERATURE = 0.8  # Slightly higher for more creative variations
+
+# Content type generated for each platform
+CONTENT_TYPES = {
+    'LinkedIn': 'post',
+    'Twitter': 'post',
+    'Instagram': 'post',
+    'Facebook': 'post',
+    'Reddit': 'post',
+    'Email': 'newsletter',
+    'Website': 'blog',
+    'YouTube': 'video_script'
+}
+
+# Platforms used when a client has no primary_channels
+DEFAULT_PLATFORMS = ['LinkedIn', 'Twitter', 'Instagram']
+
+# Platform-specific generation prompts
+PLATFORM_PROMPTS = {
+    'LinkedIn': 'Create a professional LinkedIn post',
+    'Twitter': 'Create an engaging Twitter post (280 characters max)',
+    'Instagram': 'Create an Instagram post with engaging copy',
+    'Facebook': 'Create a Facebook post that encourages engagement',
+    'Reddit': 'Create a Reddit post that follows community guidelines and encourages discussion',
+    'Email': 'Create an email newsletter content',
+    'Website': 'Create a blog post or website content',
+    'YouTube': 'Create a video script for YouTube'
+}
+
+CONTENT_TYPE_PROMPTS = {
+    'post': 'social media post',
+    'blog': 'blog post (500-800 words)',
+    'newsletter': 'email newsletter content',
+    'ad_copy': 'advertising copy',
+    'video_script': 'video script with scene descriptions'
+}
+
 def get_openai_client():
     """Get or initialize OpenAI client"""
     global openai_client
     if openai_client is None:
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key or api_key == 'your_openai_api_key_here':
+        settings = get_settings()
+        if not settings.openai_configured:
             raise Exception("OpenAI API key not configured. Please set OPENAI_API_KEY in .env file")
+        from openai import OpenAI
         # Initialize with minimal configuration to avoid proxy issues
         try:
             openai_client = OpenAI(
-                api_key=api_key,
-                timeout=60.0,
-                max_retries=3
+                api_key=settings.openai_api_key,
+                base_url=settings.openai_base_url,
+                timeout=settings.openai_timeout,
+                max_retries=settings.openai_max_retries
             )
         except Exception as e:
             raise Exception(f"Failed to initialize OpenAI client: {str(e)}")
     return openai_client
 
-# n8n configuration
-N8N_WEBHOOK_URL = os.getenv('N8N_WEBHOOK_URL', 'http://localhost:5678/webhook')
-N8N_API_KEY = os.getenv('N8N_API_KEY', '')
 
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key: the first caller runs the function,
+    callers arriving while it runs wait for and share its result (or exception).
+    Thread-safe, since generation runs in worker threads.
+    """
 
-def generate_content(
-    client_data: Dict,
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Dict] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def do(self, kind: str, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            stats = self.stats.setdefault(kind, {"calls": 0, "coalesced": 0})
+            stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+            else:
+                stats["coalesced"] += 1
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["done"].set()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            in_flight = len(self._calls)
+            kinds = {
+                kind: {
+                    **stats,
+                    "coalescing_rate": round(stats["coalesced"] / stats["calls"], 4) if stats["calls"] else None,
+                }
+                for kind, stats in self.stats.items()
+            }
+        return {"in_flight": in_flight, **kinds}
+
+
+_generation_flight = SingleFlight()
+
+metrics.register("singleflight", _generation_flight.snapshot)
+
+
+def warmup() -> None:
+    """
+    Import the heavy SDKs and build the OpenAI client ahead of the first request.
+    Meant to run in a background thread after startup; failures are only logged.
+    """
+    try:
+        import requests  # noqa: F401
+        if get_settings().openai_configured:
+            get_openai_client()
+        else:
+            import openai  # noqa: F401
+        print("✅ Service warmup complete")
+    except Exception as e:
+        print(f"Warning: Service warmup failed: {str(e)}")
+
+
+def _chat_completion(
+    model: str,
+    messages: List[Dict],
+    temperature: float,
+    max_tokens: int,
+    platform: Optional[str] = None,
+    client_id: Optional[str] = None,
+    route: Optional[Dict] = None,
+    response_format: Optional[Dict] = None
+) -> Tuple[str, Optional[str]]:
+    """Run a chat completion and record it in the usage ledger; returns (text, finish_reason)"""
+    client = get_openai_client()
+    started = time.perf_counter()
+    options = {"response_format": response_format} if response_format else {}
+    response = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        **options
+    )
+    entry = usage.record_completion(
+        model, response, time.perf_counter() - started, platform, client_id,
+        route=route["name"] if route else None
+    )
+    if route is not None:
+        routing.record_call(route, entry)
+    choice = response.choices[0]
+    return choice.message.content.strip(), getattr(choice, 'finish_reason', None)
+
+
+def _routed_completion(
     platform: str,
     content_type: str,
-    topic: Optional[str] = None
+    messages: List[Dict],
+    temperature: float,
+    client_id: Optional[str] = None
 ) -> str:
     """
-    Generate marketing content using OpenAI based on client data
+    Generate with the model routed for (platform, content_type), escalating once to
+    the large model when the output breaks the platform limits, was cut off or came
+    back empty; whatever the large model returns is kept (enforce_platform_limits
+    handles what still breaks the limits)
+    """
+    route = routing.select_route(platform, content_type)
+    content, finish_reason = _chat_completion(
+        route["model"], messages, temperature, route["max_tokens"], platform, client_id, route
+    )
+    if route["escalation_model"] and (finish_reason == 'length' or not content or validation.validate(platform, content)):
+        routing.record_escalation(route)
+        content, _ = _chat_completion(
+            route["escalation_model"], messages, temperature, route["escalation_max_tokens"],
+            platform, client_id, route
+        )
+    return content
+
+
+def _generate_once(
+    kind: str,
+    platform: str,
+    content_type: str,
+    messages: List[Dict],
+    temperature: float,
+    client_id: Optional[str] = None
+) -> str:
+    """
+    Routed completion plus platform limit enforcement, shared by concurrent callers
+    whose request is identical (same prompt, platform, content type and temperature)
+    """
+    key = hashlib.sha256(json.dumps(
+        [kind, platform, content_type, temperature, messages], sort_keys=True
+    ).encode('utf-8')).hexdigest()
+    return _generation_flight.do(kind, key, lambda: enforce_platform_limits(
+        platform, _routed_completion(platform, content_type, messages, temperature, client_id)
+    ))
+
+
+def build_generation_messages(
+    client_data: Dict,
+    platform: str,
+    content_type: str,
+    topic: Optional[str] = None
+) -> List[Dict]:
+    """Chat messages for a first generation (shared by generate_content and batch.py)"""
+    # Build context from client data
+    brand_tone = client_data.get('brand_tone', 'Professional')
+    industry = client_data.get('industry', 'General')
+    target_audience = client_data.get('target_audience', 'General audience')
+    marketing_goals = client_data.get('marketing_goals', 'Brand awareness')
+    content_preferences = client_data.get('content_preferences', 'Educational')
     
-    Args:
-        client_data: Client onboarding data
-        platform: Target platform (LinkedIn, Twitter, Instagram, etc.)
-        content_type: Type of content (post, blog, newsletter, ad_copy, video_script)
-        topic: Optional topic or theme for the content
+    base_prompt = PLATFORM_PROMPTS.get(platform, 'Create marketing content')
+    type_prompt = CONTENT_TYPE_PROMPTS.get(content_type, 'content')
     
-    Returns:
-        Generated content string
-    """
-    try:
-        # Build context from client data
-        brand_tone = client_data.get('brand_tone', 'Professional')
-        industry = client_data.get('industry', 'General')
-        target_audience = client_data.get('target_audience', 'General audience')
-        marketing_goals = client_data.get('marketing_goals', 'Brand awareness')
-        content_preferences = client_data.get('content_preferences', 'Educational')
-        past_examples = client_data.get('past_examples', '')
-        
-        # Create platform-specific prompts
-        platform_prompts = {
-            'LinkedIn': 'Create a professional LinkedIn post',
-            'Twitter': 'Create an engaging Twitter post (280 characters max)',
-            'Instagram': 'Create an Instagram post with engaging copy',
-            'Facebook': 'Create a Facebook post that encourages engagement',
-            'Reddit': 'Create a Reddit post that follows community guidelines and encourages discussion',
-            'Email': 'Create an email newsletter content',
-            'Website': 'Create a blog post or website content',
-            'YouTube': 'Create a video script for YouTube'
-        }
-        
-        content_type_prompts = {
-            'post': 'social media post',
-            'blog': 'blog post (500-800 words)',
-            'newsletter': 'email newsletter content',
-            'ad_copy': 'advertising copy',
-            'video_script': 'video script with scene descriptions'
-        }
-        
-        base_prompt = platform_prompts.get(platform, 'Create marketing content')
-        type_prompt = content_type_prompts.get(content_type, 'content')
-        
-        # Construct the full prompt
-        prompt = f"""You are an expert marketing content writer. {base_prompt} as a {type_prompt}.
+    # Construct the full prompt
+    prompt = f"""You are an expert marketing content writer. {base_prompt} as a {type_prompt}.
 
 Client Information:
 - Company: {client_data.get('company_name', 'Unknown')}
@@ -96,7 +259,7 @@ Client Information:
 - Target Audience: {target_audience}
 - Marketing Goals: {marketing_goals}
 - Content Preferences: {content_preferences}
-{f"- Past Examples: {past_examples}" if past_examples else ""}
+{brand.prompt_lines(client_data)}
 {f"- Topic: {topic}" if topic else ""}
 
 Requirements:
@@ -106,120 +269,119 @@ Requirements:
 - Follow content preferences: {content_preferences}
 - Be engaging and professional
 - Include a clear call-to-action if appropriate
+- Maximum length: {validation.describe_max_length(platform)}
 
 Generate the content now:"""
 
-        client = get_openai_client()
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert marketing content writer specializing in creating engaging, brand-aligned content for various platforms."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
-        
-        generated_content = response.choices[0].message.content.strip()
-        return generated_content
-        
-    except Exception as e:
-        raise Exception(f"Error generating content: {str(e)}")
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert marketing content writer specializing in creating engaging, brand-aligned content for various platforms."
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
 
 
-def regenerate_content(
+def generate_content(
     client_data: Dict,
     platform: str,
     content_type: str,
-    existing_content: str,
-    improvement_focus: Optional[str] = None
+    topic: Optional[str] = None
 ) -> str:
     """
-    Regenerate existing content using OpenAI with focus on improvement
+    Generate marketing content using OpenAI based on client data
     
     Args:
         client_data: Client onboarding data
         platform: Target platform (LinkedIn, Twitter, Instagram, etc.)
         content_type: Type of content (post, blog, newsletter, ad_copy, video_script)
-        existing_content: The current content that needs to be regenerated
-        improvement_focus: Optional focus area for improvement (e.g., "more engaging", "better CTA", "shorter")
+        topic: Optional topic or theme for the content
     
     Returns:
-        Regenerated content string
+        Generated content string
     """
     try:
-        # Build context from client data
-        brand_tone = client_data.get('brand_tone', 'Professional')
-        industry = client_data.get('industry', 'General')
-        target_audience = client_data.get('target_audience', 'General audience')
-        marketing_goals = client_data.get('marketing_goals', 'Brand awareness')
-        content_preferences = client_data.get('content_preferences', 'Educational')
-        company_name = client_data.get('company_name', 'Unknown')
+        return _generate_once(
+            kind='generate',
+            platform=platform,
+            content_type=content_type,
+            messages=build_generation_messages(client_data, platform, content_type, topic),
+            temperature=GENERATE_TEMPERATURE,
+            client_id=client_data.get('client_id')
+        )
         
-        # Platform-specific guidelines
-        platform_guidelines = {
-            'LinkedIn': {
-                'max_length': '1300 characters',
-                'style': 'professional, thought-provoking, industry insights',
-                'format': 'paragraphs with clear structure'
-            },
-            'Twitter': {
-                'max_length': '280 characters',
-                'style': 'concise, engaging, hashtag-friendly',
-                'format': 'short sentences, can include hashtags'
-            },
-            'Instagram': {
-                'max_length': '2200 characters',
-                'style': 'visual, engaging, authentic, emoji-friendly',
-                'format': 'short paragraphs, can include emojis and line breaks'
-            },
-            'Facebook': {
-                'max_length': '5000 characters',
-                'style': 'conversational, community-focused, engaging',
-                'format': 'paragraphs with questions to encourage engagement'
-            },
-            'Reddit': {
-                'max_length': '40000 characters',
-                'style': 'informative, authentic, discussion-provoking, follows Reddit etiquette',
-                'format': 'well-structured post with engaging body text, clear formatting, and questions to spark conversation'
-            },
-            'Email': {
-                'max_length': '2000 characters',
-                'style': 'clear, actionable, value-driven',
-                'format': 'structured with clear sections and CTA'
-            },
-            'Website': {
-                'max_length': '2000 words',
-                'style': 'informative, SEO-friendly, comprehensive',
-                'format': 'structured with headings and subheadings'
-            },
-            'YouTube': {
-                'max_length': '5000 words',
-                'style': 'conversational, engaging, storytelling',
-                'format': 'script format with scene descriptions and dialogue'
-            }
+    except Exception as e:
+        raise Exception(f"Error generating content: {str(e)}")
+
+
+def build_regeneration_messages(
+    client_data: Dict,
+    platform: str,
+    content_type: str,
+    existing_content: str,
+    improvement_focus: Optional[str] = None
+) -> List[Dict]:
+    """Chat messages for regenerating existing content (shared by regenerate_content and batch.py)"""
+    # Build context from client data
+    brand_tone = client_data.get('brand_tone', 'Professional')
+    industry = client_data.get('industry', 'General')
+    target_audience = client_data.get('target_audience', 'General audience')
+    marketing_goals = client_data.get('marketing_goals', 'Brand awareness')
+    content_preferences = client_data.get('content_preferences', 'Educational')
+    company_name = client_data.get('company_name', 'Unknown')
+    
+    # Platform-specific guidelines
+    platform_guidelines = {
+        'LinkedIn': {
+            'style': 'professional, thought-provoking, industry insights',
+            'format': 'paragraphs with clear structure'
+        },
+        'Twitter': {
+            'style': 'concise, engaging, hashtag-friendly',
+            'format': 'short sentences, can include hashtags'
+        },
+        'Instagram': {
+            'style': 'visual, engaging, authentic, emoji-friendly',
+            'format': 'short paragraphs, can include emojis and line breaks'
+        },
+        'Facebook': {
+            'style': 'conversational, community-focused, engaging',
+            'format': 'paragraphs with questions to encourage engagement'
+        },
+        'Reddit': {
+            'style': 'informative, authentic, discussion-provoking, follows Reddit etiquette',
+            'format': 'well-structured post with engaging body text, clear formatting, and questions to spark conversation'
+        },
+        'Email': {
+            'style': 'clear, actionable, value-driven',
+            'format': 'structured with clear sections and CTA'
+        },
+        'Website': {
+            'style': 'informative, SEO-friendly, comprehensive',
+            'format': 'structured with headings and subheadings'
+        },
+        'YouTube': {
+            'style': 'conversational, engaging, storytelling',
+            'format': 'script format with scene descriptions and dialogue'
         }
-        
-        guidelines = platform_guidelines.get(platform, {
-            'max_length': 'appropriate length',
-            'style': 'engaging and professional',
-            'format': 'well-structured'
-        })
-        
-        # Build the regeneration prompt
-        improvement_instruction = ""
-        if improvement_focus:
-            improvement_instruction = f"\n\nIMPORTANT: Focus on improving: {improvement_focus}"
-        else:
-            improvement_instruction = "\n\nIMPORTANT: Improve the content while maintaining brand consistency - make it more engaging, compelling, and aligned with the brand voice."
-        
-        prompt = f"""You are an expert marketing content writer. Your task is to REGENERATE and IMPROVE the following content for {platform}.
+    }
+    
+    guidelines = platform_guidelines.get(platform, {
+        'style': 'engaging and professional',
+        'format': 'well-structured'
+    })
+    
+    # Build the regeneration prompt
+    improvement_instruction = ""
+    if improvement_focus:
+        improvement_instruction = f"\n\nIMPORTANT: Focus on improving: {improvement_focus}"
+    else:
+        improvement_instruction = "\n\nIMPORTANT: Improve the content while maintaining brand consistency - make it more engaging, compelling, and aligned with the brand voice."
+    
+    prompt = f"""You are an expert marketing content writer. Your task is to REGENERATE and IMPROVE the following content for {platform}.
 
 CURRENT CONTENT TO REGENERATE:
 ---
@@ -237,7 +399,7 @@ CLIENT BRAND CONTEXT:
 PLATFORM REQUIREMENTS:
 - Platform: {platform}
 - Content Type: {content_type}
-- Maximum Length: {guidelines['max_length']}
+- Maximum Length: {validation.describe_max_length(platform)}
 - Style: {guidelines['style']}
 - Format: {guidelines['format']}
 {improvement_instruction}
@@ -256,31 +418,151 @@ REGENERATION GUIDELINES:
 
 Generate the REGENERATED and IMPROVED content now. Make it better than the original while maintaining brand consistency:"""
 
-        client = get_openai_client()
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert marketing content writer specializing in regenerating and improving existing content while maintaining brand consistency and increasing engagement."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.8,  # Slightly higher for more creative variations
-            max_tokens=1500  # Increased for better regeneration
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert marketing content writer specializing in regenerating and improving existing content while maintaining brand consistency and increasing engagement."
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+
+def regenerate_content(
+    client_data: Dict,
+    platform: str,
+    content_type: str,
+    existing_content: str,
+    improvement_focus: Optional[str] = None
+) -> str:
+    """
+    Regenerate existing content using OpenAI with focus on improvement
+    
+    Args:
+        client_data: Client onboarding data
+        platform: Target platform (LinkedIn, Twitter, Instagram, etc.)
+        content_type: Type of content (post, blog, newsletter, ad_copy, video_script)
+        existing_content: The current content that needs to be regenerated
+        improvement_focus: Optional focus area for improvement (e.g., "more engaging", "better CTA", "shorter")
+    
+    Returns:
+        Regenerated content string
+    """
+    try:
+        return _generate_once(
+            kind='regenerate',
+            platform=platform,
+            content_type=content_type,
+            messages=build_regeneration_messages(client_data, platform, content_type, existing_content, improvement_focus),
+            temperature=REGENERATE_TEMPERATURE,
+            client_id=client_data.get('client_id')
         )
         
-        regenerated_content = response.choices[0].message.content.strip()
-        return regenerated_content
-        
     except Exception as e:
         raise Exception(f"Error regenerating content: {str(e)}")
 
 
-def post_to_n8n(platform: str, content: str, client_data: Dict) -> Dict:
+def shorten_content(platform: str, content: str, violations: List[Dict], max_tokens: int) -> str:
+    """Ask the model to shorten content to the platform limits, without rewriting it"""
+    limits = validation.get_limits(platform)
+    rules = [f"- Maximum length: {validation.describe_max_length(platform)}"]
+    if limits.get('max_hashtags') is not None:
+        rules.append(f"- At most {limits['max_hashtags']} hashtags")
+    if limits.get('max_links') is not None:
+        rules.append(f"- At most {limits['max_links']} links")
+    problems = ", ".join(f"{v['rule'].replace('max_', '')} {v['actual']} > {v['limit']}" for v in violations)
+    
+    prompt = f"""Shorten the following {platform} content so it fits these limits:
+{chr(10).join(rules)}
+
+It currently breaks: {problems}.
+Keep the wording, tone and call-to-action; only cut. Return the shortened content only.
+
+---
+{content}
+---"""
+
+    shortened, _ = _chat_completion(
+        model=get_settings().model_small,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+        max_tokens=max_tokens,
+        platform=platform
+    )
+    return shortened
+
+
+def enforce_platform_limits(platform: str, content: str) -> str:
+    """
+    Validate content against the platform limits and fix it when it breaks them
+    
+    VALIDATION_MODE=truncate cuts the content locally. VALIDATION_MODE=shorten first
+    tries one shorten-only model call with a small token budget (when the limit is
+    small enough to fit that budget) and truncates only if that still fails.
+    VALIDATION_MODE=off returns content unchanged.
+    """
+    settings = get_settings()
+    if settings.validation_mode == 'off':
+        return content
+    violations = validation.validate(platform, content)
+    if not violations:
+        return content
+    
+    limits = validation.get_limits(platform)
+    # Roughly 4 characters or 0.75 words per token, plus headroom
+    needed_tokens = int((limits.get('max_chars') or 0) / 4 + (limits.get('max_words') or 0) / 0.75) + 50
+    if settings.validation_mode == 'shorten' and needed_tokens <= settings.validation_shorten_max_tokens:
+        validation.validation_stats["shorten_retries"] += 1
+        try:
+            shortened = shorten_content(platform, content, violations, needed_tokens)
+            if not validation.validate(platform, shortened):
+                validation.validation_stats["shorten_retry_successes"] += 1
+                return shortened
+            content = shortened
+        except Exception as e:
+            print(f"Warning: Shorten retry failed for {platform}: {str(e)}")
+    
+    return validation.truncate(platform, content)
+
+
+def check_near_duplicates(
+    client_data: Dict,
+    platform: str,
+    content_type: str,
+    content: str,
+    exclude: Optional[str] = None
+) -> Tuple[str, List[Dict]]:
+    """
+    Flag existing content that is a near-duplicate of freshly generated content
+    
+    Args:
+        client_data: Client onboarding data
+        platform: Target platform
+        content_type: Type of content
+        content: The generated content
+        exclude: Content id to ignore (the item being regenerated)
+    
+    Returns:
+        (content, near-duplicates). With DEDUP_AUTO_REGENERATE enabled, content is
+        regenerated once with an instruction to be distinct before re-checking.
+    """
+    duplicates = dedup.find_near_duplicates(content, exclude=exclude)
+    if duplicates and get_settings().dedup_auto_regenerate:
+        dedup.dedup_stats["auto_regenerations"] += 1
+        content = regenerate_content(
+            client_data=client_data,
+            platform=platform,
+            content_type=content_type,
+            existing_content=content,
+            improvement_focus="make it clearly distinct from previously published posts - use a new angle, hook and wording"
+        )
+        duplicates = dedup.find_near_duplicates(content, exclude=exclude)
+    return content, duplicates
+
+
+def post_to_n8n(platform: str, content: str, client_data: Dict, scheduled_time: Optional[str] = None) -> Dict:
     """
     Send content to n8n webhook for automated posting
     
@@ -288,6 +570,7 @@ def post_to_n8n(platform: str, content: str, client_data: Dict) -> Dict:
         platform: Target platform
         content: Content to post
         client_data: Client information
+        scheduled_time: Publish time the post was scheduled for, if any
     
     Returns:
         Response from n8n
@@ -298,19 +581,22 @@ def post_to_n8n(platform: str, content: str, client_data: Dict) -> Dict:
             'content': content,
             'client_id': client_data.get('client_id'),
             'client_name': client_data.get('company_name'),
-            'scheduled_time': None,  # Can be set for scheduled posts
+            'scheduled_time': scheduled_time,
             'metadata': {
                 'brand_tone': client_data.get('brand_tone'),
                 'industry': client_data.get('industry')
             }
         }
         
+        import requests
+        settings = get_settings()
+        
         headers = {}
-        if N8N_API_KEY:
-            headers['Authorization'] = f'Bearer {N8N_API_KEY}'
+        if settings.n8n_api_key:
+            headers['Authorization'] = f'Bearer {settings.n8n_api_key}'
         
         response = requests.post(
-            N8N_WEBHOOK_URL,
+            settings.n8n_webhook_url,
             json=payload,
             headers=headers,
             timeout=30
@@ -388,6 +674,7 @@ Image Requirements:
 Create an image that represents {company_name}'s brand identity and appeals to {target_audience}."""
         
         # Generate image using DALL-E
+        started = time.perf_counter()
         response = client.images.generate(
             model="dall-e-3",
             prompt=prompt,
@@ -395,6 +682,13 @@ Create an image that represents {company_name}'s brand identity and appeals to {
             quality="standard",
             n=1
         )
+        usage.record(
+            model="dall-e-3",
+            latency=time.perf_counter() - started,
+            platform=platform,
+            client_id=client_data.get('client_id'),
+            images=len(response.data or [])
+        )
         
         if response.data and len(response.data) > 0:
             return response.data[0].url
@@ -407,6 +701,155 @@ Create an image that represents {company_name}'s brand identity and appeals to {
         return None
 
 
+def client_platforms(client_data: Dict) -> List[Tuple[str, str]]:
+    """(platform, content_type) for each of the client's primary_channels"""
+    platforms = [platform.strip() for platform in (client_data.get('primary_channels') or '').split(',')]
+    platforms = [platform for platform in platforms if platform] or DEFAULT_PLATFORMS
+    return [(platform, CONTENT_TYPES.get(platform, 'post')) for platform in platforms]
+
+
+combined_stats = {
+    "calls": 0,
+    "errors": 0,
+    "platforms_requested": 0,
+    "platforms_accepted": 0,
+    "fallbacks": 0,
+}
+
+
+def build_combined_messages(
+    client_data: Dict,
+    platforms: List[Tuple[str, str]],
+    topic: Optional[str] = None
+) -> List[Dict]:
+    """Chat messages asking for every platform's content at once, sharing one brand context block"""
+    brand_tone = client_data.get('brand_tone', 'Professional')
+    industry = client_data.get('industry', 'General')
+    target_audience = client_data.get('target_audience', 'General audience')
+    marketing_goals = client_data.get('marketing_goals', 'Brand awareness')
+    content_preferences = client_data.get('content_preferences', 'Educational')
+    
+    tasks = "\n".join(
+        f'- "{platform}": {PLATFORM_PROMPTS.get(platform, "Create marketing content")} as a '
+        f'{CONTENT_TYPE_PROMPTS.get(content_type, "content")}. Maximum length: {validation.describe_max_length(platform)}'
+        for platform, content_type in platforms
+    )
+    
+    prompt = f"""You are an expert marketing content writer. Create content for each of these platforms:
+{tasks}
+
+Client Information:
+- Company: {client_data.get('company_name', 'Unknown')}
+- Industry: {industry}
+- Brand Tone: {brand_tone}
+- Target Audience: {target_audience}
+- Marketing Goals: {marketing_goals}
+- Content Preferences: {content_preferences}
+{brand.prompt_lines(client_data)}
+{f"- Topic: {topic}" if topic else ""}
+
+Requirements:
+- Match the brand tone: {brand_tone}
+- Appeal to target audience: {target_audience}
+- Align with marketing goals: {marketing_goals}
+- Follow content preferences: {content_preferences}
+- Be engaging and professional
+- Include a clear call-to-action if appropriate
+- Write each platform's content so it stands on its own and fits that platform's format and maximum length
+
+Return a JSON object with one key per platform holding only that platform's content."""
+
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert marketing content writer specializing in creating engaging, brand-aligned content for various platforms."
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+
+def _combined_response_format(platforms: List[Tuple[str, str]]) -> Dict:
+    names = [platform for platform, _ in platforms]
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "platform_content",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {name: {"type": "string"} for name in names},
+                "required": names,
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def generate_combined(
+    client_data: Dict,
+    platforms: List[Tuple[str, str]],
+    topic: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Generate the content of every platform in a single structured (JSON schema) call
+    
+    Returns {platform: content} for the platforms whose part of the response is
+    present, non-empty and within the platform limits; the caller generates the
+    others one by one. Any API or parsing error returns {}.
+    """
+    settings = get_settings()
+    combined_stats["calls"] += 1
+    combined_stats["platforms_requested"] += len(platforms)
+    routes = [routing.select_route(platform, content_type) for platform, content_type in platforms]
+    # Short-form only stays on the small model; anything routed larger needs a model with structured outputs
+    model = settings.model_small if all(route["model"] == settings.model_small for route in routes) else settings.combined_generation_model
+    # The per-platform token budgets, plus room for the JSON keys
+    max_tokens = min(sum(route["max_tokens"] for route in routes) + 20 * len(platforms), settings.combined_max_tokens)
+    parsed: Dict = {}
+    try:
+        text, finish_reason = _chat_completion(
+            model,
+            build_combined_messages(client_data, platforms, topic),
+            GENERATE_TEMPERATURE,
+            max_tokens,
+            client_id=client_data.get('client_id'),
+            route={"name": "combined"},
+            response_format=_combined_response_format(platforms)
+        )
+        # A response cut off at max_tokens is not valid JSON
+        if finish_reason != 'length':
+            parsed = json.loads(text)
+    except Exception as e:
+        combined_stats["errors"] += 1
+        print(f"Warning: Combined generation failed, generating per platform: {str(e)}")
+    
+    accepted = {}
+    for platform, _ in platforms:
+        content = parsed.get(platform) if isinstance(parsed, dict) else None
+        if not isinstance(content, str) or not content.strip():
+            continue
+        content = content.strip()
+        if settings.validation_mode == 'off' or not validation.validate(platform, content):
+            accepted[platform] = content
+    combined_stats["platforms_accepted"] += len(accepted)
+    combined_stats["fallbacks"] += len(platforms) - len(accepted)
+    return accepted
+
+
+def get_combined_metrics() -> Dict:
+    requested = combined_stats["platforms_requested"]
+    return {
+        **combined_stats,
+        "mode": get_settings().generation_mode,
+        "acceptance_ratio": round(combined_stats["platforms_accepted"] / requested, 4) if requested else None,
+    }
+
+metrics.register("combined_generation", get_combined_metrics)
+
+
 def generate_content_for_all_platforms(client_data: Dict) -> List[Dict]:
     """
     Generate content for all platforms specified in client's primary_channels
@@ -417,21 +860,6 @@ def generate_content_for_all_platforms(client_data: Dict) -> List[Dict]:
     Returns:
         List of generated content items
     """
-    platforms = client_data.get('primary_channels', '').split(', ')
-    if not platforms or platforms == ['']:
-        platforms = ['LinkedIn', 'Twitter', 'Instagram']  # Default platforms
-    
-    content_types = {
-        'LinkedIn': 'post',
-        'Twitter': 'post',
-        'Instagram': 'post',
-        'Facebook': 'post',
-        'Reddit': 'post',
-        'Email': 'newsletter',
-        'Website': 'blog',
-        'YouTube': 'video_script'
-    }
-    
     # Check if image generation is requested
     generate_images = client_data.get('generate_images', False) or str(client_data.get('generate_images', '')).lower() == 'true'
     
@@ -440,20 +868,22 @@ def generate_content_for_all_platforms(client_data: Dict) -> List[Dict]:
     uploaded_image_urls = [img.get('url') for img in uploaded_images if img.get('url')]
     
     generated_content = []
+    platforms = client_platforms(client_data)
     
-    for platform in platforms:
-        platform = platform.strip()
-        if not platform:
-            continue
-            
-        content_type = content_types.get(platform, 'post')
-        
+    # GENERATION_MODE=combined: one structured call for all platforms, the ones
+    # it does not deliver valid content for are generated one by one below
+    combined = {}
+    if get_settings().generation_mode == 'combined' and len(platforms) > 1:
+        combined = generate_combined(client_data, platforms)
+    
+    for platform, content_type in platforms:
         try:
-            content = generate_content(
+            content = combined.get(platform) or generate_content(
                 client_data=client_data,
                 platform=platform,
                 content_type=content_type
             )
+            content, duplicates = check_near_duplicates(client_data, platform, content_type, content)
             
             content_item = {
                 'platform': platform,
@@ -463,6 +893,8 @@ def generate_content_for_all_platforms(client_data: Dict) -> List[Dict]:
                 'client_name': client_data.get('company_name'),
                 'status': 'pending'
             }
+            if duplicates:
+                content_item['near_duplicate_of'] = duplicates
             
             # Add uploaded images to content item
             if uploaded_image_urls:
@@ -0,0 +1,933 @@
+"""
+Storage layer with automatic failover between MongoDB and the in-memory store
+
+- While MongoDB is reachable, reads and writes go to MongoDB and every write is
+  mirrored into the in-memory store, which is also warmed from MongoDB on connect
+- When a MongoDB call fails with a connection error the store switches to memory
+  mode: reads are served from the in-memory store and writes are appended to a
+  local journal (JSON lines) so requests keep succeeding during the outage
+- A background monitor pings MongoDB; once it answers again the journal is
+  replayed with bulk writes and MongoDB becomes the source of truth again
+"""
+import asyncio
+import copy
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from config import get_settings, MONGO_COLLECTIONS
+import database
+import events
+import metrics
+
+# Field that uniquely identifies a document in each collection
+KEY_FIELDS = {
+    'clients': 'client_id',
+    'content': 'id',
+    'campaigns': 'id',
+    'usage': 'id',
+    'idempotency': 'key',
+    'batches': 'id',
+    'campaign_summaries': 'client_id',
+    'collection_versions': 'name',
+    'leases': 'name',
+}
+
+database.INDEXES.append(('leases', [('name', 1)], {"unique": True}))
+
+# Incremented by update_versioned on every write, for optimistic concurrency control
+VERSION_FIELD = 'version'
+
+# Written to MongoDB without a memory copy: append-only collections are never read back
+# by key, and leases only coordinate workers through MongoDB (while MongoDB is down
+# their writes are kept in memory too)
+UNMIRRORED_COLLECTIONS = ('usage', 'idempotency', 'leases')
+
+# In-memory store: collection name -> {key: document}, least recently written first.
+# While MongoDB is available it is a mirror of at most STORAGE_WARM_LIMIT documents
+# per collection; during an outage it holds everything written
+memory: Dict[str, Dict[str, Dict]] = {name: OrderedDict() for name in MONGO_COLLECTIONS}
+
+# Mirrored collections with documents in MongoDB that the memory store does not hold
+# (evicted, or beyond the warm load); reads served from memory cover only part of them
+_partial_mirrors: Set[str] = set()
+
+# True while MongoDB is reachable and the journal has been fully replayed
+mongo_available = False
+
+_monitor_task: Optional[asyncio.Task] = None
+_replay_lock = asyncio.Lock()
+
+storage_stats = {
+    "failovers": 0,
+    "recoveries": 0,
+    "journaled_writes": 0,
+    "replayed_writes": 0,
+    "memory_reads": 0,
+    "version_conflicts": 0,
+    "mirror_evictions": 0,
+}
+
+# Entries in the journal files, kept up to date instead of re-reading them
+_journal_entries = 0
+
+
+def is_mongo_available() -> bool:
+    return mongo_available
+
+
+def collection(name: str, read_only: bool = False):
+    """Get the MongoDB collection handle, or None while running from memory"""
+    if not mongo_available:
+        return None
+    return database.get_collection(name, read_only)
+
+
+def _is_connection_error(error: Exception) -> bool:
+    try:
+        from pymongo.errors import ConnectionFailure
+    except ImportError:
+        return False
+    return isinstance(error, ConnectionFailure)
+
+
+def fail_over(error: Exception) -> None:
+    """Switch to memory mode if error is a MongoDB connection failure, otherwise re-raise it"""
+    if not _is_connection_error(error):
+        raise error
+    _mark_unavailable(error)
+
+
+def _mark_unavailable(error: Exception) -> None:
+    global mongo_available
+    if mongo_available:
+        mongo_available = False
+        storage_stats["failovers"] += 1
+        print(f"⚠️ MongoDB unavailable, serving from memory: {str(error)}")
+
+
+# ---------------------------------------------------------------------------
+# In-memory store
+# ---------------------------------------------------------------------------
+
+def _compare(value, operator: str, expected) -> bool:
+    if operator == '$in':
+        return value in expected
+    if operator == '$nin':
+        return value not in expected
+    if operator == '$ne':
+        return value != expected
+    if operator == '$exists':
+        return (value is not None) == bool(expected)
+    if value is None:
+        return False
+    if operator == '$gt':
+        return value > expected
+    if operator == '$gte':
+        return value >= expected
+    if operator == '$lt':
+        return value < expected
+    if operator == '$lte':
+        return value <= expected
+    raise ValueError(f"Unsupported query operator for in-memory store: {operator}")
+
+
+def matches(document: Dict, query: Dict) -> bool:
+    """Evaluate a simple MongoDB-style query (equality and comparison operators) against a document"""
+    for field, expected in query.items():
+        value = document.get(field)
+        if isinstance(expected, dict) and expected and all(k.startswith('$') for k in expected):
+            if not all(_compare(value, op, operand) for op, operand in expected.items()):
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+def _strip_id(document: Dict) -> Dict:
+    return {k: v for k, v in document.items() if k != '_id'}
+
+
+def _memory_key(name: str, document: Dict) -> Optional[str]:
+    return document.get(KEY_FIELDS[name])
+
+
+def _memory_lookup(name: str, query: Dict) -> List[Dict]:
+    """Find stored documents, using the key index when the query is an exact key lookup"""
+    store = memory[name]
+    key_field = KEY_FIELDS[name]
+    key = query.get(key_field)
+    if isinstance(key, str):
+        document = store.get(key)
+        return [document] if document is not None and matches(document, query) else []
+    if isinstance(key, dict) and list(key) == ['$in']:
+        # Batch of keys: look each one up instead of scanning the store (and testing
+        # every document against the whole key list)
+        rest = {field: expected for field, expected in query.items() if field != key_field}
+        candidates = (store.get(k) for k in dict.fromkeys(key['$in']))
+        return [document for document in candidates if document is not None and matches(document, rest)]
+    return [document for document in store.values() if matches(document, query)]
+
+
+def _evict(name: str) -> None:
+    """Drop the least recently written documents beyond the mirror bound (only while MongoDB holds them)"""
+    if not mongo_available:
+        return
+    store = memory[name]
+    excess = len(store) - max(get_settings().storage_warm_limit, 0)
+    for _ in range(excess):
+        store.popitem(last=False)
+    if excess > 0:
+        storage_stats["mirror_evictions"] += excess
+        _partial_mirrors.add(name)
+
+
+def _memory_insert(name: str, document: Dict) -> None:
+    key = _memory_key(name, document)
+    if key is not None:
+        memory[name][key] = copy.deepcopy(_strip_id(document))
+        memory[name].move_to_end(key)
+        _evict(name)
+
+
+def _memory_update(name: str, query: Dict, fields: Dict, many: bool = False) -> int:
+    updated = 0
+    for document in _memory_lookup(name, query):
+        document.update(copy.deepcopy(fields))
+        memory[name].move_to_end(_memory_key(name, document))
+        updated += 1
+        if not many:
+            break
+    return updated
+
+
+def _mirror_insert(name: str, document: Dict) -> None:
+    """Copy a document written to MongoDB into the memory mirror"""
+    if name not in UNMIRRORED_COLLECTIONS:
+        _memory_insert(name, document)
+
+
+def _mirror_update(name: str, query: Dict, fields: Dict, many: bool = False) -> None:
+    if name not in UNMIRRORED_COLLECTIONS:
+        _memory_update(name, query, fields, many)
+
+
+def _memory_delete(name: str, query: Dict, many: bool = False) -> int:
+    deleted = 0
+    for document in _memory_lookup(name, query):
+        memory[name].pop(_memory_key(name, document), None)
+        deleted += 1
+        if not many:
+            break
+    return deleted
+
+
+def _apply_to_memory(entry: Dict) -> None:
+    name = entry["collection"]
+    if entry["op"] == "insert":
+        _memory_insert(name, entry["document"])
+    elif entry["op"] == "update":
+        _memory_update(name, entry["query"], entry["set"], entry.get("many", False))
+    elif entry["op"] == "delete":
+        _memory_delete(name, entry["query"], entry.get("many", False))
+
+
+# ---------------------------------------------------------------------------
+# Write-behind journal
+# ---------------------------------------------------------------------------
+
+def _journal_path() -> str:
+    return get_settings().storage_journal_path
+
+
+def _journal_default(value):
+    # Datetimes (TTL fields such as expires_at) are tagged so a replay restores them as dates
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return str(value)
+
+
+def _journal_object(value: Dict):
+    if len(value) == 1 and isinstance(value.get("$date"), str):
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def _journal_append(entries: List[Dict]) -> None:
+    path = _journal_path()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(''.join(json.dumps(entry, default=_journal_default) + '\n' for entry in entries))
+    global _journal_entries
+    _journal_entries += len(entries)
+    storage_stats["journaled_writes"] += len(entries)
+
+
+def _journal_read(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line, object_hook=_journal_object))
+            except json.JSONDecodeError:
+                # A torn final line from a crash mid-append; everything before it is intact
+                print("Warning: Skipping unreadable storage journal entry")
+    return entries
+
+
+def journal_pending() -> int:
+    return _journal_entries
+
+
+def _record_offline_write(entry: Dict) -> None:
+    _record_offline_writes([entry])
+
+
+def _record_offline_writes(entries: List[Dict]) -> None:
+    for entry in entries:
+        _apply_to_memory(entry)
+    _journal_append(entries)
+
+
+def _bulk_operations(entries: List[Dict]) -> List:
+    from pymongo import ReplaceOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany
+
+    operations = []
+    for entry in entries:
+        name = entry["collection"]
+        if entry["op"] == "insert":
+            document = _strip_id(entry["document"])
+            # Upsert by key so replaying an insert twice (e.g. after a crash) never duplicates it
+            key_field = KEY_FIELDS[name]
+            operations.append(ReplaceOne({key_field: document[key_field]}, document, upsert=True))
+        elif entry["op"] == "update":
+            update_cls = UpdateMany if entry.get("many") else UpdateOne
+            operations.append(update_cls(entry["query"], {"$set": entry["set"]}))
+        elif entry["op"] == "delete":
+            delete_cls = DeleteMany if entry.get("many") else DeleteOne
+            operations.append(delete_cls(entry["query"]))
+    return operations
+
+
+async def _replay_entries(entries: List[Dict]) -> None:
+    """Replay journal entries in order, batching consecutive writes to the same collection"""
+    batch_size = get_settings().storage_replay_batch_size
+    index = 0
+    while index < len(entries):
+        name = entries[index]["collection"]
+        batch = []
+        while index < len(entries) and entries[index]["collection"] == name and len(batch) < batch_size:
+            batch.append(entries[index])
+            index += 1
+        await database.get_collection(name, False).bulk_write(_bulk_operations(batch), ordered=True)
+        storage_stats["replayed_writes"] += len(batch)
+
+
+async def _replay_journal() -> None:
+    """Replay the journal into MongoDB and switch back to MongoDB once it is empty"""
+    global mongo_available, _journal_entries
+    path = _journal_path()
+    replaying_path = path + '.replaying'
+    async with _replay_lock:
+        while True:
+            # A leftover .replaying file means a previous replay was interrupted; finish it first
+            if not os.path.exists(replaying_path):
+                if not os.path.exists(path):
+                    break
+                os.replace(path, replaying_path)
+            entries = _journal_read(replaying_path)
+            if entries:
+                await _replay_entries(entries)
+                print(f"✅ Replayed {len(entries)} journaled writes to MongoDB")
+            os.remove(replaying_path)
+            _journal_entries = max(0, _journal_entries - len(entries))
+        # No await between the final journal check and the flip, so no write can slip in between
+        mongo_available = True
+        _journal_entries = 0
+        # Writes kept in memory during the outage are in MongoDB now
+        for name in UNMIRRORED_COLLECTIONS:
+            memory[name].clear()
+
+
+def _load_journal_into_memory() -> None:
+    """Re-apply writes journaled before a restart so they stay visible while MongoDB is down"""
+    global _journal_entries
+    path = _journal_path()
+    entries = _journal_read(path + '.replaying') + _journal_read(path)
+    for entry in entries:
+        _apply_to_memory(entry)
+    _journal_entries = len(entries)
+
+
+# ---------------------------------------------------------------------------
+# Lifecycle
+# ---------------------------------------------------------------------------
+
+async def _warm_memory() -> None:
+    """Load the most recent documents of each collection into the in-memory store"""
+    limit = get_settings().storage_warm_limit
+    if limit <= 0:
+        _partial_mirrors.update(name for name in MONGO_COLLECTIONS if name not in UNMIRRORED_COLLECTIONS)
+        return
+    for name in MONGO_COLLECTIONS:
+        if name in UNMIRRORED_COLLECTIONS:
+            continue
+        documents = await database.get_collection(name, True).find({}).sort('_id', -1).to_list(length=limit)
+        for document in reversed(documents):
+            _memory_insert(name, document)
+        if len(documents) >= limit:
+            _partial_mirrors.add(name)
+        else:
+            # The whole collection fit
+            _partial_mirrors.discard(name)
+
+
+async def _connect() -> bool:
+    """Connect (or re-check the connection) and replay the journal; returns True when MongoDB is usable"""
+    try:
+        if database.client is None:
+            await database.connect_to_mongo()
+        else:
+            await database.client.admin.command('ping')
+        if not mongo_available:
+            await database.ensure_indexes()
+            await _replay_journal()
+            await _warm_memory()
+            storage_stats["recoveries"] += 1
+            events.publish('storage.recovered', {})
+            print("✅ MongoDB available, storage back on MongoDB")
+        return True
+    except Exception as e:
+        if not _is_connection_error(e):
+            print(f"❌ Error restoring MongoDB storage: {str(e)}")
+        _mark_unavailable(e)
+        return False
+
+
+async def _monitor() -> None:
+    interval = get_settings().storage_monitor_interval
+    while True:
+        await asyncio.sleep(interval)
+        await _connect()
+
+
+async def start() -> None:
+    """Connect to MongoDB if possible and start the availability monitor"""
+    global _monitor_task
+    _load_journal_into_memory()
+    try:
+        await database.connect_to_mongo()
+        await database.ensure_indexes()
+        await _replay_journal()
+        await _warm_memory()
+    except Exception as e:
+        print(f"⚠️ Starting with in-memory storage: {str(e)}")
+    _monitor_task = asyncio.create_task(_monitor())
+
+
+async def stop() -> None:
+    global _monitor_task, mongo_available
+    if _monitor_task is not None:
+        _monitor_task.cancel()
+        _monitor_task = None
+    mongo_available = False
+    await database.close_mongo_connection()
+
+
+# ---------------------------------------------------------------------------
+# Operations
+# ---------------------------------------------------------------------------
+
+def _serializable(document: Optional[Dict]) -> Optional[Dict]:
+    if document is not None and '_id' in document:
+        document['_id'] = str(document['_id'])
+    return document
+
+
+async def find_one(name: str, query: Dict, read_only: bool = False) -> Optional[Dict]:
+    """Find a single document"""
+    handle = collection(name, read_only)
+    if handle is not None:
+        try:
+            return _serializable(await handle.find_one(query))
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    storage_stats["memory_reads"] += 1
+    documents = _memory_lookup(name, query)
+    return copy.deepcopy(documents[0]) if documents else None
+
+
+def _sorted(documents: List[Dict], sort: List[Tuple[str, int]]) -> List[Dict]:
+    """documents ordered like a MongoDB sort (missing values first when ascending)"""
+    documents = list(documents)
+    for field, direction in reversed(sort):
+        documents.sort(key=lambda document: (document.get(field) is not None, document.get(field)), reverse=direction < 0)
+    return documents
+
+
+async def find(
+    name: str,
+    query: Dict,
+    limit: int = 1000,
+    read_only: bool = False,
+    sort: Optional[List[Tuple[str, int]]] = None,
+    skip: int = 0
+) -> List[Dict]:
+    """Find documents matching query, up to limit, optionally sorted ([(field, 1 or -1)]) and skipping the first skip"""
+    handle = collection(name, read_only)
+    if handle is not None:
+        try:
+            cursor = handle.find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            if skip:
+                cursor = cursor.skip(skip)
+            documents = await cursor.to_list(length=limit)
+            return [_serializable(document) for document in documents]
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    storage_stats["memory_reads"] += 1
+    documents = _memory_lookup(name, query)
+    if sort:
+        documents = _sorted(documents, sort)
+    return [copy.deepcopy(document) for document in documents[skip:skip + limit]]
+
+
+async def count(name: str, query: Dict, read_only: bool = False) -> int:
+    """Count documents matching query"""
+    handle = collection(name, read_only)
+    if handle is not None:
+        try:
+            return await handle.count_documents(query)
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    storage_stats["memory_reads"] += 1
+    return len(_memory_lookup(name, query))
+
+
+def _affected_keys(name: str, query: Dict) -> List[str]:
+    """Keys of the documents a write will touch, from memory or from an exact key query"""
+    keys = [_memory_key(name, document) for document in _memory_lookup(name, query)]
+    key = query.get(KEY_FIELDS[name])
+    if not keys and isinstance(key, str):
+        keys = [key]
+    return keys
+
+
+def _notify(name: str, op: str, keys: List[str], previous: Optional[Dict[str, Dict]] = None) -> None:
+    """Publish '<collection>.changed' on the events bus for each written document"""
+    for key in keys:
+        document = memory[name].get(key) if op != 'delete' else None
+        events.publish(f'{name}.changed', {
+            "collection": name,
+            "op": op,
+            "key": key,
+            "document": copy.deepcopy(document) if document is not None else None,
+            "previous": (previous or {}).get(key),
+        })
+
+
+async def insert_one(name: str, document: Dict) -> Dict:
+    """Insert a document (MongoDB sets document['_id'] in place, as with Motor)"""
+    await insert_many(name, [document])
+    return document
+
+
+async def insert_many(name: str, documents: List[Dict]) -> List[Dict]:
+    """Insert several documents in one round trip"""
+    if not documents:
+        return documents
+    handle = collection(name)
+    stored = False
+    if handle is not None:
+        try:
+            if len(documents) == 1:
+                await handle.insert_one(documents[0])
+            else:
+                await handle.insert_many(documents)
+            for document in documents:
+                _mirror_insert(name, document)
+            stored = True
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    if not stored:
+        for document in documents:
+            _record_offline_write({"op": "insert", "collection": name, "document": _strip_id(document)})
+    _notify(name, 'insert', [_memory_key(name, document) for document in documents])
+    return documents
+
+
+async def insert_missing(name: str, documents: List[Dict]) -> List[Dict]:
+    """Insert the documents whose key is not stored yet, in one round trip; returns the inserted ones"""
+    if not documents:
+        return []
+    key_field = KEY_FIELDS[name]
+    handle = collection(name)
+    if handle is not None:
+        try:
+            from pymongo import UpdateOne
+            result = await handle.bulk_write([
+                UpdateOne({key_field: document[key_field]}, {"$setOnInsert": _strip_id(document)}, upsert=True)
+                for document in documents
+            ], ordered=False)
+            inserted = [documents[index] for index in sorted(result.upserted_ids)]
+            for document in inserted:
+                _mirror_insert(name, document)
+            _notify(name, 'insert', [document[key_field] for document in inserted])
+            return inserted
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    inserted = [document for document in documents if document[key_field] not in memory[name]]
+    for document in inserted:
+        _record_offline_write({"op": "insert", "collection": name, "document": _strip_id(document)})
+    _notify(name, 'insert', [document[key_field] for document in inserted])
+    return inserted
+
+
+async def update_one(name: str, query: Dict, fields: Dict) -> bool:
+    """Set fields on the first matching document; returns True if a document matched"""
+    handle = collection(name)
+    if handle is not None:
+        try:
+            result = await handle.update_one(query, {"$set": fields})
+            _mirror_update(name, query, fields)
+            if result.matched_count > 0:
+                _notify(name, 'update', _affected_keys(name, query)[:1])
+            return result.matched_count > 0
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    matched = bool(_memory_lookup(name, query))
+    _record_offline_write({"op": "update", "collection": name, "query": query, "set": fields})
+    if matched:
+        _notify(name, 'update', _affected_keys(name, query)[:1])
+    return matched
+
+
+def _incremented(name: str, key: str, fields: Dict, inc: Optional[Dict]) -> Dict:
+    """fields plus the values the inc fields take on the stored copy of the document"""
+    if not inc:
+        return fields
+    document = memory[name].get(key)
+    if document is None:
+        return fields
+    return {**fields, **{field: (document.get(field) or 0) + amount for field, amount in inc.items()}}
+
+
+def _applied(document: Dict, fields: Dict, inc: Optional[Dict]) -> Dict:
+    """document after $set fields and $inc inc (top-level fields)"""
+    updated = {**document, **fields}
+    for field, amount in (inc or {}).items():
+        updated[field] = (document.get(field) or 0) + amount
+    return updated
+
+
+async def find_one_and_update(
+    name: str,
+    query: Dict,
+    fields: Dict,
+    inc: Optional[Dict] = None,
+    upsert: bool = False,
+    return_before: bool = False
+) -> Optional[Dict]:
+    """
+    Set fields (and increment inc) on the first matching document in one round trip; returns it
+    after the update (with return_before, as it was before the update: {} for an upsert that inserted).
+    With upsert, a document is created from the query's equality fields when none matches.
+    The change event carries the document before the update as 'previous'
+    """
+    key_field = KEY_FIELDS[name]
+    handle = collection(name)
+    if handle is not None:
+        try:
+            from pymongo import ReturnDocument
+
+            update = {"$set": fields}
+            if inc:
+                update["$inc"] = inc
+            # The document before the update, so the event has both sides; the result is derived from it
+            before = await handle.find_one_and_update(query, update, upsert=upsert, return_document=ReturnDocument.BEFORE)
+            if before is None and not upsert:
+                return None
+            if before is None:
+                seed = {field: value for field, value in query.items() if not isinstance(value, dict)}
+                document, previous = _applied(seed, fields, inc), {}
+            else:
+                document, previous = _applied(before, fields, inc), {before[key_field]: _strip_id(before)}
+            # The whole updated document, so the memory copy is exact even if it was not warmed
+            _mirror_insert(name, document)
+            _notify(name, 'update' if before is not None else 'insert', [_memory_key(name, document)], previous)
+            return _serializable(document if not return_before else (_strip_id(before) if before is not None else {}))
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    documents = _memory_lookup(name, query)
+    if not documents:
+        if not upsert:
+            return None
+        seed = {field: value for field, value in query.items() if not isinstance(value, dict)}
+        document = _applied(seed, fields, inc)
+        _record_offline_write({"op": "insert", "collection": name, "document": document})
+        _notify(name, 'insert', [_memory_key(name, document)])
+        return copy.deepcopy(document) if not return_before else {}
+    key = _memory_key(name, documents[0])
+    previous = {key: copy.deepcopy(documents[0])}
+    fields = _incremented(name, key, fields, inc)
+    # Journaled by key with the resulting values, so the replay does not depend on the original query
+    _record_offline_write({"op": "update", "collection": name, "query": {key_field: key}, "set": fields})
+    _notify(name, 'update', [key], previous)
+    return copy.deepcopy(memory[name][key] if not return_before else previous[key])
+
+
+def version_query(query: Dict, expected_version: int) -> Dict:
+    """query restricted to one version (documents written before versioning count as version 0)"""
+    return {**query, VERSION_FIELD: expected_version if expected_version else {"$in": [0, None]}}
+
+
+async def update_versioned(name: str, key: str, fields: Dict, expected_version: Optional[int] = None) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """
+    Set fields and bump the document's version in one round trip; with expected_version
+    only if the document is still at that version (optimistic concurrency).
+    Returns (updated document, None), or (None, current document) on a version
+    conflict, or (None, None) when there is no such document
+    """
+    query = {KEY_FIELDS[name]: key}
+    if expected_version is not None:
+        query = version_query(query, expected_version)
+    document = await find_one_and_update(name, query, fields, inc={VERSION_FIELD: 1})
+    if document is not None or expected_version is None:
+        return document, None
+    # Only failed writes pay for a second read, to tell a conflict from a missing document
+    storage_stats["version_conflicts"] += 1
+    return None, await find_one(name, {KEY_FIELDS[name]: key})
+
+
+async def delete_one(name: str, query: Dict) -> bool:
+    """Delete the first matching document; returns True if a document was deleted"""
+    handle = collection(name)
+    if handle is not None:
+        try:
+            # Returns the deleted document, so the event carries it even when it was not in memory
+            document = await handle.find_one_and_delete(query)
+            if document is None:
+                return False
+            key = _memory_key(name, document)
+            _memory_delete(name, {KEY_FIELDS[name]: key})
+            _notify(name, 'delete', [key], {key: _strip_id(document)})
+            return True
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    keys = _affected_keys(name, query)[:1]
+    previous = {key: copy.deepcopy(memory[name][key]) for key in keys if key in memory[name]}
+    deleted = bool(_memory_lookup(name, query))
+    _record_offline_write({"op": "delete", "collection": name, "query": query})
+    if deleted:
+        _notify(name, 'delete', keys, previous)
+    return deleted
+
+
+async def _existing_keys(handle, name: str, query: Dict) -> List[str]:
+    key_field = KEY_FIELDS[name]
+    documents = await handle.find(query, {key_field: 1, '_id': 0}).to_list(length=None)
+    return [document[key_field] for document in documents if key_field in document]
+
+
+async def update_many(name: str, query: Dict, fields: Dict) -> List[str]:
+    """Set fields on every matching document; returns the keys of the updated documents"""
+    key_field = KEY_FIELDS[name]
+    handle = collection(name)
+    if handle is not None:
+        try:
+            keys = await _existing_keys(handle, name, query)
+            if keys:
+                await handle.update_many({key_field: {"$in": keys}}, {"$set": fields})
+                _mirror_update(name, {key_field: {"$in": keys}}, fields, many=True)
+                _notify(name, 'update', keys)
+            return keys
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    keys = [_memory_key(name, document) for document in _memory_lookup(name, query)]
+    if keys:
+        _record_offline_write({"op": "update", "collection": name, "query": {key_field: {"$in": keys}}, "set": fields, "many": True})
+        _notify(name, 'update', keys)
+    return keys
+
+
+async def bulk_update(
+    name: str,
+    updates: Dict[str, Dict],
+    inc: Optional[Dict] = None,
+    conditions: Optional[Dict[str, Dict]] = None
+) -> List[str]:
+    """
+    Set per-document fields ({key: fields}, and increment inc) in one bulk write; a
+    document with conditions ({key: query}) is only written while it still matches them.
+    Returns the keys that were written
+    """
+    if not updates:
+        return []
+    key_field = KEY_FIELDS[name]
+    conditions = conditions or {}
+    selector = lambda key: {key_field: key, **conditions.get(key, {})}
+    query = {key_field: {"$in": list(updates)}}
+    handle = collection(name)
+    if handle is not None:
+        try:
+            from pymongo import UpdateOne
+            if conditions:
+                keys = await _existing_keys(handle, name, {"$or": [selector(key) for key in updates]})
+            else:
+                keys = await _existing_keys(handle, name, query)
+            if keys:
+                operation = lambda key: {"$set": updates[key], "$inc": inc} if inc else {"$set": updates[key]}
+                await handle.bulk_write(
+                    [UpdateOne(selector(key), operation(key)) for key in keys],
+                    ordered=False
+                )
+                for key in keys:
+                    _mirror_update(name, {key_field: key}, _incremented(name, key, updates[key], inc))
+                _notify(name, 'update', keys)
+            return keys
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    keys = [
+        _memory_key(name, document) for document in _memory_lookup(name, query)
+        if matches(document, conditions.get(_memory_key(name, document), {}))
+    ]
+    _record_offline_writes([
+        {"op": "update", "collection": name, "query": selector(key), "set": _incremented(name, key, updates[key], inc)}
+        for key in keys
+    ])
+    _notify(name, 'update', keys)
+    return keys
+
+
+async def delete_many(name: str, query: Dict) -> List[str]:
+    """Delete every matching document; returns the keys of the deleted documents"""
+    key_field = KEY_FIELDS[name]
+    handle = collection(name)
+    if handle is not None:
+        try:
+            keys = await _existing_keys(handle, name, query)
+            if keys:
+                previous = {key: memory[name][key] for key in keys if key in memory[name]}
+                await handle.delete_many({key_field: {"$in": keys}})
+                _memory_delete(name, {key_field: {"$in": keys}}, many=True)
+                _notify(name, 'delete', keys, previous)
+            return keys
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    previous = {_memory_key(name, document): document for document in _memory_lookup(name, query)}
+    keys = list(previous)
+    if keys:
+        _record_offline_write({"op": "delete", "collection": name, "query": {key_field: {"$in": keys}}, "many": True})
+        _notify(name, 'delete', keys, previous)
+    return keys
+
+
+async def acquire_lease(name: str, seconds: float) -> Optional[str]:
+    """
+    Take the named lease for seconds unless another holder's has not expired yet;
+    returns a token for release_lease, or None. While MongoDB is down leases are per process
+    """
+    now = time.time()
+    lease = {"name": name, "token": uuid.uuid4().hex, "expires_at": now + seconds}
+    handle = collection('leases')
+    if handle is not None:
+        try:
+            from pymongo.errors import DuplicateKeyError
+            try:
+                # Matches an expired lease, or inserts one; an unexpired lease makes the insert fail on the unique key
+                await handle.update_one({"name": name, "expires_at": {"$lt": now}}, {"$set": lease}, upsert=True)
+            except DuplicateKeyError:
+                return None
+            return lease["token"]
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    current = memory['leases'].get(name)
+    if current is not None and current["expires_at"] >= now:
+        return None
+    memory['leases'][name] = lease
+    return lease["token"]
+
+
+async def renew_lease(name: str, token: str, seconds: float) -> bool:
+    """Extend a lease this holder still has; False when it expired and was taken over"""
+    expires_at = time.time() + seconds
+    handle = collection('leases')
+    if handle is not None:
+        try:
+            result = await handle.update_one({"name": name, "token": token}, {"$set": {"expires_at": expires_at}})
+            return result.matched_count > 0
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    current = memory['leases'].get(name)
+    if current is None or current["token"] != token:
+        return False
+    current["expires_at"] = expires_at
+    return True
+
+
+async def release_lease(name: str, token: str) -> None:
+    handle = collection('leases')
+    if handle is not None:
+        try:
+            await handle.delete_one({"name": name, "token": token})
+            return
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            _mark_unavailable(e)
+    if (memory['leases'].get(name) or {}).get("token") == token:
+        del memory['leases'][name]
+
+
+def mirror_complete(name: str) -> bool:
+    """False when MongoDB holds documents of the collection that the memory store does not"""
+    return name not in _partial_mirrors
+
+
+def get_storage_metrics() -> Dict:
+    return {
+        **storage_stats,
+        "mode": "mongo" if mongo_available else "memory",
+        "journal_pending": journal_pending(),
+        "memory_documents": {name: len(store) for name, store in memory.items()},
+        "partial_mirrors": sorted(_partial_mirrors),
+    }
+
+metrics.register("storage", get_storage_metrics)
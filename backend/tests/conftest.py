@@ -0,0 +1,58 @@
+"""
+Shared test setup: the app runs in in-memory storage mode (MongoDB points at a
+closed port), with journal, archive, batch and profile files in a temporary directory
+"""
+import dataclasses
+import os
+import sys
+import tempfile
+
+TMP_DIR = tempfile.mkdtemp(prefix='campaignforge-tests-')
+
+os.environ.update({
+    'MONGODB_URL': 'mongodb://127.0.0.1:1/',
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': '50',
+    'STORAGE_JOURNAL_PATH': os.path.join(TMP_DIR, 'journal.jsonl'),
+    'ARCHIVE_DIR': os.path.join(TMP_DIR, 'archive'),
+    'BATCH_DIR': os.path.join(TMP_DIR, 'batches'),
+    'PROFILER_DIR': os.path.join(TMP_DIR, 'profiles'),
+    'OPENAI_API_KEY': '',
+    'WARMUP_ON_STARTUP': 'false',
+})
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+import config
+import storage
+
+
+@pytest.fixture(autouse=True)
+def fresh_storage():
+    """Every test starts with empty collections and no journal"""
+    for store in storage.memory.values():
+        store.clear()
+    storage._partial_mirrors.clear()
+    path = config.get_settings().storage_journal_path
+    for journal in (path, path + '.replaying'):
+        if os.path.exists(journal):
+            os.remove(journal)
+    storage._journal_entries = 0
+    yield
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    """Replace settings for one test: settings(scheduler_enabled=False, ...)"""
+    def override(**changes):
+        monkeypatch.setattr(config, 'settings', dataclasses.replace(config.get_settings(), **changes))
+        return config.settings
+    return override
+
+
+@pytest.fixture
+def client():
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -0,0 +1,27 @@
+import admission
+
+
+def test_expensive_requests_are_refused_while_not_accepting(client):
+    client.portal.call(admission.stop)
+    try:
+        response = client.post('/api/content/c1/regenerate', json={})
+        # Cheap endpoints keep working while the instance drains
+        assert client.get('/health').status_code == 200
+    finally:
+        client.portal.call(admission.start)
+
+    assert response.status_code == 503
+    assert response.headers['retry-after'] and response.json()['message'].startswith('Server is starting or shutting down')
+    assert admission._gates['generation'].stats['not_accepting'] >= 1
+
+
+def test_ready_is_503_until_a_dependency_check_completes(client, monkeypatch):
+    async def failing_check():
+        raise RuntimeError('check crashed')
+
+    monkeypatch.setattr(admission, '_ready_result', None)
+    monkeypatch.setattr(admission, '_check_dependencies', failing_check)
+    response = client.get('/ready')
+
+    assert response.status_code == 503
+    assert response.json()['reason'] == 'not_probed_yet' and response.json()['dependencies'] is None
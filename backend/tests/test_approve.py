@@ -0,0 +1,73 @@
+import pytest
+import main
+import storage
+
+
+def _seed(client):
+    client.portal.call(storage.insert_one, 'clients', {'client_id': 'acme', 'company_name': 'Acme'})
+    client.portal.call(storage.insert_one, 'content', {
+        'id': 'c1', 'client_id': 'acme', 'platform': 'Twitter', 'content': 'Hello', 'status': 'pending', 'version': 3
+    })
+
+
+def test_approve_without_scheduler_claims_then_posts(client, settings, monkeypatch):
+    settings(scheduler_enabled=False)
+    _seed(client)
+    posts = []
+
+    def post_to_n8n(platform, content, client_data):
+        # The claim is stored before the post goes out
+        posts.append(storage.memory['content']['c1']['publish_status'])
+        return {'success': True}
+
+    monkeypatch.setattr(main, 'post_to_n8n', post_to_n8n)
+    response = client.post('/api/content/c1/approve', json={'version': 3})
+
+    assert response.status_code == 200
+    assert posts == ['publishing']
+    data = response.json()['data']
+    assert data['status'] == 'approved' and data['publish_status'] == 'published'
+    assert data['n8n_result'] == {'success': True} and data['version'] == 5
+
+
+def test_approve_of_a_stale_or_claimed_version_does_not_post(client, settings, monkeypatch):
+    settings(scheduler_enabled=False)
+    _seed(client)
+    posts = []
+    monkeypatch.setattr(main, 'post_to_n8n', lambda **kwargs: posts.append(kwargs) or {'success': True})
+
+    assert client.post('/api/content/c1/approve', json={'version': 2}).status_code == 409
+
+    client.portal.call(storage.update_one, 'content', {'id': 'c1'}, {'publish_status': 'publishing'})
+    assert client.post('/api/content/c1/approve').status_code == 409
+    assert posts == []
+
+
+def test_approve_of_published_or_scheduled_content_is_refused(client, settings, monkeypatch):
+    _seed(client)
+    posts = []
+    monkeypatch.setattr(main, 'post_to_n8n', lambda **kwargs: posts.append(kwargs) or {'success': True})
+
+    for scheduler_enabled in (False, True):
+        settings(scheduler_enabled=scheduler_enabled)
+        for publish_status in ('published', 'scheduled'):
+            client.portal.call(storage.update_one, 'content', {'id': 'c1'}, {'publish_status': publish_status})
+            response = client.post('/api/content/c1/approve')
+            assert response.status_code == 409
+            assert response.json()['message'] == f'Content is already {publish_status}'
+    assert posts == []
+    assert storage.memory['content']['c1']['version'] == 3
+
+
+def test_approve_of_content_over_the_limits_releases_the_claim(client, settings, monkeypatch):
+    settings(scheduler_enabled=False)
+    _seed(client)
+    client.portal.call(storage.update_one, 'content', {'id': 'c1'}, {'content': 'x' * 400, 'publish_status': 'failed'})
+    monkeypatch.setattr(main, 'post_to_n8n', lambda **kwargs: pytest.fail('posted'))
+
+    response = client.post('/api/content/c1/approve')
+
+    assert response.status_code == 422
+    content = storage.memory['content']['c1']
+    assert content['status'] == 'pending' and content['publish_status'] == 'failed'
+    assert content.get('approved_at') is None and content['version'] == 5
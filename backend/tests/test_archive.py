@@ -0,0 +1,30 @@
+import time
+import archive
+import storage
+
+
+def _wait_for(client, job_id):
+    for _ in range(100):
+        job = client.get(f'/api/jobs/{job_id}').json()['job']
+        if job['state'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError('job did not finish')
+
+
+def test_delete_removes_the_client_and_its_upload(client, settings, tmp_path, monkeypatch):
+    settings(archive_batch_pause_seconds=0)
+    monkeypatch.setattr(archive, 'UPLOAD_DIR', tmp_path)
+    (tmp_path / 'logo.png').write_bytes(b'png')
+    client.portal.call(storage.insert_one, 'clients', {
+        'client_id': 'acme', 'company_name': 'Acme', 'images': [{'stored_filename': 'logo.png'}]
+    })
+    client.portal.call(storage.insert_one, 'content', {'id': 'c1', 'client_id': 'acme', 'content': 'Hello'})
+
+    response = client.delete('/api/client/acme')
+    assert response.status_code == 202
+    job = _wait_for(client, response.json()['job']['job_id'])
+
+    assert job['state'] == 'completed' and job['error'] is None
+    assert job['uploads_removed'] == 1 and not (tmp_path / 'logo.png').exists()
+    assert 'acme' not in storage.memory['clients'] and 'c1' not in storage.memory['content']
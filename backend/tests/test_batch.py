@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from openai import OpenAI
+import batch
+import batch_stub
+import services
+import storage
+
+CLIENT = {'client_id': 'acme', 'company_name': 'Acme', 'status': 'active', 'primary_channels': 'Twitter, LinkedIn'}
+
+
+@pytest.fixture
+def openai_stub(monkeypatch):
+    """The OpenAI client talks to batch_stub.py in process; batches finish as soon as they are polled"""
+    monkeypatch.setenv('BATCH_STUB_DELAY_SECONDS', '0')
+    monkeypatch.setattr(services, 'openai_client', OpenAI(
+        api_key='stub', base_url='http://testserver/v1', http_client=TestClient(batch_stub.app), max_retries=0
+    ))
+
+
+async def _submit(mode: str, client_ids):
+    job = await batch.submit(mode, client_ids=client_ids)
+    await asyncio.gather(*batch._build_tasks)
+    return job
+
+
+def test_generate_job_is_submitted_polled_and_applied_once(client, openai_stub):
+    client.portal.call(storage.insert_one, 'clients', dict(CLIENT))
+    job = client.portal.call(_submit, 'generate', ['acme'])
+
+    submitted = client.portal.call(batch.get_job, job['id'])
+    assert submitted['status'] == 'submitted' and submitted['request_count'] == 2
+
+    client.portal.call(batch.poll)
+    done = client.portal.call(batch.get_job, job['id'])
+    assert done['status'] == 'completed'
+    assert done['counts'] == {'succeeded': 2, 'failed': 0, 'skipped': 0, 'written': 2}
+    generated = [item for item in storage.memory['content'].values() if item.get('batch_id') == job['id']]
+    assert sorted(item['platform'] for item in generated) == ['LinkedIn', 'Twitter']
+    assert all(item['content'].startswith('Stub content') and item['status'] == 'pending' for item in generated)
+
+    # Applying the same results again (e.g. after a restart mid-apply) writes nothing new
+    for part in done['parts']:
+        part['applied'] = False
+    client.portal.call(storage.update_one, 'batches', {'id': job['id']}, {'status': 'submitted', 'parts': done['parts']})
+    client.portal.call(batch.poll)
+    assert len([item for item in storage.memory['content'].values() if item.get('batch_id') == job['id']]) == 2
+
+
+def test_batches_created_before_a_failure_stay_submitted(client, openai_stub, settings, monkeypatch):
+    settings(batch_max_requests=1)
+    client.portal.call(storage.insert_one, 'clients', dict(CLIENT))
+    upload_and_create = batch._upload_and_create
+
+    def fail_second_part(part, job_id):
+        if part['index'] == 1:
+            raise RuntimeError('upload failed')
+        return upload_and_create(part, job_id)
+
+    monkeypatch.setattr(batch, '_upload_and_create', fail_second_part)
+    job = client.portal.call(_submit, 'generate', ['acme'])
+
+    stored = client.portal.call(batch.get_job, job['id'])
+    assert stored['status'] == 'submitted'
+    assert [part['index'] for part in stored['parts']] == [0] and stored['parts'][0]['batch_id']
+    assert 'Only 1 of 2 batches' in stored['error']
+
+
+def test_recovery_leaves_jobs_a_live_worker_holds_alone(client):
+    part = {'index': 0, 'batch_id': 'b0', 'status': 'in_progress', 'applied': False}
+    client.portal.call(storage.insert_many, 'batches', [
+        {'id': 'dead-build', 'status': 'building', 'parts': []},
+        {'id': 'dead-partial', 'status': 'building', 'parts': [part]},
+        {'id': 'dead-apply', 'status': 'applying', 'parts': [part]},
+        {'id': 'live-build', 'status': 'building', 'parts': []},
+        {'id': 'live-apply', 'status': 'applying', 'parts': [part]},
+    ])
+    # Another worker is still building and applying these
+    for job_id in ('live-build', 'live-apply'):
+        assert client.portal.call(storage.acquire_lease, batch._lease_name(job_id), 60)
+
+    client.portal.call(batch._resume_interrupted)
+
+    statuses = {job_id: job['status'] for job_id, job in storage.memory['batches'].items()}
+    assert statuses == {
+        'dead-build': 'failed', 'dead-partial': 'submitted', 'dead-apply': 'submitted',
+        'live-build': 'building', 'live-apply': 'applying',
+    }
+    assert 'Interrupted after 1 batches' in storage.memory['batches']['dead-partial']['error']
+
+
+def test_regenerate_results_applied_again_are_not_counted_twice():
+    job = {'id': 'j1', 'submitted_at': '2024-01-01T00:00:00'}
+    body = {'choices': [{'message': {'content': 'Fresh take'}}], 'usage': {}}
+    item = {'id': 'c1', 'status': 'pending', 'platform': 'Twitter', 'content_type': 'tweet', 'regeneration_count': 1}
+
+    updates, skipped = batch._regenerated_updates(job, [('regenerate:c1', body)], {'c1': item})
+    assert updates['c1']['regeneration_count'] == 2 and skipped == 0
+
+    # The part is applied again after its worker died mid-apply
+    updates, skipped = batch._regenerated_updates(job, [('regenerate:c1', body)], {'c1': {**item, **updates['c1']}})
+    assert updates == {} and skipped == 1
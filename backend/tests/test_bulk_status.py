@@ -0,0 +1,49 @@
+import storage
+
+
+def _seed(client):
+    client.portal.call(storage.insert_many, 'content', [
+        {'id': 'new', 'platform': 'Twitter', 'content': 'Hello', 'status': 'pending'},
+        {'id': 'scheduled', 'platform': 'Twitter', 'content': 'Hello', 'status': 'approved',
+         'publish_status': 'scheduled', 'scheduled_at': '2030-01-01T00:00:00'},
+        {'id': 'publishing', 'platform': 'Twitter', 'content': 'Hello', 'status': 'approved', 'publish_status': 'publishing'},
+        {'id': 'published', 'platform': 'Twitter', 'content': 'Hello', 'status': 'approved', 'publish_status': 'published'},
+    ])
+
+
+def test_bulk_approve_skips_content_already_on_its_way_out(client):
+    _seed(client)
+    response = client.post('/api/content/bulk/status', json={
+        'status': 'approved', 'ids': ['new', 'scheduled', 'publishing', 'published']
+    })
+
+    results = {result['id']: result for result in response.json()['results']}
+    assert results['new']['result'] == 'updated' and results['new']['scheduled_at']
+    assert {key: results[key]['result'] for key in ('scheduled', 'publishing', 'published')} == {
+        'scheduled': 'skipped', 'publishing': 'skipped', 'published': 'skipped'
+    }
+    # The existing schedule is left alone
+    assert storage.memory['content']['scheduled']['scheduled_at'] == '2030-01-01T00:00:00'
+    assert storage.memory['content']['published']['publish_status'] == 'published'
+
+
+def test_bulk_pending_refuses_content_being_published(client):
+    _seed(client)
+    response = client.post('/api/content/bulk/status', json={'status': 'pending', 'ids': ['scheduled', 'publishing']})
+
+    results = {result['id']: result['result'] for result in response.json()['results']}
+    assert results == {'scheduled': 'updated', 'publishing': 'refused'}
+    assert storage.memory['content']['scheduled']['publish_status'] == 'cancelled'
+    assert storage.memory['content']['publishing']['status'] == 'approved'
+
+
+def test_bulk_update_skips_documents_that_no_longer_match_their_conditions(client):
+    _seed(client)
+    written = client.portal.call(
+        storage.bulk_update, 'content',
+        {'scheduled': {'status': 'pending'}, 'publishing': {'status': 'pending'}},
+        None,
+        {'scheduled': {'publish_status': 'scheduled'}, 'publishing': {'publish_status': 'scheduled'}}
+    )
+    assert written == ['scheduled']
+    assert storage.memory['content']['publishing']['status'] == 'approved'
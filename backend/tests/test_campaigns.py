@@ -0,0 +1,72 @@
+import campaigns
+import database
+import storage
+
+
+def _campaign(campaign_id, budget):
+    return {'id': campaign_id, 'client_id': 'acme', 'client_name': 'Acme', 'status': 'active', 'budget': budget}
+
+
+def _budget(client):
+    # Reads serve the stored summary; the background flush is run here so it has landed
+    client.portal.call(campaigns.flush_summaries)
+    return client.portal.call(campaigns.get_summary, 'acme')['budget']
+
+
+def test_rebuild_keeps_an_increment_made_after_the_summary_was_read(client, monkeypatch):
+    client.portal.call(storage.insert_one, 'campaigns', _campaign('a', 100))
+    assert _budget(client) == 100
+
+    aggregate = campaigns._aggregate
+    calls = []
+
+    async def aggregate_while_another_worker_writes(client_id=None):
+        summaries = await aggregate(client_id)
+        if not calls:
+            # Another worker adds a campaign and its $inc after this worker read the summaries
+            storage._memory_insert('campaigns', _campaign('b', 50))
+            await storage.find_one_and_update(
+                'campaign_summaries', {'client_id': 'acme'}, {}, inc={'budget': 50, 'campaigns': 1, 'version': 1}
+            )
+        calls.append(client_id)
+        return summaries
+
+    monkeypatch.setattr(campaigns, '_aggregate', aggregate_while_another_worker_writes)
+    monkeypatch.setattr(campaigns, '_rebuild_all', True)
+    assert _budget(client) == 150
+    # The conflicting rebuild write was retried as a recomputation of the client
+    assert calls == [None, 'acme']
+
+
+def test_pending_deltas_are_recomputed_while_another_worker_rebuilds(client, monkeypatch):
+    client.portal.call(campaigns.flush_summaries)
+    client.portal.call(storage.acquire_lease, campaigns.REBUILD_LEASE, 60)
+    skipped = campaigns.campaign_stats['summary_rebuilds_skipped']
+    monkeypatch.setattr(campaigns, '_rebuild_all', True)
+
+    # The other worker's rebuild already counted the campaign this worker writes
+    client.portal.call(storage.insert_one, 'campaign_summaries', {
+        'client_id': 'acme', 'campaigns': 1, 'active': 1, 'budget': 100, 'impressions': 0, 'clicks': 0, 'version': 1
+    })
+    client.portal.call(storage.insert_one, 'campaigns', _campaign('a', 100))
+
+    # Adding the pending delta would count it twice
+    assert _budget(client) == 100
+    assert campaigns.campaign_stats['summary_rebuilds_skipped'] == skipped + 1
+
+
+def test_reads_do_not_rebuild(client, monkeypatch):
+    client.portal.call(campaigns.flush_summaries)
+    rebuilds = campaigns.campaign_stats['summary_rebuilds']
+    monkeypatch.setattr(campaigns, '_rebuild_all', True)
+
+    assert client.get('/api/campaigns/summaries').json()['summaries'] == []
+
+    assert campaigns.campaign_stats['summary_rebuilds'] == rebuilds
+    assert campaigns._rebuild_all
+
+
+def test_every_sort_field_has_an_index(client):
+    leading = {keys[0][0] for name, keys, _ in database.INDEXES if name == 'campaigns'}
+    assert set(campaigns.SORT_FIELDS) <= leading
+    assert client.get('/api/campaigns', params={'sort': 'end_date'}).status_code == 400
@@ -0,0 +1,17 @@
+import storage
+
+
+def test_list_etag_follows_the_shared_collection_version(client):
+    first = client.get('/api/clients')
+    etag = first.headers['etag']
+    assert client.get('/api/clients', headers={'If-None-Match': etag}).status_code == 304
+
+    client.portal.call(storage.insert_one, 'clients', {'client_id': 'c1', 'company_name': 'Acme'})
+    changed = client.get('/api/clients', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.json()['count'] == 1
+
+    # Another worker's write is seen through the version document, not an event in this process
+    client.portal.call(
+        storage.find_one_and_update, 'collection_versions', {'name': 'clients'}, {'changed_at': 1.0}, {'version': 1}
+    )
+    assert client.get('/api/clients', headers={'If-None-Match': changed.headers['etag']}).status_code == 200
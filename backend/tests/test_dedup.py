@@ -0,0 +1,90 @@
+import dedup
+import executors
+import storage
+
+TEXT = "Launch week starts Monday with five new features for small teams"
+
+
+def test_changes_during_a_build_are_applied_to_the_new_index(monkeypatch):
+    monkeypatch.setattr(dedup, '_index', None)
+    storage._memory_insert('content', {'id': 'a', 'content': TEXT})
+
+    original_add = dedup.MinHashLSHIndex.add
+
+    def add_while_content_changes(self, key, text):
+        # An update arrives on the event loop while the build is running
+        monkeypatch.setattr(dedup.MinHashLSHIndex, 'add', original_add)
+        storage._memory_insert('content', {'id': 'b', 'content': TEXT + " today"})
+        dedup._on_content_changed({"op": "insert", "key": "b", "document": storage.memory['content']['b']})
+        dedup._on_content_changed({"op": "delete", "key": "a", "document": None})
+        original_add(self, key, text)
+
+    monkeypatch.setattr(dedup.MinHashLSHIndex, 'add', add_while_content_changes)
+    index = dedup._get_index()
+
+    assert dedup._index is index
+    assert set(index.signatures) == {'b'}
+    assert dedup._builds == []
+
+
+def test_reload_during_a_build_discards_the_stale_index(monkeypatch):
+    monkeypatch.setattr(dedup, '_index', None)
+    storage._memory_insert('content', {'id': 'a', 'content': TEXT})
+    original_add = dedup.MinHashLSHIndex.add
+
+    def add_then_reload(self, key, text):
+        monkeypatch.setattr(dedup.MinHashLSHIndex, 'add', original_add)
+        dedup._on_storage_reloaded({})
+        original_add(self, key, text)
+
+    monkeypatch.setattr(dedup.MinHashLSHIndex, 'add', add_then_reload)
+    assert dedup.find_near_duplicates(TEXT) == [{"id": "a", "similarity": 1.0}]
+    assert dedup._index is None
+
+
+class _Cursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield dict(document)
+
+
+class _ContentCollection:
+    """Stands in for the MongoDB content collection, which holds more than the memory mirror"""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection):
+        return _Cursor(self.documents)
+
+
+def test_build_scans_the_whole_collection_not_the_memory_mirror(client, monkeypatch):
+    documents = [{'id': f'old-{i}', 'content': f"{TEXT} number {i}"} for i in range(5)]
+    monkeypatch.setattr(storage, 'collection', lambda name, read_only=False: _ContentCollection(documents))
+    monkeypatch.setattr(dedup, 'BUILD_BATCH_SIZE', 2)
+    monkeypatch.setattr(dedup, '_index', None)
+    # Only the newest document is mirrored in memory
+    storage._memory_insert('content', documents[-1])
+
+    index = client.portal.call(dedup._build)
+
+    assert dedup._index is index and len(index) == 5
+
+
+def test_lookup_from_a_worker_thread_waits_for_the_build(client, monkeypatch):
+    monkeypatch.setattr(dedup, '_index', None)
+    storage._memory_insert('content', {'id': 'a', 'content': TEXT})
+
+    matches = client.portal.call(executors.run_background, dedup.find_near_duplicates, TEXT)
+
+    assert matches == [{"id": "a", "similarity": 1.0}]
+    assert dedup._index is not None and dedup._build_task is None
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+import config
+import idempotency
+import storage
+
+
+def _app():
+    app = FastAPI()
+    calls = []
+
+    @app.post("/things")
+    def create_thing(response: Response):
+        calls.append(1)
+        response.headers["Location"] = f"/things/{len(calls)}"
+        response.headers["ETag"] = f'"{len(calls)}"'
+        response.status_code = 201
+        return {"success": True, "number": len(calls)}
+
+    app.add_middleware(idempotency.IdempotencyMiddleware)
+    return app, calls
+
+
+def test_replay_returns_the_stored_status_and_headers():
+    app, calls = _app()
+    with TestClient(app) as client:
+        first = client.post("/things", json={"name": "a"}, headers={"Idempotency-Key": "k1"})
+        second = client.post("/things", json={"name": "a"}, headers={"Idempotency-Key": "k1"})
+
+    assert len(calls) == 1
+    assert second.status_code == 201
+    assert second.json() == first.json() == {"success": True, "number": 1}
+    assert second.headers["location"] == "/things/1" and second.headers["etag"] == '"1"'
+    assert second.headers["idempotent-replayed"] == "true"
+    assert first.headers["idempotent-replayed"] == "false"
+
+
+def test_expiry_is_compared_in_utc():
+    utc_now = datetime.now(timezone.utc)
+    assert not idempotency._expired({"expires_at": utc_now + timedelta(seconds=60)})
+    assert idempotency._expired({"expires_at": utc_now - timedelta(seconds=1)})
+    # pymongo reads naive UTC datetimes
+    assert idempotency._expired({"expires_at": utc_now.replace(tzinfo=None) - timedelta(seconds=1)})
+    app, _ = _app()
+    with TestClient(app) as client:
+        client.post("/things", json={}, headers={"Idempotency-Key": "k2"})
+    record = next(iter(storage.memory['idempotency'].values()))
+    ttl = config.get_settings().idempotency_ttl_seconds
+    assert abs((record['expires_at'] - utc_now).total_seconds() - ttl) < 60
+
+    # Journaled while MongoDB is down, and replayed as a date the TTL index can expire
+    journaled = storage._journal_read(config.get_settings().storage_journal_path)
+    inserted = [entry["document"] for entry in journaled if entry["collection"] == 'idempotency' and entry["op"] == 'insert']
+    assert inserted and inserted[0]['expires_at'] == record['expires_at']
+
+
+def _abandon(key: str, lease_until: datetime) -> None:
+    # A pending record left by a worker that crashed mid-request
+    storage.memory['idempotency'][f"POST /things {key}"] = {
+        "key": f"POST /things {key}",
+        "fingerprint": idempotency.hashlib.sha256(b'/things?\n{}').hexdigest(),
+        "state": "pending",
+        "lease_until": lease_until,
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=1),
+    }
+
+
+def test_retry_takes_over_a_pending_request_whose_lease_expired(settings):
+    settings(idempotency_wait_seconds=0.5)
+    app, calls = _app()
+    with TestClient(app) as client:
+        _abandon("k3", datetime.now(timezone.utc) + timedelta(seconds=60))
+        held = client.post("/things", content=b'{}', headers={"Idempotency-Key": "k3", "Content-Type": "application/json"})
+        assert held.status_code == 409 and calls == []
+
+        _abandon("k3", datetime.now(timezone.utc) - timedelta(seconds=1))
+        taken = client.post("/things", content=b'{}', headers={"Idempotency-Key": "k3", "Content-Type": "application/json"})
+        replayed = client.post("/things", content=b'{}', headers={"Idempotency-Key": "k3", "Content-Type": "application/json"})
+
+    assert taken.status_code == 201 and len(calls) == 1
+    assert replayed.json() == taken.json() and replayed.headers["idempotent-replayed"] == "true"
+    assert idempotency.idempotency_stats["taken_over"] >= 1
@@ -0,0 +1,27 @@
+import routing
+import services
+
+
+def test_output_breaking_the_limits_escalates_once(monkeypatch):
+    calls = []
+
+    def chat_completion(model, messages, temperature, max_tokens, *args):
+        calls.append(model)
+        # Both models answer with a tweet over the 280 character limit
+        return 'x' * 400, 'stop'
+
+    monkeypatch.setattr(services, '_chat_completion', chat_completion)
+    route = routing.select_route('Twitter', 'post')
+
+    content = services._routed_completion('Twitter', 'post', [], 0.7)
+
+    assert calls == [route["model"], route["escalation_model"]]
+    assert content == 'x' * 400
+
+
+def test_valid_output_is_not_escalated(monkeypatch):
+    calls = []
+    monkeypatch.setattr(services, '_chat_completion', lambda model, *args: calls.append(model) or ('Hello', 'stop'))
+
+    assert services._routed_completion('Twitter', 'post', [], 0.7) == 'Hello'
+    assert len(calls) == 1
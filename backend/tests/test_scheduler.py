@@ -0,0 +1,63 @@
+import time
+from fastapi.testclient import TestClient
+import scheduler
+import storage
+
+
+def _content(content_id, **fields):
+    return {'id': content_id, 'platform': 'Twitter', 'client_id': 'missing', 'content': 'Hello', **fields}
+
+
+def test_claim_records_claimed_at(client):
+    scheduled_at = scheduler._iso(time.time() - 1)
+    client.portal.call(storage.insert_one, 'content', _content('c1', publish_status='scheduled', scheduled_at=scheduled_at))
+
+    client.portal.call(scheduler._publish, (time.time(), 'c1', 'Twitter', scheduled_at))
+
+    content = storage.memory['content']['c1']
+    assert content['claimed_at']
+    # The client does not exist, so the post failed and was rescheduled
+    assert content['publish_status'] == 'scheduled' and content['publish_attempts'] == 1
+
+
+def test_requeue_reschedules_items_publishing_past_the_lease(settings):
+    import main
+    settings(scheduler_enabled=False, scheduler_lease_seconds=60)
+    with TestClient(main.app) as client:
+        stale = scheduler._iso(time.time() - 120)
+        fresh = scheduler._iso(time.time() - 10)
+        client.portal.call(storage.insert_many, 'content', [
+            _content('stale', publish_status='publishing', claimed_at=stale, scheduled_at=stale),
+            _content('legacy', publish_status='publishing', scheduled_at=stale),
+            _content('fresh', publish_status='publishing', claimed_at=fresh, scheduled_at=fresh),
+        ])
+        before = scheduler.scheduler_stats['requeued_stale']
+
+        assert client.portal.call(scheduler.requeue_stale) == 2
+
+    statuses = {key: document['publish_status'] for key, document in storage.memory['content'].items()}
+    assert statuses == {'stale': 'scheduled', 'legacy': 'scheduled', 'fresh': 'publishing'}
+    assert storage.memory['content']['stale']['scheduled_at'] == stale
+    assert scheduler.scheduler_stats['requeued_stale'] == before + 2
+
+
+def test_running_dispatcher_requeues_items_a_crashed_worker_left_publishing(settings):
+    import main
+    settings(scheduler_enabled=True, scheduler_lease_seconds=1)
+    # No window or pacing left over from other tests
+    scheduler._reset({})
+    scheduler._next_allowed.clear()
+    with TestClient(main.app) as client:
+        before = scheduler.scheduler_stats['requeued_stale']
+        stale = scheduler._iso(time.time() - 60)
+        # Written after startup, as if a worker crashed mid-post while this one is running
+        client.portal.call(storage.insert_one, 'content', _content('c1', publish_status='publishing', claimed_at=stale, scheduled_at=stale))
+        for _ in range(50):
+            if storage.memory['content']['c1'].get('publish_attempts'):
+                break
+            time.sleep(0.05)
+
+    assert scheduler.scheduler_stats['requeued_stale'] == before + 1
+    # Requeued and dispatched again: the client does not exist, so the post is retried later
+    content = storage.memory['content']['c1']
+    assert content['publish_status'] == 'scheduled' and content['publish_attempts'] == 1
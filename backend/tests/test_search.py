@@ -0,0 +1,20 @@
+import storage
+
+
+def test_memory_search_is_marked_partial_when_the_mirror_was_evicted(client, settings, monkeypatch):
+    client.portal.call(storage.insert_many, 'content', [
+        {'id': 'c0', 'content': 'Quarterly numbers are in', 'status': 'pending'},
+        {'id': 'c1', 'content': 'Launch week starts Monday', 'status': 'pending'},
+    ])
+
+    complete = client.get('/api/content/search', params={'q': 'launch'}).json()
+    assert complete['count'] == 1 and complete['partial'] is False
+
+    # Before MongoDB went down, the capped mirror evicted its oldest document
+    settings(storage_warm_limit=2)
+    monkeypatch.setattr(storage, 'mongo_available', True)
+    storage._mirror_insert('content', {'id': 'c2', 'content': 'Hiring update', 'status': 'pending'})
+    monkeypatch.setattr(storage, 'mongo_available', False)
+
+    partial = client.get('/api/content/search', params={'q': 'launch'}).json()
+    assert partial['count'] == 1 and partial['partial'] is True
@@ -0,0 +1,35 @@
+import storage
+
+
+def test_journal_pending_counts_offline_writes_without_reading_the_journal(client, monkeypatch):
+    assert not storage.is_mongo_available()
+    client.portal.call(storage.insert_many, 'batches', [{'id': 'a'}, {'id': 'b'}])
+    client.portal.call(storage.update_one, 'batches', {'id': 'a'}, {'status': 'completed'})
+
+    monkeypatch.setattr(storage, '_journal_read', lambda path: [])
+    assert storage.journal_pending() == 3
+
+
+def test_mirror_is_bounded_and_skips_append_only_collections(settings, monkeypatch):
+    settings(storage_warm_limit=2)
+    monkeypatch.setattr(storage, 'mongo_available', True)
+    for key in ('a', 'b', 'c'):
+        storage._mirror_insert('content', {'id': key})
+    storage._mirror_update('content', {'id': 'b'}, {'status': 'approved'})
+    storage._mirror_insert('content', {'id': 'd'})
+    storage._mirror_insert('usage', {'id': 'u1'})
+    storage._mirror_insert('idempotency', {'key': 'k1'})
+
+    # Least recently written first: 'c' was written before the update of 'b'
+    assert list(storage.memory['content']) == ['b', 'd']
+    assert storage.memory['usage'] == {} and storage.memory['idempotency'] == {}
+    # Reads served from memory would miss the evicted documents
+    assert not storage.mirror_complete('content') and storage.mirror_complete('campaigns')
+
+
+def test_memory_mode_keeps_every_document(settings):
+    settings(storage_warm_limit=2)
+    for key in ('a', 'b', 'c'):
+        storage._memory_insert('content', {'id': key})
+    assert list(storage.memory['content']) == ['a', 'b', 'c']
+    assert storage.mirror_complete('content')
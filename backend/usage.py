@@ -0,0 +1,320 @@
+"""
+Usage ledger for OpenAI calls
+
+Every model call records its tokens (or image count), model, latency and an
+estimated cost, tagged with the client, platform and the API endpoint that
+triggered it. Entries are buffered in process and flushed to the 'usage'
+collection in batches by a background task, so recording costs a list append.
+
+The endpoint (and client, when the service call does not know it) comes from a
+context variable set by the API handler with usage.context(...).
+
+Per-client monthly budgets (client 'monthly_budget_usd', or USAGE_CLIENT_BUDGET_USD
+for every client) are checked before generation against the ledger total, which
+every worker shares; each process re-reads it after USAGE_SPEND_TTL seconds and
+adds its own calls in between.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import get_settings
+import database
+import metrics
+import storage
+
+# USD per 1K prompt / completion tokens
+MODEL_PRICES = {
+    'gpt-4': (0.03, 0.06),
+    'gpt-4-turbo': (0.01, 0.03),
+    'gpt-4o': (0.0025, 0.01),
+    'gpt-4o-mini': (0.00015, 0.0006),
+    'gpt-3.5-turbo': (0.0005, 0.0015),
+}
+
+# USD per generated image
+IMAGE_PRICES = {
+    'dall-e-3': 0.04,
+    'dall-e-2': 0.02,
+}
+
+# Batch API calls are billed at half the synchronous price
+BATCH_PRICE_FACTOR = 0.5
+
+GROUP_FIELDS = ('client_id', 'platform', 'endpoint', 'day', 'model', 'route')
+
+database.INDEXES.append(('usage', [('client_id', 1), ('day', 1)], {}))
+database.INDEXES.append(('usage', [('day', 1)], {}))
+
+_context: ContextVar[Dict] = ContextVar('usage_context', default={})
+
+_buffer: List[Dict] = []
+_buffer_lock = threading.Lock()
+_flush_task: Optional[asyncio.Task] = None
+
+# (client_id, month) -> [spend in USD, monotonic time read from the ledger], for budget checks
+_spend: Dict[Tuple[str, str], List[float]] = {}
+
+usage_stats = {
+    "recorded": 0,
+    "flushed": 0,
+    "flushes": 0,
+    "flush_seconds_total": 0.0,
+    "flush_errors": 0,
+    "throttled": 0,
+}
+
+
+@contextmanager
+def context(endpoint: str, client_id: Optional[str] = None) -> Iterator[None]:
+    """Tag the model calls made inside the block with endpoint (and client_id)"""
+    token = _context.set({"endpoint": endpoint, "client_id": client_id})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def _price(prices: Dict, model: str, default):
+    """Price of model, matching dated snapshots (gpt-4-0613) to their base model"""
+    if model in prices:
+        return prices[model]
+    bases = [base for base in prices if model.startswith(f"{base}-")]
+    return prices[max(bases, key=len)] if bases else default
+
+
+def estimate_cost(model: str, prompt_tokens: int = 0, completion_tokens: int = 0, images: int = 0) -> float:
+    prompt_price, completion_price = _price(MODEL_PRICES, model, (0.0, 0.0))
+    cost = prompt_tokens / 1000 * prompt_price + completion_tokens / 1000 * completion_price
+    cost += images * _price(IMAGE_PRICES, model, 0.0)
+    return round(cost, 6)
+
+
+def record(
+    model: str,
+    latency: float,
+    platform: Optional[str] = None,
+    client_id: Optional[str] = None,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+    images: int = 0,
+    route: Optional[str] = None,
+    batch: bool = False
+) -> Dict:
+    """Add a model call to the ledger buffer (safe to call from worker threads)"""
+    call_context = _context.get()
+    client_id = client_id or call_context.get("client_id")
+    now = datetime.now()
+    cost = estimate_cost(model, prompt_tokens, completion_tokens, images)
+    entry = {
+        "id": str(uuid.uuid4()),
+        "timestamp": now.isoformat(),
+        "day": now.strftime('%Y-%m-%d'),
+        "client_id": client_id,
+        "platform": platform,
+        "endpoint": call_context.get("endpoint", "unknown"),
+        "model": model,
+        "route": route,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "images": images,
+        "latency_ms": round(latency * 1000, 1),
+        "cost_usd": round(cost * BATCH_PRICE_FACTOR, 6) if batch else cost,
+        "batch": batch,
+    }
+    with _buffer_lock:
+        _buffer.append(entry)
+        usage_stats["recorded"] += 1
+        key = (client_id, entry["day"][:7])
+        if key in _spend:
+            _spend[key][0] += entry["cost_usd"]
+    return entry
+
+
+def record_completion(
+    model: str,
+    response,
+    latency: float,
+    platform: Optional[str] = None,
+    client_id: Optional[str] = None,
+    route: Optional[str] = None
+) -> Dict:
+    """Record a chat completion response"""
+    usage = getattr(response, 'usage', None)
+    return record(
+        model=getattr(response, 'model', None) or model,
+        latency=latency,
+        platform=platform,
+        client_id=client_id,
+        prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+        completion_tokens=getattr(usage, 'completion_tokens', 0) or 0,
+        route=route,
+    )
+
+
+async def flush() -> int:
+    """Write buffered entries to the ledger in batches; returns the number written"""
+    with _buffer_lock:
+        entries = _buffer[:]
+        _buffer.clear()
+    if not entries:
+        return 0
+
+    batch_size = get_settings().usage_flush_batch_size
+    started = time.perf_counter()
+    written = 0
+    try:
+        for start in range(0, len(entries), batch_size):
+            await storage.insert_many('usage', entries[start:start + batch_size])
+            written = start + batch_size
+    except Exception as e:
+        usage_stats["flush_errors"] += 1
+        print(f"Warning: Could not flush usage ledger: {str(e)}")
+        with _buffer_lock:
+            _buffer[:0] = entries[written:]
+    written = min(written, len(entries))
+    usage_stats["flushed"] += written
+    usage_stats["flushes"] += 1
+    usage_stats["flush_seconds_total"] += time.perf_counter() - started
+    return written
+
+
+async def _flush_periodically() -> None:
+    settings = get_settings()
+    while True:
+        await asyncio.sleep(settings.usage_flush_interval)
+        await flush()
+
+
+async def start() -> None:
+    global _flush_task
+    _flush_task = asyncio.create_task(_flush_periodically())
+
+
+async def stop() -> None:
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        _flush_task = None
+    await flush()
+
+
+def _aggregate_memory(query: Dict, group_by: List[str]) -> List[Dict]:
+    groups: Dict[Tuple, Dict] = {}
+    for entry in storage.memory['usage'].values():
+        if not storage.matches(entry, query):
+            continue
+        key = tuple(entry.get(field) for field in group_by)
+        group = groups.setdefault(key, {
+            **dict(zip(group_by, key)),
+            "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+            "images": 0, "cost_usd": 0.0, "latency_ms_total": 0.0,
+        })
+        group["calls"] += 1
+        for field in ("prompt_tokens", "completion_tokens", "total_tokens", "images", "cost_usd"):
+            group[field] += entry.get(field) or 0
+        group["latency_ms_total"] += entry.get("latency_ms") or 0
+    results = []
+    for group in groups.values():
+        latency_total = group.pop("latency_ms_total")
+        group["avg_latency_ms"] = round(latency_total / group["calls"], 1)
+        group["cost_usd"] = round(group["cost_usd"], 6)
+        results.append(group)
+    return results
+
+
+async def _aggregate_mongo(handle, query: Dict, group_by: List[str]) -> List[Dict]:
+    pipeline = [
+        {"$match": query},
+        {"$group": {
+            "_id": {field: f"${field}" for field in group_by},
+            "calls": {"$sum": 1},
+            "prompt_tokens": {"$sum": "$prompt_tokens"},
+            "completion_tokens": {"$sum": "$completion_tokens"},
+            "total_tokens": {"$sum": "$total_tokens"},
+            "images": {"$sum": "$images"},
+            "cost_usd": {"$sum": "$cost_usd"},
+            "avg_latency_ms": {"$avg": "$latency_ms"},
+        }},
+    ]
+    results = []
+    async for group in handle.aggregate(pipeline):
+        keys = group.pop("_id") or {}
+        group["cost_usd"] = round(group["cost_usd"], 6)
+        group["avg_latency_ms"] = round(group["avg_latency_ms"] or 0, 1)
+        results.append({**{field: keys.get(field) for field in group_by}, **group})
+    return results
+
+
+async def aggregate(
+    group_by: List[str],
+    client_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+) -> List[Dict]:
+    """Sum calls, tokens, images and cost per group, most expensive first"""
+    await flush()
+    query: Dict = {}
+    if client_id:
+        query["client_id"] = client_id
+    day: Dict = {}
+    if date_from:
+        day["$gte"] = date_from[:10]
+    if date_to:
+        day["$lte"] = date_to[:10]
+    if day:
+        query["day"] = day
+
+    results = None
+    handle = storage.collection('usage', read_only=True)
+    if handle is not None:
+        try:
+            results = await _aggregate_mongo(handle, query, group_by)
+        except Exception as e:
+            storage.fail_over(e)
+    if results is None:
+        results = _aggregate_memory(query, group_by)
+    results.sort(key=lambda group: group["cost_usd"], reverse=True)
+    return results
+
+
+async def month_spend(client_id: str) -> float:
+    """This month's spend for a client in USD"""
+    month = datetime.now().strftime('%Y-%m')
+    key = (client_id, month)
+    cached = _spend.get(key)
+    if cached is None or time.monotonic() - cached[1] >= get_settings().usage_spend_ttl:
+        # aggregate() flushes first, so the total includes this process's calls
+        read_at = time.monotonic()
+        groups = await aggregate(['client_id'], client_id=client_id, date_from=f"{month}-01", date_to=f"{month}-31")
+        with _buffer_lock:
+            _spend[key] = [groups[0]["cost_usd"] if groups else 0.0, read_at]
+    return _spend[key][0]
+
+
+async def check_budget(client: Dict) -> Optional[Dict]:
+    """Return the budget status if the client is over its monthly budget, otherwise None"""
+    budget = client.get('monthly_budget_usd') or get_settings().usage_client_budget_usd
+    if not budget:
+        return None
+    spent = await month_spend(client['client_id'])
+    if spent < float(budget):
+        return None
+    usage_stats["throttled"] += 1
+    return {"spent_usd": round(spent, 4), "budget_usd": float(budget)}
+
+
+def get_usage_metrics() -> Dict:
+    flushes = usage_stats["flushes"]
+    return {
+        **usage_stats,
+        "buffered": len(_buffer),
+        "avg_flush_ms": round(usage_stats["flush_seconds_total"] / flushes * 1000, 3) if flushes else None,
+    }
+
+metrics.register("usage", get_usage_metrics)
@@ -0,0 +1,142 @@
+"""
+Local validation of generated content against platform limits
+
+Checks length, hashtag count and link count per platform without a model call,
+and can bring content back within limits deterministically: extra hashtags and
+links are dropped from the end, then the text is cut at the last sentence (or
+word) boundary that fits.
+"""
+import re
+from typing import Dict, List, Optional
+import metrics
+
+# Hard limits per platform. max_chars / max_words of None means no length limit,
+# max_hashtags / max_links of None means no count limit.
+PLATFORM_LIMITS = {
+    'LinkedIn': {'max_chars': 1300, 'max_words': None, 'max_hashtags': 5, 'max_links': 2},
+    'Twitter': {'max_chars': 280, 'max_words': None, 'max_hashtags': 3, 'max_links': 1},
+    'Instagram': {'max_chars': 2200, 'max_words': None, 'max_hashtags': 30, 'max_links': 0},
+    'Facebook': {'max_chars': 5000, 'max_words': None, 'max_hashtags': 5, 'max_links': 3},
+    'Reddit': {'max_chars': 40000, 'max_words': None, 'max_hashtags': 0, 'max_links': 5},
+    'Email': {'max_chars': 2000, 'max_words': None, 'max_hashtags': None, 'max_links': 5},
+    'Website': {'max_chars': None, 'max_words': 2000, 'max_hashtags': None, 'max_links': None},
+    'YouTube': {'max_chars': None, 'max_words': 5000, 'max_hashtags': 15, 'max_links': None},
+}
+
+_HASHTAG_RE = re.compile(r"(?<![\w#])#\w+")
+_LINK_RE = re.compile(r"https?://\S+|www\.\S+")
+_WORD_RE = re.compile(r"\S+")
+_SENTENCE_END_RE = re.compile(r"[.!?](?=\s)|\n")
+_TRAILING_TAGS_RE = re.compile(r"(?:\s+(?:#\w+|https?://\S+|www\.\S+))+\s*$")
+
+ELLIPSIS = '…'
+
+validation_stats = {
+    "checked": 0,
+    "passed": 0,
+    "violations": {},
+    "truncated": 0,
+    "shorten_retries": 0,
+    "shorten_retry_successes": 0,
+}
+
+
+def get_limits(platform: str) -> Dict:
+    return PLATFORM_LIMITS.get(platform, {})
+
+
+def describe_max_length(platform: str) -> str:
+    """Human readable length limit, as used in prompts"""
+    limits = get_limits(platform)
+    if limits.get('max_chars'):
+        return f"{limits['max_chars']} characters"
+    if limits.get('max_words'):
+        return f"{limits['max_words']} words"
+    return 'appropriate length'
+
+
+def validate(platform: str, content: Optional[str]) -> List[Dict]:
+    """Return the platform limits content breaks (an empty list means it is valid)"""
+    content = content or ''
+    limits = get_limits(platform)
+    measured = {
+        'max_chars': len(content),
+        'max_words': len(_WORD_RE.findall(content)),
+        'max_hashtags': len(_HASHTAG_RE.findall(content)),
+        'max_links': len(_LINK_RE.findall(content)),
+    }
+    violations = [
+        {"rule": rule, "limit": limits[rule], "actual": actual}
+        for rule, actual in measured.items()
+        if limits.get(rule) is not None and actual > limits[rule]
+    ]
+
+    validation_stats["checked"] += 1
+    if not violations:
+        validation_stats["passed"] += 1
+    for violation in violations:
+        key = f"{platform}.{violation['rule']}"
+        validation_stats["violations"][key] = validation_stats["violations"].get(key, 0) + 1
+    return violations
+
+
+def _drop_matches_after(content: str, pattern: "re.Pattern", keep: int) -> str:
+    matches = list(pattern.finditer(content))[keep:]
+    for match in reversed(matches):
+        content = content[:match.start()] + content[match.end():]
+    return content
+
+
+def _tidy(content: str) -> str:
+    content = re.sub(r"[ \t]{2,}", " ", content)
+    content = re.sub(r"[ \t]+\n", "\n", content)
+    return content.strip()
+
+
+def _cut(content: str, limit: int) -> str:
+    """Cut content to at most limit characters at a sentence or word boundary"""
+    if len(content) <= limit:
+        return content
+    window = content[:limit]
+    sentence_ends = [match.end() for match in _SENTENCE_END_RE.finditer(window)]
+    # A sentence boundary is used only when it keeps most of the text
+    if sentence_ends and sentence_ends[-1] >= limit * 0.6:
+        return window[:sentence_ends[-1]].rstrip()
+    window = content[:limit - len(ELLIPSIS)]
+    space = window.rfind(' ')
+    if space >= limit * 0.5:
+        window = window[:space]
+    return window.rstrip(' ,;:-') + ELLIPSIS
+
+
+def truncate(platform: str, content: str) -> str:
+    """Deterministically bring content within the platform limits"""
+    limits = get_limits(platform)
+    if limits.get('max_hashtags') is not None:
+        content = _drop_matches_after(content, _HASHTAG_RE, limits['max_hashtags'])
+    if limits.get('max_links') is not None:
+        content = _drop_matches_after(content, _LINK_RE, limits['max_links'])
+    content = _tidy(content)
+    if limits.get('max_words') is not None:
+        words = list(_WORD_RE.finditer(content))
+        if len(words) > limits['max_words']:
+            content = _cut(content, words[limits['max_words'] - 1].end())
+    if limits.get('max_chars') is not None and len(content) > limits['max_chars']:
+        # Keep a closing block of hashtags/links and shorten the body in front of it
+        tail = _TRAILING_TAGS_RE.search(content)
+        if tail and len(tail.group()) <= limits['max_chars'] // 2:
+            content = _cut(content[:tail.start()], limits['max_chars'] - len(tail.group())) + tail.group()
+        else:
+            content = _cut(content, limits['max_chars'])
+    validation_stats["truncated"] += 1
+    return content
+
+
+def get_validation_metrics() -> Dict:
+    checked = validation_stats["checked"]
+    return {
+        **validation_stats,
+        "pass_ratio": round(validation_stats["passed"] / checked, 4) if checked else None,
+    }
+
+metrics.register("validation", get_validation_metrics)
@@ -8,6 +8,11 @@ const CampaignAutomation = () => {
   const [campaigns, setCampaigns] = useState([]);
   const [loading, setLoading] = useState(true);
   const [showCreateModal, setShowCreateModal] = useState(false);
+  const [filters, setFilters] = useState({
+    status: 'all',
+    platform: 'all',
+    sort: 'created_at'
+  });
   const toast = useToastContext();
   const [formData, setFormData] = useState({
     name: '',
@@ -22,12 +27,14 @@ const CampaignAutomation = () => {
 
   useEffect(() => {
     loadCampaigns();
-  }, []);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [filters]);
 
   const loadCampaigns = async () => {
     try {
       setLoading(true);
-      const data = await getCampaigns();
+      // Filtered and sorted by the server
+      const data = await getCampaigns(filters);
       setCampaigns(data.campaigns || []);
     } catch (error) {
       console.error('Error loading campaigns:', error);
@@ -108,6 +115,44 @@ const CampaignAutomation = () => {
           </button>
         </div>
 
+        <div className="filters campaign-filters">
+          <select
+            value={filters.status}
+            onChange={(e) => setFilters({...filters, status: e.target.value})}
+            className="filter-select"
+          >
+            <option value="all">All Statuses</option>
+            <option value="active">Active</option>
+            <option value="paused">Paused</option>
+            <option value="completed">Completed</option>
+            <option value="draft">Draft</option>
+          </select>
+          <select
+            value={filters.platform}
+            onChange={(e) => setFilters({...filters, platform: e.target.value})}
+            className="filter-select"
+          >
+            <option value="all">All Platforms</option>
+            <option value="LinkedIn">LinkedIn</option>
+            <option value="Facebook">Facebook</option>
+            <option value="Twitter">Twitter</option>
+            <option value="Instagram">Instagram</option>
+            <option value="Reddit">Reddit</option>
+            <option value="Google Ads">Google Ads</option>
+          </select>
+          <select
+            value={filters.sort}
+            onChange={(e) => setFilters({...filters, sort: e.target.value})}
+            className="filter-select"
+          >
+            <option value="created_at">Newest</option>
+            <option value="start_date">Start Date</option>
+            <option value="budget">Budget</option>
+            <option value="impressions">Impressions</option>
+            <option value="clicks">Clicks</option>
+          </select>
+        </div>
+
         {campaigns.length === 0 ? (
           <div className="empty-state">
             <div className="empty-icon">🎯</div>
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './ClientOnboarding.css';
 import { onboardClient, healthCheck } from '../services/api';
 import BackButton from '../components/BackButton';
@@ -35,6 +35,12 @@ const ClientOnboarding = () => {
   const [workflowStep, setWorkflowStep] = useState(null);
   const [completedSteps, setCompletedSteps] = useState([]);
   const toast = useToastContext();
+  // Same submission -> same key, so a retry after a timeout does not onboard the client twice
+  const idempotencyKey = useRef(crypto.randomUUID());
+
+  useEffect(() => {
+    idempotencyKey.current = crypto.randomUUID();
+  }, [formData, images, videos]);
 
   useEffect(() => {
     // Health check on component mount
@@ -109,7 +115,7 @@ const ClientOnboarding = () => {
       }, 1500);
 
       // Step 2: Call API to onboard client and generate content
-      const result = await onboardClient(formData, images, videos);
+      const result = await onboardClient(formData, images, videos, idempotencyKey.current);
       setSuccessData(result.data);
       
       // Step 3: Complete generating step
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import './ContentApproval.css';
-import { getPendingContent, approveContent, editContent, deleteContent, regenerateContent, getClients } from '../services/api';
+import { getPendingContent, subscribeToContentStream, approveContent, editContent, deleteContent, regenerateContent, getClients } from '../services/api';
 import BackButton from '../components/BackButton';
 import WorkflowProgress from '../components/WorkflowProgress';
 import { useToastContext } from '../context/ToastContext';
@@ -23,6 +23,34 @@ const ContentApproval = () => {
     loadClients();
   }, [selectedClient]);
 
+  // Apply live changes instead of re-fetching the whole pending list
+  useEffect(() => {
+    const sameItem = (a, b) => (a.id && a.id === b.id) || (a._id && a._id === b._id);
+    const removeItem = (data) => {
+      setContentItems((items) => items.filter((item) => !sameItem(item, data)));
+    };
+    const upsertItem = (data) => {
+      const doc = data.document;
+      if (!doc) return;
+      if (doc.status !== 'pending') {
+        removeItem(doc);
+        return;
+      }
+      setContentItems((items) => {
+        const exists = items.some((item) => sameItem(item, doc));
+        return exists
+          ? items.map((item) => (sameItem(item, doc) ? doc : item))
+          : [...items, doc];
+      });
+    };
+    return subscribeToContentStream(selectedClient, {
+      onInsert: upsertItem,
+      onUpdate: upsertItem,
+      onDelete: removeItem,
+      onReset: () => loadContent(),
+    });
+  }, [selectedClient]);
+
   const loadContent = async () => {
     try {
       setLoading(true);
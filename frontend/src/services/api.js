@@ -18,8 +18,9 @@ export const healthCheck = async () => {
  * @param {Object} formData - Client form data
  * @param {Array} images - Array of image files
  * @param {Array} videos - Array of video files
+ * @param {string} idempotencyKey - Reuse the same key when retrying the same submission
  */
-export const onboardClient = async (formData, images = [], videos = []) => {
+export const onboardClient = async (formData, images = [], videos = [], idempotencyKey = crypto.randomUUID()) => {
   try {
     const formDataToSend = new FormData();
 
@@ -48,6 +49,9 @@ export const onboardClient = async (formData, images = [], videos = []) => {
 
     const response = await fetch(`${API_BASE_URL}/api/client/onboard`, {
       method: 'POST',
+      headers: {
+        'Idempotency-Key': idempotencyKey
+      },
       body: formDataToSend
     });
 
@@ -113,13 +117,38 @@ export const getPendingContent = async (clientId = 'all') => {
   }
 };
 
+/**
+ * Subscribe to live content changes (server-sent events).
+ * handlers: { onInsert, onUpdate, onDelete, onReset } each receiving the event data.
+ * Returns a function that closes the stream.
+ */
+export const subscribeToContentStream = (clientId = 'all', handlers = {}) => {
+  const url = clientId === 'all'
+    ? `${API_BASE_URL}/api/content/stream`
+    : `${API_BASE_URL}/api/content/stream?client_id=${clientId}`;
+  const source = new EventSource(url);
+  const listen = (type, handler) => {
+    if (!handler) return;
+    source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+  };
+  listen('insert', handlers.onInsert);
+  listen('update', handlers.onUpdate);
+  listen('delete', handlers.onDelete);
+  listen('reset', handlers.onReset);
+  return () => source.close();
+};
+
 /**
  * Approve content
  */
 export const approveContent = async (contentId) => {
   try {
+    // Approving the same item twice (double click, retry) must not schedule it twice
     const response = await fetch(`${API_BASE_URL}/api/content/${contentId}/approve`, {
-      method: 'POST'
+      method: 'POST',
+      headers: {
+        'Idempotency-Key': `approve-${contentId}`
+      }
     });
     const data = await response.json();
     if (!data.success) {
@@ -229,11 +258,19 @@ export const getDashboardStats = async () => {
 };
 
 /**
- * Get campaigns
+ * Get campaigns, filtered and sorted on the server
+ * @param {Object} filters - client_id, platform, status, date_from, date_to, sort, order, page, page_size
  */
-export const getCampaigns = async () => {
+export const getCampaigns = async (filters = {}) => {
   try {
-    const response = await fetch(`${API_BASE_URL}/api/campaigns`);
+    const params = new URLSearchParams();
+    Object.entries(filters).forEach(([key, value]) => {
+      if (value !== undefined && value !== null && value !== '' && value !== 'all') {
+        params.append(key, value);
+      }
+    });
+    const query = params.toString();
+    const response = await fetch(`${API_BASE_URL}/api/campaigns${query ? `?${query}` : ''}`);
     const data = await response.json();
     return data;
   } catch (error) {
@@ -241,6 +278,19 @@ export const getCampaigns = async () => {
   }
 };
 
+/**
+ * Get per-client campaign summaries (campaigns, active, budget, impressions, clicks, CTR)
+ */
+export const getCampaignSummaries = async () => {
+  try {
+    const response = await fetch(`${API_BASE_URL}/api/campaigns/summaries`);
+    const data = await response.json();
+    return data;
+  } catch (error) {
+    throw new Error('Failed to fetch campaign summaries');
+  }
+};
+
 /**
  * Create campaign
  */